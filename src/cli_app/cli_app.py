@@ -1,15 +1,13 @@
-from src.file_service import RawFileService, SignedFileService, EncryptedFileService
+from src.file_service import create_backend, create_file_service, reconcile_if_empty
 from src.config import Config
 
 
 class ConsoleApp:
     def __init__(self, directory):
-        self.raw_file_service = RawFileService(directory)
-        self.file_service = self.raw_file_service
-        if Config().is_encrypted():
-            self.file_service = EncryptedFileService(self.file_service)
-        if Config().is_signed():
-            self.file_service = SignedFileService(self.file_service)
+        Config().set_storage_root(directory)
+        reconcile_if_empty(directory)
+        self.raw_file_service = create_backend(directory)
+        self.file_service = create_file_service(self.raw_file_service)
 
     def read(self):
         filename = input('Enter file name: ')
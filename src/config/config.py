@@ -1,10 +1,18 @@
 import configparser
+import os
 from src.utils import Singleton
 
 
 class Config(metaclass=Singleton):
     SIGNATURE_SECTION = "Signature"
     CRYPTO = "Encryption"
+    SERVER = "Server"
+    EXECUTOR = "Executor"
+    SESSION_CACHE = "SessionCache"
+    STORAGE = "Storage"
+    READ_CACHE = "ReadCache"
+    SIDECAR_GC = "SidecarGC"
+    COMPRESSION = "Compression"
 
     def __init__(self, filename=None):
         self.filename = filename
@@ -13,6 +21,7 @@ class Config(metaclass=Singleton):
             self.load(self.filename)
 
     def load(self, filename):
+        self.filename = filename
         try:
             self.config_data = configparser.ConfigParser()
             self.config_data.read(filename)
@@ -26,6 +35,17 @@ class Config(metaclass=Singleton):
                 value = self.config_data[section][param]
         return value
 
+    def set_param(self, section, param, value):
+        if section not in self.config_data:
+            self.config_data[section] = {}
+        self.config_data[section][param] = value
+
+    def storage_root(self):
+        return self.get_param(Config.STORAGE, "root", "")
+
+    def set_storage_root(self, root):
+        self.set_param(Config.STORAGE, "root", os.path.abspath(root))
+
     def is_encrypted(self):
         param = self.get_param(Config.CRYPTO, "enabled", "false")
         if param == "true":
@@ -40,14 +60,171 @@ class Config(metaclass=Singleton):
         else:
             return False
 
+    def is_compressed(self):
+        param = self.get_param(Config.COMPRESSION, "enabled", "false")
+        if param == "true":
+            return True
+        else:
+            return False
+
+    def compression_codec(self):
+        return self.get_param(Config.COMPRESSION, "codec", "auto")
+
+    def compression_level(self):
+        return int(self.get_param(Config.COMPRESSION, "level", 6))
+
+    def compression_min_size(self):
+        return int(self.get_param(Config.COMPRESSION, "min_size", 512))
+
+    def compression_lzma_min_size(self):
+        return int(self.get_param(Config.COMPRESSION, "lzma_min_size", 1024 * 1024))
+
+    def compression_max_entropy(self):
+        return float(self.get_param(Config.COMPRESSION, "max_entropy", 7.5))
+
+    def compressed_path(self):
+        return os.path.join(self.storage_root(), self.get_param(Config.COMPRESSION, "marker_path", ".compressed"))
+
     def signature_algo(self):
         return self.get_param(Config.SIGNATURE_SECTION, "signature_algo", "md5")
 
     def key_path(self):
-        return self.get_param(Config.CRYPTO, "key_path", ".")
+        return os.path.join(self.storage_root(), self.get_param(Config.CRYPTO, "key_path", "."))
 
     def sig_path(self):
-        return self.get_param(Config.SIGNATURE_SECTION, "sig_path", ".")
+        return os.path.join(self.storage_root(), self.get_param(Config.SIGNATURE_SECTION, "sig_path", "."))
+
+    def backend(self):
+        return self.get_param(Config.STORAGE, "backend", "files")
+
+    def pack_path(self):
+        return os.path.join(self.storage_root(), self.get_param(Config.STORAGE, "pack_path", ".packs"))
+
+    def pack_segment_size(self):
+        return int(self.get_param(Config.STORAGE, "pack_segment_size", 64 * 1024 * 1024))
+
+    def pack_checkpoint_interval(self):
+        return int(self.get_param(Config.STORAGE, "pack_checkpoint_interval", 1000))
+
+    def pack_compact_ratio(self):
+        return float(self.get_param(Config.STORAGE, "pack_compact_ratio", 0.5))
+
+    def pack_compact_interval(self):
+        return float(self.get_param(Config.STORAGE, "pack_compact_interval", 10))
+
+    def is_deduplicated(self):
+        param = self.get_param(Config.STORAGE, "dedup", "false")
+        if param == "true":
+            return True
+        else:
+            return False
+
+    def objects_path(self):
+        return os.path.join(self.storage_root(), self.get_param(Config.STORAGE, "objects_path", "objects"))
+
+    def shard_depth(self):
+        return int(self.get_param(Config.STORAGE, "shard_depth", 0))
+
+    def shard_width(self):
+        return int(self.get_param(Config.STORAGE, "shard_width", 2))
+
+    def fsync_policy(self):
+        return self.get_param(Config.STORAGE, "fsync", "group-commit")
+
+    def group_commit_window(self):
+        return float(self.get_param(Config.STORAGE, "group_commit_window", 0.002))
+
+    def is_indexed(self):
+        param = self.get_param(Config.STORAGE, "index", "false")
+        if param == "true":
+            return True
+        else:
+            return False
+
+    def index_path(self):
+        return os.path.join(self.storage_root(), self.get_param(Config.STORAGE, "index_path", ".metadata.sqlite"))
+
+    def mmap_threshold(self):
+        return int(self.get_param(Config.STORAGE, "mmap_threshold", 1024 * 1024))
 
     def encryption_type(self):
         return self.get_param(Config.CRYPTO, "encryption_type", "aes")
+
+    def encryption_chunk_size(self):
+        return int(self.get_param(Config.CRYPTO, "chunk_size", 64 * 1024))
+
+    def data_key_lifetime(self):
+        return float(self.get_param(Config.CRYPTO, "data_key_lifetime", 3600))
+
+    def data_key_cache_size(self):
+        return int(self.get_param(Config.CRYPTO, "data_key_cache_size", 1024))
+
+    def keystore(self):
+        return self.get_param(Config.CRYPTO, "keystore", "files")
+
+    def keystore_path(self):
+        return os.path.join(self.key_path(), self.get_param(Config.CRYPTO, "keystore_path", ".keys.sqlite"))
+
+    def keystore_cache_size(self):
+        return int(self.get_param(Config.CRYPTO, "keystore_cache_size", 10000))
+
+    def keystore_batch_window(self):
+        return float(self.get_param(Config.CRYPTO, "keystore_batch_window", 0.002))
+
+    def chunk_size(self):
+        return int(self.get_param(Config.SERVER, "chunk_size", 64 * 1024))
+
+    def max_sessions(self):
+        return int(self.get_param(Config.SERVER, "max_sessions", 10000))
+
+    def session_dirs_path(self):
+        return os.path.join(self.storage_root(), self.get_param(Config.SERVER, "session_dirs_path", ".sessions.sqlite"))
+
+    def max_body_size(self):
+        return int(self.get_param(Config.SERVER, "max_body_size", 1024 * 1024 * 1024))
+
+    def io_workers(self):
+        return int(self.get_param(Config.EXECUTOR, "io_workers", 16))
+
+    def io_backlog(self):
+        return int(self.get_param(Config.EXECUTOR, "io_backlog", 256))
+
+    def db_workers(self):
+        return int(self.get_param(Config.EXECUTOR, "db_workers", 4))
+
+    def cpu_workers(self):
+        return int(self.get_param(Config.EXECUTOR, "cpu_workers", 0))
+
+    def parallel_threshold(self):
+        return int(self.get_param(Config.EXECUTOR, "parallel_threshold", 4 * 1024 * 1024))
+
+    def parallel_segment_size(self):
+        return int(self.get_param(Config.EXECUTOR, "parallel_segment_size", 1024 * 1024))
+
+    def session_cache_size(self):
+        return int(self.get_param(Config.SESSION_CACHE, "size", 10000))
+
+    def session_cache_ttl(self):
+        return float(self.get_param(Config.SESSION_CACHE, "ttl", 60))
+
+    def read_cache_size(self):
+        return int(self.get_param(Config.READ_CACHE, "size", 64 * 1024 * 1024))
+
+    def read_cache_max_file_size(self):
+        return int(self.get_param(Config.READ_CACHE, "max_file_size", 4 * 1024 * 1024))
+
+    def is_gc_enabled(self):
+        param = self.get_param(Config.SIDECAR_GC, "enabled", "false")
+        if param == "true":
+            return True
+        else:
+            return False
+
+    def gc_batch_size(self):
+        return int(self.get_param(Config.SIDECAR_GC, "batch_size", 100))
+
+    def gc_interval(self):
+        return float(self.get_param(Config.SIDECAR_GC, "interval", 1.0))
+
+    def gc_min_age(self):
+        return float(self.get_param(Config.SIDECAR_GC, "min_age", 3600))
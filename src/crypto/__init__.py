@@ -1,2 +1,3 @@
 from .signature import SignatureFactory, Signature
 from .encryption import Encryption
+from .keyring import Keyring
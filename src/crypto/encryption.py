@@ -1,16 +1,39 @@
 from abc import ABCMeta, abstractmethod
 from Crypto import Random
-from Crypto.Cipher import AES, PKCS1_OAEP
-from Crypto.PublicKey import RSA
+from Crypto.Cipher import AES
+from itertools import chain
 from src.config import Config
-from src.utils import generate_random
+from src.executor import Executor
+from .keyring import Keyring
 from typing import Tuple
 import os
+import struct
+
+# version of format, plain size of chunk, key
+CHUNKED_KEY = struct.Struct(">BI16s")
+CHUNKED = 2
+# nonce, tag and key of single EAX message, format of earlier versions
+LEGACY_KEY_SIZE = 48
+TAG_SIZE = 16
+# magic and size of wrapped data key, followed by wrapped data key, nonce, tag and encrypted key of file
+ENVELOPE = struct.Struct(">4sH")
+ENVELOPE_MAGIC = b"ENV1"
 
 
 class Encryption(metaclass=ABCMeta):
+    """
+    Base of encryption algorithms, implementations are registered by label and id of algorithm
+    and created once per process, they must keep no state of their own
+    """
 
     label = ""
+    algorithm = 0
+    _registry = {}
+    _instances = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        Encryption._registry[cls.label] = cls
 
     @property
     def key_path(self):
@@ -36,13 +59,59 @@ class Encryption(metaclass=ABCMeta):
         """
         raise NotImplemented
 
+    @abstractmethod
+    def encrypt_stream(self, chunks, on_key):
+        """
+        Encrypts chunks one by one with new key
+        :param chunks: iterable of bytes
+        :param on_key: callback taking key to decrypt data, called after the last chunk
+        :return: generator of encrypted chunks
+        """
+        raise NotImplemented
+
+    @abstractmethod
+    def decrypt_stream(self, chunks, key):
+        """
+        Decrypt chunks one by one, broken data raises after the last chunk
+        :param chunks: iterable of encrypted bytes
+        :param key: decryption key
+        :return: generator of decrypted chunks
+        """
+        raise NotImplemented
+
+    @abstractmethod
+    def decrypt_range(self, read, size, key, start, stop):
+        """
+        Decrypt only chunks covering byte range of data
+        :param read: function taking offset and length, returns encrypted bytes
+        :param size: size of encrypted data
+        :param key: decryption key
+        :param start: first byte of range
+        :param stop: byte after the last byte of range
+        :return: generator of decrypted bytes of range, None if format of data has no random access
+        """
+        raise NotImplemented
+
+    @abstractmethod
+    def plain_size(self, size, key):
+        """
+        :param size: size of encrypted data
+        :param key: decryption key
+        :return: size of decrypted data
+        """
+        raise NotImplemented
+
     @staticmethod
     def get_encryptor(filename):
+        """
+        Find encryptor of file by probing key files of every encryptor, for files without header and index entry
+        """
         current_encryptor = None
-        for encryptor in Encryption.__subclasses__():
-            if os.path.exists(encryptor().key_name(filename)):
+        for label in Encryption._registry:
+            encryptor = Encryption.get_encryptor_by_label(label)
+            if os.path.exists(encryptor.key_name(filename)):
                 if not current_encryptor:
-                    current_encryptor = encryptor()
+                    current_encryptor = encryptor
                 else:
                     raise Exception("More than one encryptor is found!")
         if current_encryptor:
@@ -52,12 +121,7 @@ class Encryption(metaclass=ABCMeta):
 
     @staticmethod
     def get_default_encryptor():
-        config = Config()
-        encryption_type = config.encryption_type()
-        if encryption_type == "aes":
-            return SymmetricEncryption()
-        elif encryption_type == "hybrid":
-            return HybridEncryption()
+        return Encryption.get_encryptor_by_label(Config().encryption_type())
 
     def key_name(self, filename):
         key_path = self.key_path
@@ -65,61 +129,276 @@ class Encryption(metaclass=ABCMeta):
 
     @staticmethod
     def get_encryptor_by_label(label):
-        for encryptor in Encryption.__subclasses__():
-            if encryptor().label == label:
-                return encryptor()
+        """
+        :param label: label of encryptor
+        :return: shared instance of encryptor, None if label is unknown
+        """
+        encryptor = Encryption._instances.get(label)
+        if encryptor is None and label in Encryption._registry:
+            encryptor = Encryption._instances.setdefault(label, Encryption._registry[label]())
+        return encryptor
+
+    @staticmethod
+    def get_encryptor_by_algorithm(algorithm):
+        """
+        :param algorithm: id of algorithm from header of encrypted data
+        :return: shared instance of encryptor, None if id is unknown
+        """
+        for label, encryptor_class in Encryption._registry.items():
+            if encryptor_class.algorithm == algorithm:
+                return Encryption.get_encryptor_by_label(label)
+        return None
 
 
 class SymmetricEncryption(Encryption):
+    """
+    AES-GCM over chunks of fixed plain size, every chunk has its own tag, so data is verified
+    chunk by chunk and any chunk can be decrypted alone. Nonce of chunk is its index, index and flag
+    of the last chunk are authenticated, so reordered or truncated chunks are detected.
+    Data of single EAX message written by earlier versions is told apart by size of its key
+    """
 
     label = "aes"
+    algorithm = 1
 
     def encrypt(self, data):
-        key = generate_random(16).encode()
-        aes = AES.new(key, AES.MODE_EAX)
-        encrypted_data, tag = aes.encrypt_and_digest(data.encode())
-        session_key = bytearray(aes.nonce)
-        session_key.extend(bytearray(tag))
-        session_key.extend(bytearray(key))
-        return encrypted_data, session_key
+        keys = []
+        encrypted_data = b"".join(self.encrypt_stream((data.encode() if isinstance(data, str) else data,),
+                                                      keys.append))
+        return encrypted_data, keys[0]
 
     def decrypt(self, encrypted_data, session_key):
-        n = 16
-        session_key = bytearray(session_key)
-        nonce, tag, session_key = [bytes(session_key[i:i + n]) for i in range(0, len(session_key), n)]
-        aes = AES.new(session_key, AES.MODE_EAX, nonce)
-        data = aes.decrypt_and_verify(encrypted_data, tag)
+        if len(session_key) == LEGACY_KEY_SIZE:
+            aes, tag = _cipher(session_key)
+            data = aes.decrypt_and_verify(encrypted_data, tag)
+        else:
+            data = b"".join(self.decrypt_stream((encrypted_data,), session_key))
         return data.decode()
 
+    def encrypt_stream(self, chunks, on_key):
+        chunk_size = Config().encryption_chunk_size()
+        key = Random.get_random_bytes(16)
+        yield from _seal_parallel(key, chunk_size, chunks)
+        on_key(bytearray(CHUNKED_KEY.pack(CHUNKED, chunk_size, key)))
+
+    def decrypt_stream(self, chunks, session_key):
+        if len(session_key) == LEGACY_KEY_SIZE:
+            aes, tag = _cipher(session_key)
+            for chunk in chunks:
+                yield aes.decrypt(chunk)
+            aes.verify(tag)
+            return
+        chunk_size, key = _chunked_key(session_key)
+        yield from _open(key, chunk_size, chunks)
+
+    def decrypt_range(self, read, size, session_key, start, stop):
+        if len(session_key) == LEGACY_KEY_SIZE:
+            return None
+        chunk_size, key = _chunked_key(session_key)
+        sealed_size = chunk_size + TAG_SIZE
+        first, last = start // chunk_size, max(stop - 1, start) // chunk_size
+        sealed = (read(index * sealed_size, sealed_size) for index in range(first, last + 1))
+        chunks = _open(key, chunk_size, sealed, first, _chunk_count(size, sealed_size) - 1)
+        return _slice(chunks, start - first * chunk_size, stop - start)
+
+    def plain_size(self, size, session_key):
+        if len(session_key) == LEGACY_KEY_SIZE:
+            return size
+        chunk_size, _ = _chunked_key(session_key)
+        return size - _chunk_count(size, chunk_size + TAG_SIZE) * TAG_SIZE
+
 
 class HybridEncryption(Encryption):
+    """
+    Envelope encryption, key of file is encrypted by data key of current epoch and stored with data key
+    wrapped by master RSA key. Keys encrypted by master key directly, written by earlier versions, are still read
+    """
 
     label = "hybrid"
+    algorithm = 2
 
-    def __init__(self):
-        self.symmetric_encryption = SymmetricEncryption()
-        key_path = self.key_path
-        self.pem_key_path = os.path.join(key_path, "key.pem")
-        self._rsa_key = None
+    @property
+    def symmetric_encryption(self):
+        return Encryption.get_encryptor_by_label(SymmetricEncryption.label)
+
+    @property
+    def pem_key_path(self):
+        return os.path.abspath(os.path.join(self.key_path, "key.pem"))
 
     @property
     def rsa_key(self):
-        if os.path.exists(self.pem_key_path):
-            with open(self.pem_key_path) as key:
-                self._rsa_key = RSA.import_key(key.read())
-        else:
-            random_generator = Random.new().read
-            self._rsa_key = RSA.generate(1024, random_generator)
-            with open(self.pem_key_path, "w") as file:
-                file.write(self._rsa_key.export_key("PEM").decode())
-        return PKCS1_OAEP.new(self._rsa_key)
+        return Keyring().master(self.pem_key_path)
 
     def encrypt(self, data):
         encrypted_data, session_key = self.symmetric_encryption.encrypt(data)
-        session_key = self.rsa_key.encrypt(session_key)
-        return encrypted_data, session_key
+        return encrypted_data, self._wrap(session_key)
 
     def decrypt(self, encrypted_data, session_key):
-        session_key = self.rsa_key.decrypt(bytearray(session_key))
-        data = self.symmetric_encryption.decrypt(encrypted_data, session_key)
-        return data
+        return self.symmetric_encryption.decrypt(encrypted_data, self._unwrap(session_key))
+
+    def encrypt_stream(self, chunks, on_key):
+        return self.symmetric_encryption.encrypt_stream(chunks, lambda key: on_key(self._wrap(key)))
+
+    def decrypt_stream(self, chunks, session_key):
+        return self.symmetric_encryption.decrypt_stream(chunks, self._unwrap(session_key))
+
+    def decrypt_range(self, read, size, session_key, start, stop):
+        return self.symmetric_encryption.decrypt_range(read, size, self._unwrap(session_key), start, stop)
+
+    def plain_size(self, size, session_key):
+        return self.symmetric_encryption.plain_size(size, self._unwrap(session_key))
+
+    def _wrap(self, session_key):
+        data_key = Keyring().data_key(self.rsa_key)
+        nonce = Random.get_random_bytes(12)
+        aes = AES.new(data_key.key, AES.MODE_GCM, nonce=nonce)
+        encrypted_key, tag = aes.encrypt_and_digest(bytes(session_key))
+        return bytearray(ENVELOPE.pack(ENVELOPE_MAGIC, len(data_key.wrapped)) + data_key.wrapped + nonce + tag
+                         + encrypted_key)
+
+    def _unwrap(self, session_key):
+        session_key = bytes(session_key)
+        if session_key[:len(ENVELOPE_MAGIC)] != ENVELOPE_MAGIC:
+            return self.rsa_key.decrypt(bytearray(session_key))
+        _, wrapped_size = ENVELOPE.unpack(session_key[:ENVELOPE.size])
+        wrapped_end = ENVELOPE.size + wrapped_size
+        wrapped, nonce, tag = (session_key[ENVELOPE.size:wrapped_end], session_key[wrapped_end:wrapped_end + 12],
+                               session_key[wrapped_end + 12:wrapped_end + 12 + TAG_SIZE])
+        aes = AES.new(Keyring().unwrap(self.rsa_key, wrapped), AES.MODE_GCM, nonce=nonce)
+        return aes.decrypt_and_verify(session_key[wrapped_end + 12 + TAG_SIZE:], tag)
+
+
+def _session_key(nonce, tag, key):
+    session_key = bytearray(nonce)
+    session_key.extend(bytearray(tag))
+    session_key.extend(bytearray(key))
+    return session_key
+
+
+def _cipher(session_key):
+    n = 16
+    session_key = bytearray(session_key)
+    nonce, tag, session_key = [bytes(session_key[i:i + n]) for i in range(0, len(session_key), n)]
+    return AES.new(session_key, AES.MODE_EAX, nonce), tag
+
+
+def _chunked_key(session_key):
+    if len(session_key) != CHUNKED_KEY.size:
+        raise ValueError("Unknown format of key")
+    version, chunk_size, key = CHUNKED_KEY.unpack(bytes(session_key))
+    if version != CHUNKED:
+        raise ValueError(f"Unknown version of format: {version}")
+    return chunk_size, key
+
+
+def _chunk_count(size, sealed_size):
+    # empty data is one empty chunk
+    return max(-(-size // sealed_size), 1)
+
+
+def _chunk_cipher(key, index, last):
+    aes = AES.new(key, AES.MODE_GCM, nonce=index.to_bytes(12, "big"))
+    aes.update(struct.pack(">Q?", index, last))
+    return aes
+
+
+def _seal(key, chunk_size, chunks, index=0, last=True):
+    """
+    Regroup data into chunks of chunk_size and encrypt them, chunk is sealed only when the next data
+    arrives, so the last chunk is known
+
+    :param index: index of the first chunk
+    :param last: False if data goes on after chunks, their final chunk is not the last one then
+    :return: generator of encrypted chunks followed by their tags
+    """
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) > chunk_size:
+            encrypted_data, tag = _chunk_cipher(key, index, False).encrypt_and_digest(bytes(buffer[:chunk_size]))
+            yield encrypted_data + tag
+            del buffer[:chunk_size]
+            index += 1
+    encrypted_data, tag = _chunk_cipher(key, index, last).encrypt_and_digest(bytes(buffer))
+    yield encrypted_data + tag
+
+
+def _seal_parallel(key, chunk_size, chunks):
+    """
+    Encrypt data on all workers of the process pool, chunks are independent, so segments of whole chunks
+    are sealed in parallel and the result is the same as of _seal. Data below parallel threshold is sealed inline
+
+    :return: generator of encrypted chunks followed by their tags
+    """
+    executor = Executor()
+    chunks = iter(chunks)
+    head, length = [], 0
+    if executor.cpu_pool is not None:
+        for chunk in chunks:
+            head.append(chunk)
+            length += len(chunk)
+            if executor.parallel(length):
+                break
+    chunks = chain(head, chunks)
+    if not executor.parallel(length):
+        yield from _seal(key, chunk_size, chunks)
+        return
+    segment_size = max(Config().parallel_segment_size() // chunk_size, 1) * chunk_size
+    yield from executor.map_cpu(_seal_segment, _segments(key, chunk_size, segment_size, chunks))
+
+
+def _segments(key, chunk_size, segment_size, chunks):
+    """
+    :return: generator of arguments of _seal_segment, segment is a whole number of chunks, except the last one
+    """
+    index, buffer = 0, bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) > segment_size:
+            yield key, chunk_size, index, bytes(buffer[:segment_size]), False
+            del buffer[:segment_size]
+            index += segment_size // chunk_size
+    yield key, chunk_size, index, bytes(buffer), True
+
+
+def _seal_segment(key, chunk_size, index, data, last):
+    # picklable for the process pool
+    return b"".join(_seal(key, chunk_size, (data,), index, last))
+
+
+def _open(key, chunk_size, chunks, index=0, last=None):
+    """
+    Decrypt and verify encrypted chunks
+
+    :param index: index of the first chunk
+    :param last: index of the last chunk of data, None if chunks go to the end of data
+    :return: generator of decrypted chunks, broken chunk raises before its data is returned
+    """
+    sealed_size = chunk_size + TAG_SIZE
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) > sealed_size:
+            yield _open_chunk(key, index, index == last, buffer[:sealed_size])
+            del buffer[:sealed_size]
+            index += 1
+    yield _open_chunk(key, index, last is None or index == last, buffer)
+
+
+def _open_chunk(key, index, last, sealed):
+    if len(sealed) < TAG_SIZE:
+        raise ValueError("MAC check failed")
+    return _chunk_cipher(key, index, last).decrypt_and_verify(bytes(sealed[:-TAG_SIZE]), bytes(sealed[-TAG_SIZE:]))
+
+
+def _slice(chunks, skip, length):
+    for chunk in chunks:
+        if skip >= len(chunk):
+            skip -= len(chunk)
+            continue
+        piece = chunk[skip:skip + length]
+        skip = 0
+        length -= len(piece)
+        yield piece
+        if length <= 0:
+            return
@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict, namedtuple
+from Crypto import Random
+from Crypto.Cipher import PKCS1_OAEP
+from Crypto.PublicKey import RSA
+from src.config import Config
+from src.metrics import Counter
+from src.utils import Singleton
+
+MASTER_KEY_OPERATIONS = Counter("keyring_master_key_operations_total",
+                                "RSA operations of master key of hybrid encryption", ("operation",))
+
+DataKey = namedtuple("DataKey", ("key", "wrapped", "created"))
+
+
+class Keyring(metaclass=Singleton):
+    """
+    Process-wide keys of hybrid encryption. Master RSA key is loaded from pem file once.
+    Files are encrypted under data keys, data key is wrapped by master key once and used
+    by all files of its epoch, a new one is made when the epoch is over or on rotate.
+    Unwrapped data keys are cached, so RSA runs once per epoch instead of once per file
+    """
+
+    def __init__(self):
+        self.lifetime = Config().data_key_lifetime()
+        self.cache_size = Config().data_key_cache_size()
+        self._masters = {}
+        # state is kept per master key object, so keys of a replaced master are never mixed in
+        self._current = weakref.WeakKeyDictionary()
+        self._unwrapped = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def master(self, pem_path):
+        """
+        Get master key, it is generated on first use
+
+        :param pem_path: path of pem file of master key
+        :return: PKCS1_OAEP cipher of master key
+        """
+        pem_path = os.path.abspath(pem_path)
+        with self._lock:
+            master = self._masters.get(pem_path)
+            if master is None:
+                master = self._masters[pem_path] = PKCS1_OAEP.new(_load_or_generate(pem_path))
+            return master
+
+    def data_key(self, master):
+        """
+        Get data key of current epoch
+
+        :param master: cipher of master key
+        :return: DataKey
+        """
+        with self._lock:
+            data_key = self._current.get(master)
+            if data_key is not None and time.monotonic() - data_key.created < self.lifetime:
+                return data_key
+        key = Random.get_random_bytes(16)
+        wrapped = bytes(master.encrypt(key))
+        MASTER_KEY_OPERATIONS.labels("wrap").inc()
+        data_key = DataKey(key, wrapped, time.monotonic())
+        with self._lock:
+            self._current[master] = data_key
+            self._remember(master, wrapped, key)
+        return data_key
+
+    def unwrap(self, master, wrapped):
+        """
+        Get data key wrapped by master key
+
+        :param master: cipher of master key
+        :param wrapped: wrapped data key
+        :return: data key
+        """
+        wrapped = bytes(wrapped)
+        with self._lock:
+            keys = self._unwrapped.get(master)
+            if keys is not None and wrapped in keys:
+                keys.move_to_end(wrapped)
+                return keys[wrapped]
+        key = bytes(master.decrypt(wrapped))
+        MASTER_KEY_OPERATIONS.labels("unwrap").inc()
+        with self._lock:
+            self._remember(master, wrapped, key)
+        return key
+
+    def _remember(self, master, wrapped, key):
+        keys = self._unwrapped.setdefault(master, OrderedDict())
+        keys[wrapped] = key
+        while len(keys) > self.cache_size:
+            keys.popitem(last=False)
+
+    def rotate(self):
+        """
+        End current epoch, the next encrypted file gets a new data key. Old data keys still decrypt their files
+        """
+        with self._lock:
+            self._current.clear()
+
+
+def _load_or_generate(pem_path):
+    try:
+        with open(pem_path) as key:
+            return RSA.import_key(key.read())
+    except FileNotFoundError:
+        pass
+    rsa_key = RSA.generate(1024, Random.new().read)
+    temp = f"{pem_path}.{os.getpid()}.tmp"
+    with open(temp, "w") as file:
+        file.write(rsa_key.export_key("PEM").decode())
+    try:
+        # link fails if another process was first, its key wins
+        os.link(temp, pem_path)
+    except FileExistsError:
+        with open(pem_path) as key:
+            rsa_key = RSA.import_key(key.read())
+    finally:
+        os.remove(temp)
+    return rsa_key
@@ -1,6 +1,15 @@
 import hashlib
 import os
+from collections import deque
 from src.config import Config
+from src.executor import Executor
+
+# size of leaf of tree hash, it is part of signature format and can not be configured
+TREE_SEGMENT_SIZE = 1024 * 1024
+
+
+def _to_bytes(data):
+    return data.encode() if isinstance(data, str) else data
 
 
 class SignatureFactory(type):
@@ -11,11 +20,18 @@ class SignatureFactory(type):
         signer_class = type(classname, parents, attributes)
         if "label" not in attributes:
             signer_class.label = classname.lower()
+        Signature._registry[signer_class.label] = signer_class
         return signer_class
 
 
 class Signature:
+    """
+    Base of signers, implementations are registered by label and created once per process,
+    they must keep no state of their own
+    """
     label = ""
+    _registry = {}
+    _instances = {}
 
     @property
     def sig_path(self):
@@ -23,11 +39,15 @@ class Signature:
 
     @staticmethod
     def get_signer(filename):
+        """
+        Find signer of file by probing sig files of every signer, for files without index entry
+        """
         current_signer = None
-        for signer in Signature.__subclasses__():
-            if os.path.exists(signer().sig_filename(filename)):
+        for label in Signature._registry:
+            signer = Signature.get_signer_by_label(label)
+            if os.path.exists(signer.sig_filename(filename)):
                 if not current_signer:
-                    current_signer = signer()
+                    current_signer = signer
                 else:
                     raise Exception("More than one signer is found!")
         if current_signer:
@@ -41,9 +61,46 @@ class Signature:
 
     @staticmethod
     def get_signer_by_label(label):
-        for signer in Signature.__subclasses__():
-            if signer().label == label:
-                return signer()
+        """
+        :param label: label of signer
+        :return: shared instance of signer, None if label is unknown
+        """
+        signer = Signature._instances.get(label)
+        if signer is None and label in Signature._registry:
+            signer = Signature._instances.setdefault(label, Signature._registry[label]())
+        return signer
+
+    def hasher(self):
+        return hashlib.new(type(self).label)
+
+    def sign_stream(self, chunks, on_signature):
+        """
+        Pass chunks through and sign them on the way
+
+        :param chunks: iterable of bytes
+        :param on_signature: callback taking signature, called after the last chunk
+        :return: generator of the same chunks
+        """
+        hasher = self.hasher()
+        for chunk in chunks:
+            hasher.update(chunk)
+            yield chunk
+        on_signature(hasher.hexdigest())
+
+    def verify_stream(self, chunks, signature):
+        """
+        Pass chunks through and check them against signature, broken file raises after the last chunk
+
+        :param chunks: iterable of bytes
+        :param signature: expected signature
+        :return: generator of the same chunks
+        """
+        hasher = self.hasher()
+        for chunk in chunks:
+            hasher.update(chunk)
+            yield chunk
+        if hasher.hexdigest() != signature:
+            raise Exception("File is Broken")
 
     def sig_filename(self, filename):
         sig_path = self.sig_path
@@ -54,18 +111,93 @@ class MD5Signature(Signature, metaclass=SignatureFactory):
     label = "md5"
 
     def __call__(self, data):
-        return hashlib.md5(data.encode()).hexdigest()
+        return hashlib.md5(_to_bytes(data)).hexdigest()
 
 
 class Sha512Signer(Signature, metaclass=SignatureFactory):
     label = "sha512"
 
     def __call__(self, data):
-        return hashlib.sha512(data.encode()).hexdigest()
+        return hashlib.sha512(_to_bytes(data)).hexdigest()
 
 
 class Sha256Signer(Signature, metaclass=SignatureFactory):
     label = "sha256"
 
     def __call__(self, data):
-        return hashlib.sha256(data.encode()).hexdigest()
+        return hashlib.sha256(_to_bytes(data)).hexdigest()
+
+
+class Sha256TreeSigner(Signature, metaclass=SignatureFactory):
+    """
+    Sha256 tree hash, leaves are hashes of segments of fixed size and root is hash of leaves and size of data.
+    Leaves of big data are hashed on all workers of the process pool
+    """
+    label = "sha256tree"
+
+    def __call__(self, data):
+        hasher = self.hasher()
+        hasher.update(_to_bytes(data))
+        return hasher.hexdigest()
+
+    def hasher(self):
+        return TreeHasher()
+
+
+class TreeHasher:
+    """
+    Hasher of Sha256TreeSigner, with update and hexdigest of hashlib hashers.
+    Leaves are hashed inline until size of data reaches parallel threshold
+    """
+
+    def __init__(self):
+        self._executor = Executor()
+        self._window = max(2 * self._executor.cpu_workers, 1)
+        self._buffer = bytearray()
+        self._size = 0
+        # digests of leaves, or futures of ones hashed by the process pool
+        self._leaves = []
+        self._pending = deque()
+
+    def update(self, data):
+        data = memoryview(data)
+        self._size += len(data)
+        if self._buffer:
+            missing = TREE_SEGMENT_SIZE - len(self._buffer)
+            self._buffer += data[:missing]
+            data = data[missing:]
+            if len(self._buffer) < TREE_SEGMENT_SIZE:
+                return
+            self._leaf(bytes(self._buffer))
+            self._buffer = bytearray()
+        while len(data) >= TREE_SEGMENT_SIZE:
+            self._leaf(bytes(data[:TREE_SEGMENT_SIZE]))
+            data = data[TREE_SEGMENT_SIZE:]
+        self._buffer += data
+
+    def hexdigest(self):
+        leaves = list(self._leaves)
+        if self._buffer or not leaves:
+            leaves.append(_leaf_digest(bytes(self._buffer)))
+        root = hashlib.sha256(b"\x01" + self._size.to_bytes(8, "big"))
+        for leaf in leaves:
+            root.update(leaf if isinstance(leaf, bytes) else leaf.result())
+        return root.hexdigest()
+
+    def _leaf(self, segment):
+        if self._executor.parallel(self._size):
+            future = self._executor.submit_cpu(_leaf_digest, segment)
+            self._leaves.append(future)
+            self._pending.append(future)
+            # at most a window of segments waits for workers
+            while len(self._pending) > self._window:
+                self._pending.popleft().result()
+        else:
+            self._leaves.append(_leaf_digest(segment))
+
+
+def _leaf_digest(segment):
+    # picklable for the process pool, prefixes tell leaves from root
+    hasher = hashlib.sha256(b"\x00")
+    hasher.update(segment)
+    return hasher.digest()
@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+from src.crypto import Encryption, Signature
+from .executor import Executor
+
+SIZES = tuple(2 ** power * 1024 for power in range(6, 15, 2))
+
+
+def crossover(sizes=SIZES, repeat=3):
+    """
+    Time encryption and tree hashing of payloads of growing size, inline and split between workers of the process pool,
+    the size where parallel run gets faster is a starting point for parallel threshold
+
+    :param sizes: sizes of payloads in bytes
+    :param repeat: count of runs, the best one is taken
+    :return: list of tuples (operation, size, inline seconds, parallel seconds)
+    """
+    executor = Executor()
+    if executor.cpu_pool is None:
+        raise ValueError("Process pool is disabled, set cpu_workers")
+    operations = (("aes", Encryption.get_encryptor_by_label("aes").encrypt),
+                  ("sha256tree", Signature.get_signer_by_label("sha256tree")))
+    threshold = executor.parallel_threshold
+    results = []
+    try:
+        for name, operation in operations:
+            for size in sizes:
+                data = os.urandom(size)
+                timings = []
+                for parallel_threshold in (sys.maxsize, 0):
+                    executor.parallel_threshold = parallel_threshold
+                    timings.append(_best(operation, data, repeat))
+                results.append((name, size, *timings))
+    finally:
+        executor.parallel_threshold = threshold
+    return results
+
+
+def crossover_size(results, name):
+    """
+    :param results: result of crossover
+    :param name: name of operation
+    :return: the smallest size from which parallel run is faster than inline one for all bigger sizes,
+        None if it is not faster for the biggest size
+    """
+    found = None
+    for operation, size, inline, parallel in sorted(results, key=lambda result: result[1], reverse=True):
+        if operation != name:
+            continue
+        if parallel >= inline:
+            break
+        found = size
+    return found
+
+
+def _best(operation, data, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        operation(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
@@ -0,0 +1,99 @@
+import asyncio
+import functools
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from src.config import Config
+from src.utils import Singleton
+
+
+class Executor(metaclass=Singleton):
+    """
+    Worker pools used to keep blocking work off the event loop:
+    threads for disk I/O, threads for database queries and processes for crypto
+    """
+
+    def __init__(self):
+        config = Config()
+        self.io_pool = ThreadPoolExecutor(max_workers=config.io_workers(), thread_name_prefix="io")
+        self.db_pool = ThreadPoolExecutor(max_workers=config.db_workers(), thread_name_prefix="db")
+        self.cpu_workers = config.cpu_workers()
+        self.cpu_pool = ProcessPoolExecutor(max_workers=self.cpu_workers) if self.cpu_workers > 0 else None
+        self.parallel_threshold = config.parallel_threshold()
+
+    async def run_io(self, func, *args, **kwargs):
+        """
+        Run blocking I/O function on the I/O thread pool
+
+        :param func: function to call
+        :return: function result
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.io_pool, functools.partial(func, *args, **kwargs))
+
+    async def run_db(self, func, *args, **kwargs):
+        """
+        Run blocking database function on the database thread pool
+
+        :param func: function to call
+        :return: function result
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.db_pool, functools.partial(func, *args, **kwargs))
+
+    def run_cpu(self, func, *args):
+        """
+        Run CPU heavy function on the process pool and wait for the result.
+        Function and arguments must be picklable. Runs inline if process pool is disabled.
+
+        :param func: function to call
+        :return: function result
+        """
+        if self.cpu_pool is None:
+            return func(*args)
+        return self.cpu_pool.submit(func, *args).result()
+
+    def submit_cpu(self, func, *args):
+        """
+        Start CPU heavy function on the process pool. Function and arguments must be picklable.
+        Runs inline if process pool is disabled, returned future is done then.
+
+        :param func: function to call
+        :return: Future of function result
+        """
+        if self.cpu_pool is not None:
+            return self.cpu_pool.submit(func, *args)
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as ex:
+            future.set_exception(ex)
+        return future
+
+    def map_cpu(self, func, args):
+        """
+        Run CPU heavy function over arguments on all workers of the process pool, results come in order.
+        Only two calls per worker are in flight, so arguments are not read ahead into memory
+
+        :param func: function to call
+        :param args: iterable of tuples of arguments
+        :return: generator of function results
+        """
+        window = max(2 * self.cpu_workers, 1)
+        pending = deque()
+        try:
+            for item in args:
+                pending.append(self.submit_cpu(func, *item))
+                if len(pending) > window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def parallel(self, size):
+        """
+        :param size: size of payload in bytes
+        :return: True if payload is big enough to be split between workers of the process pool
+        """
+        return self.cpu_pool is not None and size >= self.parallel_threshold
@@ -1,4 +1,14 @@
 from .raw_file_service import RawFileService, _to_dt
 from .signed_file_service import SignedFileService
 from .encrypted_file_service import EncryptedFileService
+from .cached_file_service import CachedFileService
+from .compressed_file_service import CompressedFileService
+from .read_cache import ReadCache
 from .file_service import FileService
+from .async_file_service import AsyncFileService, ThreadedFileService, AsyncRawFileService, create_async_file_services
+from .pack_file_service import PackFileService, open_pack_store, close_pack_stores
+from .factory import create_file_service, create_backend, reconcile_if_empty
+from .durability import Durability
+from .reshard import reshard
+from .sidecar_gc import SidecarCollector
+from .keystore import SqliteKeystore, migrate_key_files
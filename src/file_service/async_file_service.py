@@ -0,0 +1,264 @@
+from abc import ABCMeta, abstractmethod
+from itertools import islice
+from typing import AsyncIterable, AsyncIterator, Iterable, Optional, Union
+from src.executor import Executor
+from .durability import Durability
+from .streams import read_chunks
+import os
+
+
+class AsyncFileService(metaclass=ABCMeta):
+    """
+    Asynchronous counterpart of FileService for code running on event loop
+    """
+
+    @abstractmethod
+    async def read(self, filename: str) -> Optional[str]:
+        raise Exception("Not implemented")
+
+    @abstractmethod
+    async def create(self, data: str) -> Optional[str]:
+        raise Exception("Not implemented")
+
+    @abstractmethod
+    async def open_read(self, filename: str) -> AsyncIterator[bytes]:
+        raise Exception("Not implemented")
+
+    @abstractmethod
+    async def create_from_stream(self, chunks: Union[Iterable[bytes], AsyncIterable[bytes]]) -> Optional[str]:
+        raise Exception("Not implemented")
+
+    @abstractmethod
+    async def ls(self) -> Optional[list]:
+        raise Exception("Not implemented")
+
+    @abstractmethod
+    async def internal_paths(self) -> Optional[set]:
+        raise Exception("Not implemented")
+
+    @abstractmethod
+    async def cd(self, directory: str) -> Optional[bool]:
+        raise Exception("Not implemented")
+
+    @abstractmethod
+    async def remove(self, filename: str) -> Optional[bool]:
+        raise Exception("Not implemented")
+
+    @abstractmethod
+    async def read_metadata(self, filename: str) -> Optional[tuple]:
+        raise Exception("Not implemented")
+
+    @abstractmethod
+    async def get_permissions(self, filename: str) -> Optional[str]:
+        raise Exception("Not implemented")
+
+    @abstractmethod
+    async def set_permissions(self, filename: str, permissions: int) -> Optional[bool]:
+        raise Exception("Not implemented")
+
+    @abstractmethod
+    async def get_etag(self, filename: str) -> Optional[str]:
+        raise Exception("Not implemented")
+
+
+class ThreadedFileService(AsyncFileService):
+    """
+    Asynchronous file service running blocking calls of wrapped file service on the I/O thread pool.
+    Limiter bounds calls queued or running on the pool, further callers wait on event loop,
+    so slow disk pushes back on clients instead of growing the queue of the pool
+    """
+
+    def __init__(self, file_service, limiter):
+        """
+        :param file_service: synchronous file service
+        :param limiter: asyncio.Semaphore shared by file services of one event loop
+        """
+        self.file_service = file_service
+        self.limiter = limiter
+
+    @property
+    def workdir(self):
+        return self.file_service.workdir
+
+    async def run(self, func, *args):
+        """
+        Run blocking function on the I/O thread pool within the limit
+
+        :param func: function to call
+        :return: function result
+        """
+        async with self.limiter:
+            return await Executor().run_io(func, *args)
+
+    async def read(self, filename):
+        return await self.run(self.file_service.read, filename)
+
+    async def create(self, data):
+        return await self.run(self.file_service.create, data)
+
+    async def open_read(self, filename):
+        """
+        Open file for reading by chunks, every chunk is read on the I/O thread pool
+
+        :param filename: name of file
+        :return: async generator of bytes, it must be exhausted or closed
+        """
+        chunks = await self.run(self.file_service.open_read, filename)
+        return self._iterate(chunks)
+
+    async def open_range(self, filename, start, stop):
+        """
+        Open byte range of file for reading, see FileService.open_range
+
+        :return: async generator of bytes or None, generator must be exhausted or closed
+        """
+        chunks = await self.run(self.file_service.open_range, filename, start, stop)
+        if chunks is None:
+            return None
+        return self._iterate(chunks)
+
+    async def open_encoded(self, filename, encodings):
+        """
+        Open file for reading content as it is stored in one of accepted content codings, see FileService.open_encoded
+
+        :return: tuple (content coding, async generator of bytes) or None, generator must be exhausted or closed
+        """
+        encoded = await self.run(self.file_service.open_encoded, filename, encodings)
+        if encoded is None:
+            return None
+        encoding, chunks = encoded
+        return encoding, self._iterate(chunks)
+
+    async def content_size(self, filename):
+        return await self.run(self.file_service.content_size, filename)
+
+    async def _iterate(self, chunks):
+        try:
+            while True:
+                chunk = await self.run(next, chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            if hasattr(chunks, "close"):
+                await self.run(chunks.close)
+
+    async def create_from_stream(self, chunks):
+        """
+        Create file with unique file name from chunks. Async iterable, like body of upload, is spooled
+        to disk first, so no thread of the pool waits for slow client
+
+        :param chunks: iterable or async iterable of bytes
+        :return: unique filename
+        """
+        if not hasattr(chunks, "__aiter__"):
+            return await self.run(self.file_service.create_from_stream, chunks)
+        spool = await self.spool(chunks)
+        try:
+            return await self.run(self._create_from_spool, spool)
+        finally:
+            await self.run(_remove_if_exists, spool)
+
+    async def spool(self, chunks):
+        """
+        Write chunks to temporary file in working directory, every chunk is written by a short call on the pool
+
+        :param chunks: async iterable of bytes
+        :return: path of temporary file, caller removes it
+        """
+        fd, path = await self.run(Durability().temp, self.workdir, ".upload-")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                async for chunk in chunks:
+                    await self.run(file.write, chunk)
+        except BaseException:
+            await self.run(_remove_if_exists, path)
+            raise
+        return path
+
+    def _create_from_spool(self, spool):
+        chunks = read_chunks(spool)
+        try:
+            return self.file_service.create_from_stream(chunks)
+        finally:
+            chunks.close()
+
+    async def ls(self):
+        return await self.run(self.file_service.ls)
+
+    async def internal_paths(self):
+        return self.file_service.internal_paths()
+
+    async def cd(self, directory):
+        return await self.run(self.file_service.cd, directory)
+
+    async def remove(self, filename):
+        return await self.run(self.file_service.remove, filename)
+
+    async def read_metadata(self, filename):
+        return await self.run(self.file_service.read_metadata, filename)
+
+    async def get_permissions(self, filename):
+        return await self.run(self.file_service.get_permissions, filename)
+
+    async def set_permissions(self, filename, permissions):
+        return await self.run(self.file_service.set_permissions, filename, permissions)
+
+    async def get_etag(self, filename):
+        return await self.run(self.file_service.get_etag, filename)
+
+
+class AsyncRawFileService(ThreadedFileService):
+    """
+    Asynchronous raw file service, adds operations of RawFileService used by http server
+    """
+
+    @property
+    def on_disk(self):
+        return self.file_service.on_disk
+
+    async def get_path(self, filename):
+        return await self.run(self.file_service.get_path, filename)
+
+    async def create_from_file(self, path):
+        return await self.run(self.file_service.create_from_file, path)
+
+    async def metadata(self, filename):
+        return await self.run(self.file_service.metadata, filename)
+
+    async def scan(self, cursor, limit, details, hidden, batch_size):
+        """
+        List current directory in batches, see RawFileService.scan
+
+        :param batch_size: max count of entries in batch
+        :return: async generator of lists of entries, it must be exhausted or closed
+        """
+        entries = self.file_service.scan(cursor, limit, details, hidden)
+        try:
+            while True:
+                batch = await self.run(list, islice(entries, batch_size))
+                if not batch:
+                    return
+                yield batch
+        finally:
+            await self.run(entries.close)
+
+
+def _remove_if_exists(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def create_async_file_services(raw_file_service, file_service, limiter):
+    """
+    Wrap synchronous file services of one stack for use on event loop
+
+    :param raw_file_service: raw file service of the stack
+    :param file_service: top level file service of the stack
+    :param limiter: asyncio.Semaphore bounding calls on the I/O thread pool
+    :return: tuple (async raw file service, async top level file service), the same object if stack has no layers
+    """
+    async_raw_file_service = AsyncRawFileService(raw_file_service, limiter)
+    if file_service is raw_file_service:
+        return async_raw_file_service, async_raw_file_service
+    return async_raw_file_service, ThreadedFileService(file_service, limiter)
@@ -0,0 +1,138 @@
+from .durability import Durability
+from .streams import read_chunks
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import logging
+import os
+
+
+def hasher():
+    return hashlib.sha256()
+
+
+def digest(content):
+    """
+    Get content address of data
+
+    :param content: str or bytes
+    :return: hex digest
+    """
+    if isinstance(content, str):
+        content = content.encode()
+    return hashlib.sha256(content).hexdigest()
+
+
+def file_digest(path, chunk_size=64 * 1024):
+    """
+    Get content address of file without reading it into memory
+
+    :param path: path of file
+    :param chunk_size: size of read chunks
+    :return: hex digest
+    """
+    content_hasher = hasher()
+    for chunk in read_chunks(path, chunk_size):
+        content_hasher.update(chunk)
+    return content_hasher.hexdigest()
+
+
+class BlobStore:
+    """
+    Content addressed blobs, each blob is stored once under its digest with a count of references.
+    Count is kept in <blob>.refs, changes of blob and its count are serialized by flock on that file,
+    so several processes may share one store.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+
+    def blob_path(self, digest):
+        return os.path.join(self.path, digest[:2], digest)
+
+    def owns(self, path):
+        """
+        Check whether path is inside of the store
+
+        :param path: absolute path
+        :return: True, if path belongs to the store, else False
+        """
+        return path.startswith(self.path + os.sep)
+
+    def acquire(self, digest, write):
+        """
+        Add reference to blob, blob is written if it is new
+
+        :param digest: content address
+        :param write: callback taking temporary path, it writes the content there, called for new blob only
+        :return: absolute path of blob
+        """
+        blob = self.blob_path(digest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        with self._locked(blob) as refs:
+            count = _read_count(refs)
+            if not os.path.exists(blob):
+                logging.debug(f"Storing new blob: {blob}")
+                temp = f"{blob}.tmp"
+                try:
+                    write(temp)
+                    os.rename(temp, blob)
+                    Durability().sync_path(blob, os.path.dirname(blob))
+                except BaseException:
+                    if os.path.exists(temp):
+                        os.remove(temp)
+                    if not count:
+                        os.remove(refs.name)
+                    raise
+            _write_count(refs, count + 1)
+            # count must be on disk before reference is published
+            Durability().sync(refs.fileno())
+        return blob
+
+    def release(self, blob):
+        """
+        Drop reference to blob, blob is deleted with the last reference
+
+        :param blob: absolute path of blob
+        :return: True, if blob was deleted, else False
+        """
+        with self._locked(blob) as refs:
+            count = _read_count(refs) - 1
+            if count > 0:
+                _write_count(refs, count)
+                return False
+            logging.debug(f"Deleting blob: {blob}")
+            if os.path.exists(blob):
+                os.remove(blob)
+            os.remove(refs.name)
+            return True
+
+    @contextmanager
+    def _locked(self, blob):
+        path = f"{blob}.refs"
+        while True:
+            refs = open(path, "a+")
+            fcntl.flock(refs, fcntl.LOCK_EX)
+            try:
+                # count file may be deleted by release while we were waiting for the lock
+                if os.fstat(refs.fileno()).st_ino == os.stat(path).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            refs.close()
+        try:
+            yield refs
+        finally:
+            refs.close()
+
+
+def _read_count(refs):
+    refs.seek(0)
+    return int(refs.read() or 0)
+
+
+def _write_count(refs, count):
+    refs.seek(0)
+    refs.truncate()
+    refs.write(str(count))
+    refs.flush()
@@ -0,0 +1,146 @@
+from .file_service import FileService, DURATION, OPERATIONS
+from .read_cache import ReadCache
+from src.metrics import instrument
+
+TEXT = "text"
+BINARY = "binary"
+
+
+@instrument(DURATION, OPERATIONS, "cached")
+class CachedFileService(FileService):
+    """
+    Top level layer keeping content of files already read and verified by the layers below in read cache
+    """
+
+    def __init__(self, wrapped_file_service):
+        self.wrapped_file_service = wrapped_file_service
+        self.cache = ReadCache()
+
+    @property
+    def workdir(self):
+        return self.wrapped_file_service.workdir
+
+    def resolve(self, filename):
+        return self.wrapped_file_service.resolve(filename)
+
+    def relpath(self, filename):
+        return self.wrapped_file_service.relpath(filename)
+
+    @property
+    def content_addressed(self):
+        return self.wrapped_file_service.content_addressed
+
+    def sidecar_key(self, filename):
+        return self.wrapped_file_service.sidecar_key(filename)
+
+    def released(self, key):
+        return self.wrapped_file_service.released(key)
+
+    def new_name(self):
+        return self.wrapped_file_service.new_name()
+
+    def discard(self, filename):
+        return self.wrapped_file_service.discard(filename)
+
+    @property
+    def indexed(self):
+        return self.wrapped_file_service.indexed
+
+    def metadata(self, filename):
+        return self.wrapped_file_service.metadata(filename)
+
+    def reindex(self, filename):
+        return self.wrapped_file_service.reindex(filename)
+
+    def create_blob(self, digest, write):
+        return self.wrapped_file_service.create_blob(digest, write)
+
+    def spool(self, chunks):
+        return self.wrapped_file_service.spool(chunks)
+
+    def content_size(self, filename):
+        return self.wrapped_file_service.content_size(filename)
+
+    def open_range(self, filename, start, stop):
+        return self.wrapped_file_service.open_range(filename, start, stop)
+
+    def open_encoded(self, filename, encodings):
+        return self.wrapped_file_service.open_encoded(filename, encodings)
+
+    def _validator(self, filename):
+        # any rewrite of stored file changes inode or modification time
+        metadata = self.metadata(filename)
+        return metadata.ino, metadata.size, metadata.mtime_ns
+
+    def read(self, filename):
+        """
+        Read file content from cache, file is read through the layers on miss
+
+        :param filename: name of file
+        :return: file content, if file exists and not broken, else raise exception
+        """
+        key = (TEXT, self.resolve(filename))
+        validator = self._validator(filename)
+        data = self.cache.get(key, validator)
+        if data is None:
+            data = self.wrapped_file_service.read(filename)
+            self.cache.put(key, validator, data)
+        return data
+
+    def open_read(self, filename):
+        """
+        Open file for reading by chunks, cached content is returned as one chunk.
+        On miss content is cached after the last chunk, when the layers below verified it
+
+        :param filename: name of file
+        :return: iterator of bytes
+        """
+        key = (BINARY, self.resolve(filename))
+        validator = self._validator(filename)
+        data = self.cache.get(key, validator)
+        if data is not None:
+            return iter((data,))
+        chunks = self.wrapped_file_service.open_read(filename)
+        if validator[1] > self.cache.max_file_size:
+            return chunks
+        return self._caching(chunks, key, validator)
+
+    def _caching(self, chunks, key, validator):
+        collected = []
+        for chunk in chunks:
+            collected.append(bytes(chunk))
+            yield chunk
+        self.cache.put(key, validator, b"".join(collected))
+
+    def create(self, data):
+        return self.wrapped_file_service.create(data)
+
+    def create_from_stream(self, chunks):
+        return self.wrapped_file_service.create_from_stream(chunks)
+
+    def ls(self):
+        return self.wrapped_file_service.ls()
+
+    def internal_paths(self):
+        return self.wrapped_file_service.internal_paths()
+
+    def cd(self, directory):
+        return self.wrapped_file_service.cd(directory)
+
+    def remove(self, filename):
+        path = self.resolve(filename)
+        self.cache.remove((TEXT, path))
+        self.cache.remove((BINARY, path))
+        return self.wrapped_file_service.remove(filename)
+
+    def read_metadata(self, filename):
+        return self.wrapped_file_service.read_metadata(filename)
+
+    def get_permissions(self, filename):
+        return self.wrapped_file_service.get_permissions(filename)
+
+    def get_etag(self, filename):
+        return self.wrapped_file_service.get_etag(filename)
+
+    def set_permissions(self, filename, permissions):
+        return self.wrapped_file_service.set_permissions(filename, permissions)
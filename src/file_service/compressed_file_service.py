@@ -0,0 +1,407 @@
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from itertools import chain
+from .file_service import FileService, DURATION, OPERATIONS, store, store_stream
+from . import streams
+from .durability import Durability
+from src.config import Config
+from src.executor import Executor
+from src.metrics import instrument
+import bz2
+import logging
+import lzma
+import math
+import os
+import struct
+import zlib
+
+MAGIC = b"\xffCZ2"
+# magic, id of codec, size of plain content
+HEADER = struct.Struct("<4sBQ")
+# size of content of stream longer than peeked beginning is not known when header is written
+UNKNOWN_SIZE = 2 ** 64 - 1
+# suffix of marker sidecar, files with the header have it, so content of other files is never parsed
+MARKER_LABEL = "cz"
+# entropy of the beginning of file tells compressible content from already compressed one
+SAMPLE_SIZE = 64 * 1024
+
+Codec = namedtuple("Codec", ("id", "name", "encoding", "compressor", "decompressor"))
+
+IDENTITY = Codec(0, "identity", "identity", None, None)
+CODECS = (IDENTITY,
+          Codec(1, "zlib", "deflate", lambda level: zlib.compressobj(level), zlib.decompressobj),
+          Codec(2, "lzma", "xz", lambda level: lzma.LZMACompressor(preset=level), lzma.LZMADecompressor),
+          Codec(3, "bz2", "bzip2", lambda level: bz2.BZ2Compressor(max(level, 1)), bz2.BZ2Decompressor))
+
+
+def get_codec(value):
+    """
+    Find codec by id, name or content coding of http
+
+    :param value: id, name or content coding of codec
+    :return: Codec, if it exists, else raise ValueError
+    """
+    for codec in CODECS:
+        if value in (codec.id, codec.name, codec.encoding):
+            return codec
+    raise ValueError(f"Unknown codec: {value}")
+
+
+def entropy(sample):
+    """
+    :param sample: bytes
+    :return: Shannon entropy of sample in bits per byte, from 0 to 8
+    """
+    if not sample:
+        return 0.0
+    counts = Counter(sample).values()
+    return -sum(count / len(sample) * math.log2(count / len(sample)) for count in counts)
+
+
+def choose_codec(sample, size):
+    """
+    Choose codec of new file. Small files and files looking compressed or encrypted are stored as they are,
+    with auto codec big files get lzma, which pays off there, other files get fast zlib
+
+    :param sample: beginning of file
+    :param size: size of file or lower bound of it for streams
+    :return: Codec
+    """
+    if size < Config().compression_min_size() or entropy(sample[:SAMPLE_SIZE]) > Config().compression_max_entropy():
+        return IDENTITY
+    if Config().compression_codec() != "auto":
+        return get_codec(Config().compression_codec())
+    if size >= Config().compression_lzma_min_size():
+        return get_codec("lzma")
+    return get_codec("zlib")
+
+
+def compress(codec_id, level, data):
+    """
+    Compress whole file, picklable for the process pool
+
+    :param codec_id: id of codec
+    :param level: compression level
+    :param data: bytes
+    :return: header followed by compressed data
+    """
+    return b"".join(compress_stream(get_codec(codec_id), level, (data,), len(data)))
+
+
+def compress_stream(codec, level, chunks, size=None):
+    """
+    :param codec: Codec
+    :param level: compression level
+    :param chunks: iterable of bytes
+    :param size: size of plain content, None if it is not known
+    :return: generator of header and compressed chunks
+    """
+    yield HEADER.pack(MAGIC, codec.id, UNKNOWN_SIZE if size is None else size)
+    if codec is IDENTITY:
+        yield from chunks
+        return
+    compressor = codec.compressor(level)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def decompress_stream(codec, chunks):
+    """
+    :param codec: Codec
+    :param chunks: iterable of compressed bytes, without header
+    :return: generator of decompressed chunks, truncated stream raises after the last chunk
+    """
+    if codec is IDENTITY:
+        yield from chunks
+        return
+    decompressor = codec.decompressor()
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    if hasattr(decompressor, "flush"):
+        data = decompressor.flush()
+        if data:
+            yield data
+    if not decompressor.eof:
+        raise Exception("File is Broken")
+
+
+def marker_filename(key):
+    """
+    :param key: sidecar key of file
+    :return: path of marker of compressed file
+    """
+    return os.path.join(Config().compressed_path(), f"{key}.{MARKER_LABEL}")
+
+
+def _split_header(chunks):
+    """
+    Read header of compressed file
+
+    :param chunks: iterator of stored bytes
+    :return: tuple (Codec, size of plain content or None if it is not known, iterator of bytes after header)
+    """
+    head, rest = streams.head(chunks, HEADER.size)
+    if len(head) < HEADER.size or head[:len(MAGIC)] != MAGIC:
+        raise Exception("File is Broken")
+    _, codec_id, size = HEADER.unpack(head)
+    return get_codec(codec_id), None if size == UNKNOWN_SIZE else size, rest
+
+
+@contextmanager
+def _marking(key):
+    # marker is written before the file, like signature, and dropped if the write fails
+    marker = marker_filename(key)
+    os.makedirs(os.path.dirname(marker), exist_ok=True)
+    Durability().write(marker, b"")
+    try:
+        yield
+    except BaseException:
+        os.remove(marker)
+        raise
+
+
+def _peek(chunks, limit):
+    """
+    :param chunks: iterable of bytes
+    :param limit: max size of peeked data, it is exceeded by one chunk at most
+    :return: tuple (peeked bytes, iterator of the rest)
+    """
+    chunks = iter(chunks)
+    head = []
+    length = 0
+    for chunk in chunks:
+        head.append(bytes(chunk))
+        length += len(chunk)
+        if length >= limit:
+            break
+    return b"".join(head), chunks
+
+
+def _slice(chunks, skip, length):
+    try:
+        for chunk in chunks:
+            if skip >= len(chunk):
+                skip -= len(chunk)
+                continue
+            piece = bytes(chunk[skip:skip + length])
+            skip = 0
+            length -= len(piece)
+            yield piece
+            if length <= 0:
+                return
+    finally:
+        _close(chunks)
+
+
+def _close(chunks):
+    if hasattr(chunks, "close"):
+        chunks.close()
+
+
+@instrument(DURATION, OPERATIONS, "compressed")
+class CompressedFileService(FileService):
+    """
+    Layer compressing files with codec chosen per file, id of codec is kept in a header before the data.
+    It wraps encryption layer, so it sees plain content. Files with the header are marked by empty sidecar,
+    files without marker, like ones written before compression was enabled, are read as they are
+    """
+
+    def __init__(self, wrapped_file_service):
+        self.wrapped_file_service = wrapped_file_service
+
+    @property
+    def workdir(self):
+        return self.wrapped_file_service.workdir
+
+    def resolve(self, filename):
+        return self.wrapped_file_service.resolve(filename)
+
+    def relpath(self, filename):
+        return self.wrapped_file_service.relpath(filename)
+
+    @property
+    def content_addressed(self):
+        return self.wrapped_file_service.content_addressed
+
+    def sidecar_key(self, filename):
+        return self.wrapped_file_service.sidecar_key(filename)
+
+    def released(self, key):
+        return self.wrapped_file_service.released(key)
+
+    def new_name(self):
+        return self.wrapped_file_service.new_name()
+
+    def discard(self, filename):
+        return self.wrapped_file_service.discard(filename)
+
+    @property
+    def indexed(self):
+        return self.wrapped_file_service.indexed
+
+    def metadata(self, filename):
+        return self.wrapped_file_service.metadata(filename)
+
+    def reindex(self, filename):
+        return self.wrapped_file_service.reindex(filename)
+
+    def create_blob(self, digest, write):
+        return self.wrapped_file_service.create_blob(digest, write)
+
+    def spool(self, chunks):
+        return self.wrapped_file_service.spool(chunks)
+
+    def content_size(self, filename):
+        """
+        :param filename: name of file
+        :return: size of plain content from header, None for files streamed without known size
+        """
+        if not self._marked(filename):
+            return self.wrapped_file_service.content_size(filename)
+        chunks = iter(self.wrapped_file_service.open_read(filename))
+        try:
+            _, size, _ = _split_header(chunks)
+        finally:
+            _close(chunks)
+        return size
+
+    def _marked(self, filename):
+        return os.path.exists(marker_filename(self.sidecar_key(filename)))
+
+    def read(self, filename):
+        return b"".join(self.open_read(filename)).decode()
+
+    def open_read(self, filename):
+        """
+        Open file for reading by chunks, content is decompressed on the way
+
+        :param filename: name of file
+        :return: iterator of bytes, truncated file raises after the last chunk
+        """
+        chunks = self.wrapped_file_service.open_read(filename)
+        if not self._marked(filename):
+            return chunks
+        return self._decompressed(chunks)
+
+    def _decompressed(self, chunks):
+        codec, _, chunks = _split_header(iter(chunks))
+        yield from decompress_stream(codec, chunks)
+
+    def open_range(self, filename, start, stop):
+        """
+        Open byte range of file for reading, compressed data has no random access,
+        so it is decompressed from the beginning and bytes before the range are dropped
+
+        :param filename: name of file
+        :param start: first byte of range
+        :param stop: byte after the last byte of range
+        :return: iterator of bytes
+        """
+        return _slice(self.open_read(filename), start, stop - start)
+
+    def open_encoded(self, filename, encodings):
+        """
+        Open file for reading compressed data as it is stored, if codec of file is accepted by client
+
+        :param filename: name of file
+        :param encodings: accepted content codings of http
+        :return: tuple (content coding, iterator of compressed bytes) or None, if codec of file is not accepted
+        """
+        if not self._marked(filename):
+            return None
+        chunks = iter(self.wrapped_file_service.open_read(filename))
+        try:
+            codec, _, rest = _split_header(chunks)
+        except BaseException:
+            _close(chunks)
+            raise
+        if codec is IDENTITY or codec.encoding not in encodings:
+            _close(chunks)
+            return None
+        return codec.encoding, rest
+
+    def create(self, content):
+        """
+        Create compressed file with unique file name and desired content
+
+        :param content: content of created file
+        :return: unique filename
+        """
+        return store(self, content)
+
+    def create_from_stream(self, chunks):
+        return store_stream(self, chunks)
+
+    def write_data(self, path, key, content):
+        """
+        Compress content and write it through wrapped layer
+
+        :param path: absolute path of file
+        :param key: sidecar key of file
+        :param content: content of file
+        """
+        if isinstance(content, str):
+            content = content.encode()
+        codec = choose_codec(content[:SAMPLE_SIZE], len(content))
+        logging.debug(f"Compressing {key} with {codec.name}")
+        compressed = Executor().run_cpu(compress, codec.id, Config().compression_level(), content)
+        with _marking(key):
+            self.wrapped_file_service.write_data(path, key, compressed)
+
+    def write_stream(self, path, key, chunks):
+        """
+        Compress file chunk by chunk, codec is chosen by the beginning of stream
+
+        :param path: absolute path of file
+        :param key: sidecar key of file
+        :param chunks: iterable of bytes
+        """
+        # size of stream is unknown, it is peeked up to the size where lzma is chosen
+        head, chunks = _peek(chunks, max(SAMPLE_SIZE, Config().compression_lzma_min_size()))
+        following = next(chunks, None)
+        # size goes to header, if the whole stream fits into peeked beginning
+        size = len(head) if following is None else None
+        codec = choose_codec(head, len(head))
+        logging.debug(f"Compressing {key} with {codec.name}")
+        chunks = chain((head,), chunks) if following is None else chain((head, following), chunks)
+        with _marking(key):
+            self.wrapped_file_service.write_stream(
+                path, key, compress_stream(codec, Config().compression_level(), chunks, size))
+
+    def ls(self):
+        return self.wrapped_file_service.ls()
+
+    def internal_paths(self):
+        return self.wrapped_file_service.internal_paths() | {os.path.abspath(Config().compressed_path())}
+
+    def cd(self, directory):
+        return self.wrapped_file_service.cd(directory)
+
+    def remove(self, filename):
+        key = self.sidecar_key(filename)
+        result = self.wrapped_file_service.remove(filename)
+        if self.released(key) and os.path.exists(marker_filename(key)):
+            os.remove(marker_filename(key))
+        return result
+
+    def read_metadata(self, filename):
+        # stored size is size of compressed data
+        creation_date, modification_date, _ = self.wrapped_file_service.read_metadata(filename)
+        size = self.content_size(filename)
+        if size is None:
+            size = sum(len(chunk) for chunk in self.open_read(filename))
+        return creation_date, modification_date, size
+
+    def get_permissions(self, filename):
+        return self.wrapped_file_service.get_permissions(filename)
+
+    def get_etag(self, filename):
+        return self.wrapped_file_service.get_etag(filename)
+
+    def set_permissions(self, filename, permissions):
+        return self.wrapped_file_service.set_permissions(filename, permissions)
@@ -0,0 +1,208 @@
+import logging
+import os
+import stat
+import threading
+import time
+from src.config import Config
+from src.utils import Singleton, generate_random
+
+NONE = "none"
+PER_FILE = "per-file"
+GROUP_COMMIT = "group-commit"
+POLICIES = (NONE, PER_FILE, GROUP_COMMIT)
+
+_fdatasync = getattr(os, "fdatasync", os.fsync)
+
+
+class _Batch:
+    def __init__(self):
+        self.fds = []
+        self.done = threading.Event()
+        self.error = None
+        self.errors = {}
+
+
+class GroupCommit:
+    """
+    Batch fsync requests of concurrent writers. First writer of a batch waits for the window,
+    then syncs every file of the batch once, other writers wait for it. Only files of the batch are flushed,
+    and error of every file is reported to its writer.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.lock = threading.Lock()
+        self.batch = None
+
+    def sync(self, *fds):
+        """
+        Block until data of file descriptors is on disk, descriptors of one writer share the commit window
+
+        :param fds: open file descriptors, must stay open until return
+        """
+        with self.lock:
+            batch = self.batch
+            leader = batch is None
+            if leader:
+                batch = self.batch = _Batch()
+            batch.fds.extend(fds)
+        if not leader:
+            batch.done.wait()
+        else:
+            time.sleep(self.window)
+            with self.lock:
+                self.batch = None
+            try:
+                batch.errors = _flush(batch.fds)
+            except OSError as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        if batch.error:
+            raise batch.error
+        for fd in fds:
+            if fd in batch.errors:
+                raise batch.errors[fd]
+
+
+def _flush(fds):
+    """
+    Sync files, file open by several descriptors is synced once
+
+    :param fds: file descriptors
+    :return: dict of errors by file descriptor
+    """
+    errors, synced = {}, {}
+    for fd in fds:
+        try:
+            status = os.fstat(fd)
+        except OSError as e:
+            errors[fd] = e
+            continue
+        inode = status.st_dev, status.st_ino
+        if inode not in synced:
+            synced[inode] = None
+            try:
+                # directory entries are metadata of directory, data of file needs no sync of its timestamps
+                os.fsync(fd) if stat.S_ISDIR(status.st_mode) else _fdatasync(fd)
+            except OSError as e:
+                synced[inode] = e
+        if synced[inode] is not None:
+            errors[fd] = synced[inode]
+    logging.debug(f"Group commit of {len(fds)} descriptors, {len(synced)} files")
+    return errors
+
+
+class Durability(metaclass=Singleton):
+    """
+    Crash safe writes: data goes to temporary file, which is synced according to fsync policy
+    and renamed over the target, then directory entry is synced as well
+    """
+
+    def __init__(self):
+        self.policy = Config().fsync_policy()
+        if self.policy not in POLICIES:
+            raise ValueError(f"Unknown fsync policy: {self.policy}")
+        self.group_commit = GroupCommit(Config().group_commit_window())
+
+    def sync(self, *fds):
+        """
+        Sync files according to fsync policy, files are synced in one commit window
+
+        :param fds: open file descriptors
+        """
+        if self.policy == PER_FILE:
+            for fd in fds:
+                os.fsync(fd)
+        elif self.policy == GROUP_COMMIT:
+            self.group_commit.sync(*fds)
+
+    def sync_path(self, *paths):
+        """
+        Sync files or directories by path, in one commit window
+
+        :param paths: paths of files or directories
+        """
+        if self.policy == NONE:
+            return
+        fds = []
+        try:
+            for path in paths:
+                fds.append(os.open(path, os.O_RDONLY))
+            self.sync(*fds)
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def write(self, path, data):
+        """
+        Atomically replace content of file
+
+        :param path: path of file
+        :param data: str or bytes
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        self.write_stream(path, [data])
+
+    def write_stream(self, path, chunks):
+        """
+        Atomically replace content of file with chunks, file is published after the last chunk.
+        Data and directory entry are synced in one commit window after the rename, so file is durable on return,
+        file left by crash before return may be incomplete
+
+        :param path: path of file
+        :param chunks: iterable of bytes
+        """
+        fd, temp = self.temp(os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as file:
+                for chunk in chunks:
+                    file.write(chunk)
+            self.publish(temp, path, synced=False)
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+
+    def temp(self, directory, prefix=".tmp-"):
+        """
+        Create temporary file with usual permissions in directory
+
+        :param directory: directory of file
+        :param prefix: prefix of file name
+        :return: (file descriptor, path) tuple
+        """
+        while True:
+            path = os.path.join(directory, f"{prefix}{generate_random(10)}")
+            try:
+                return os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666), path
+            except FileExistsError:
+                continue
+
+    def publish(self, temp, path, synced=True):
+        """
+        Rename temporary file over the target and sync the directory
+
+        :param temp: path of temporary file, in the same directory as target
+        :param path: path of file
+        :param synced: temporary file is already synced, else it is synced together with the directory
+        """
+        os.replace(temp, path)
+        if synced:
+            self.sync_path(os.path.dirname(path))
+        else:
+            self.sync_path(path, os.path.dirname(path))
+
+    def reserve(self, path):
+        """
+        Create empty file, fail if it exists
+
+        :param path: path of file
+        :return: True, if file is created, False if name is taken
+        """
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666))
+        except FileExistsError:
+            return False
+        return True
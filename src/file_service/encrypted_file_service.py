@@ -1,53 +1,238 @@
-from .file_service import FileService
-from src import utils
+from .file_service import FileService, DURATION, OPERATIONS, store, store_stream
+from .keystore import create_keystore
 from src.crypto import Encryption
 from src.config import Config
+from src.metrics import instrument
+from src.executor import Executor
+from itertools import chain
+from . import streams
 import os
+import struct
 
+MAGIC = b"\xffEN"
+VERSION = 1
+# magic, version of header, id of encryption algorithm
+HEADER = struct.Struct(">3sBB")
 
+
+@instrument(DURATION, OPERATIONS, "encrypted")
 class EncryptedFileService(FileService):
     def __init__(self, wrapped_file_service):
         self.wrapped_file_service = wrapped_file_service
-        self.workdir = wrapped_file_service.workdir
         os.makedirs(Config().key_path(), exist_ok=True)
+        self.keystore = create_keystore(wrapped_file_service)
+
+    @property
+    def workdir(self):
+        return self.wrapped_file_service.workdir
+
+    def resolve(self, filename):
+        return self.wrapped_file_service.resolve(filename)
+
+    def relpath(self, filename):
+        return self.wrapped_file_service.relpath(filename)
+
+    @property
+    def content_addressed(self):
+        return self.wrapped_file_service.content_addressed
+
+    def sidecar_key(self, filename):
+        return self.wrapped_file_service.sidecar_key(filename)
+
+    def released(self, key):
+        return self.wrapped_file_service.released(key)
+
+    def new_name(self):
+        return self.wrapped_file_service.new_name()
+
+    def discard(self, filename):
+        return self.wrapped_file_service.discard(filename)
+
+    @property
+    def indexed(self):
+        return self.wrapped_file_service.indexed
+
+    def metadata(self, filename):
+        return self.wrapped_file_service.metadata(filename)
+
+    def reindex(self, filename):
+        return self.wrapped_file_service.reindex(filename)
+
+    def create_blob(self, digest, write):
+        return self.wrapped_file_service.create_blob(digest, write)
+
+    def spool(self, chunks):
+        return self.wrapped_file_service.spool(chunks)
+
+    def content_size(self, filename):
+        encryptor, key, offset = self._session(filename, self.wrapped_file_service.read_at(filename, 0, HEADER.size))
+        return encryptor.plain_size(self.wrapped_file_service.content_size(filename) - offset, key)
 
     def read(self, filename):
-        encryptor = Encryption.get_encryptor(filename)
-        key_file_name = encryptor.key_name(filename)
-        with open(key_file_name, "rb") as f:
-            key = f.read()
-        with open(filename, "rb") as file:
-            encrypted_data = file.read()
-        decrypted_data = encryptor.decrypt(encrypted_data, key)
+        # data is read through wrapped service, backend may keep it outside of regular files
+        encryptor, key, chunks = self._split_header(filename, self.wrapped_file_service.open_read(filename))
+        encrypted_data = b"".join(chunks)
+        decrypted_data = Executor().run_cpu(encryptor.decrypt, encrypted_data, key)
         return decrypted_data
 
+    def open_read(self, filename):
+        """
+        Open encrypted file for reading by chunks, content is decrypted on the way
+
+        :param filename: name of file
+        :return: iterator of bytes, broken file raises after the last chunk
+        """
+        encryptor, key, chunks = self._split_header(filename, self.wrapped_file_service.open_read(filename))
+        return encryptor.decrypt_stream(chunks, key)
+
+    def open_range(self, filename, start, stop):
+        """
+        Open byte range of encrypted file for reading, only chunks covering the range are read and decrypted
+
+        :param filename: name of file
+        :param start: first byte of range
+        :param stop: byte after the last byte of range
+        :return: iterator of bytes, None if file is encrypted as a whole
+        """
+        encryptor, key, offset = self._session(filename, self.wrapped_file_service.read_at(filename, 0, HEADER.size))
+
+        def read_at(position, length):
+            return self.wrapped_file_service.read_at(filename, offset + position, length)
+        return encryptor.decrypt_range(read_at, self.wrapped_file_service.content_size(filename) - offset,
+                                       key, start, stop)
+
+    def _split_header(self, filename, chunks):
+        """
+        :param filename: name of file
+        :param chunks: iterable of stored bytes
+        :return: tuple (encryptor, session key, iterator of encrypted bytes)
+        """
+        head, rest = streams.head(chunks, HEADER.size)
+        encryptor, key, offset = self._session(filename, head)
+        if not offset:
+            return encryptor, key, chain((head,), rest)
+        return encryptor, key, rest
+
+    def _session(self, filename, head):
+        """
+        Find encryptor and session key of file by its first bytes. Encrypted data of files written before headers
+        may begin like a header, so header counts only if it is valid and file has key of its algorithm
+
+        :param filename: name of file
+        :param head: first bytes of stored file
+        :return: tuple (encryptor, session key, size of header or 0 for file without header)
+        """
+        algorithm = _algorithm(head)
+        if algorithm is not None:
+            try:
+                return (*self._session_key(filename, algorithm), HEADER.size)
+            except FileNotFoundError:
+                pass
+        return (*self._session_key(filename), 0)
+
+    def _session_key(self, filename, algorithm=None):
+        key = self.sidecar_key(filename)
+        encryptor = self._encryptor(filename, key, algorithm)
+        return encryptor, self.keystore.get(encryptor, key, lambda: self._validator(filename))
+
+    def _validator(self, filename):
+        # data file of content addressed blob created again gets new key, cached old one is stale then
+        metadata = self.metadata(filename)
+        return metadata.ino, metadata.size, metadata.mtime_ns
+
+    def _encryptor(self, filename, key, algorithm=None):
+        # header of data names the algorithm, files written before headers are found by index or probing
+        if algorithm is not None:
+            return Encryption.get_encryptor_by_algorithm(algorithm)
+        # label from metadata index saves probing of key files of every encryptor
+        if self.indexed:
+            label = self.metadata(filename).encryption
+            if label:
+                return Encryption.get_encryptor_by_label(label)
+        return self.keystore.find(key)
+
     def create(self, data):
+        # with content addressing blob is addressed by plain content, so it is encrypted only once
+        return store(self, data)
+
+    def create_from_stream(self, chunks):
+        return store_stream(self, chunks)
+
+    def write_stream(self, path, sidecar_key, chunks):
+        """
+        Encrypt file chunk by chunk, key is stored after the last chunk, before the file is published
+
+        :param path: absolute path of file
+        :param sidecar_key: sidecar key of file
+        :param chunks: iterable of bytes
+        """
         encryptor = Encryption.get_default_encryptor()
+        try:
+            self.wrapped_file_service.write_stream(
+                path, sidecar_key,
+                chain((_header(encryptor),),
+                      encryptor.encrypt_stream(chunks, lambda key: self.keystore.put(encryptor, sidecar_key, key))))
+        except BaseException:
+            self.keystore.discard(encryptor, sidecar_key)
+            raise
+
+    def write_data(self, path, sidecar_key, data):
+        """
+        Store key of new file, then write the encrypted file itself
+
+        :param path: absolute path of file
+        :param sidecar_key: sidecar key of file
+        :param data: content of file
+        """
+        encryptor = Encryption.get_default_encryptor()
+        # big data is split between workers of the process pool by encryptor itself
         encrypted_data, key = encryptor.encrypt(data)
-        filename = utils.generate_name(10)
-        with open(filename, "wb") as file:
-            file.write(encrypted_data)
-        key_file_name = encryptor.key_name(filename)
-        with open(key_file_name, "wb") as file:
-            file.write(key)
-        return filename
+        self.keystore.put(encryptor, sidecar_key, key)
+        try:
+            self.wrapped_file_service.write_data(path, sidecar_key, _header(encryptor) + encrypted_data)
+        except BaseException:
+            self.keystore.discard(encryptor, sidecar_key)
+            raise
 
     def ls(self):
         return self.wrapped_file_service.ls()
 
+    def internal_paths(self):
+        return self.wrapped_file_service.internal_paths() | {os.path.abspath(Config().key_path())}
+
     def cd(self, dir):
         return self.wrapped_file_service.cd(dir)
 
     def remove(self, filename):
+        key = self.sidecar_key(filename)
         self.wrapped_file_service.remove(filename)
-        key_name = Encryption.get_encryptor(filename).key_name(filename)
-        self.wrapped_file_service.remove(key_name)
+        if self.released(key):
+            self.keystore.remove(key)
 
     def read_metadata(self, filename):
-        return self.wrapped_file_service.read_metadata(filename)
+        # chunk tags make encrypted file bigger than its content
+        creation_date, modification_date, _ = self.wrapped_file_service.read_metadata(filename)
+        return creation_date, modification_date, self.content_size(filename)
 
     def get_permissions(self, filename):
         return self.wrapped_file_service.get_permissions(filename)
 
+    def get_etag(self, filename):
+        return self.wrapped_file_service.get_etag(filename)
+
     def set_permissions(self, filename, permissions):
-        return self.wrapped_file_service.get_permissions(filename, permissions)
+        return self.wrapped_file_service.set_permissions(filename, permissions)
+
+
+def _algorithm(head):
+    # id of algorithm from valid header, None if head is not one
+    if len(head) < HEADER.size:
+        return None
+    magic, version, algorithm = HEADER.unpack(head)
+    if magic != MAGIC or version != VERSION or Encryption.get_encryptor_by_algorithm(algorithm) is None:
+        return None
+    return algorithm
+
+
+def _header(encryptor):
+    return HEADER.pack(MAGIC, VERSION, encryptor.algorithm)
@@ -0,0 +1,54 @@
+from .signed_file_service import SignedFileService
+from .encrypted_file_service import EncryptedFileService
+from .raw_file_service import RawFileService
+from .pack_file_service import PackFileService
+from .cached_file_service import CachedFileService
+from .compressed_file_service import CompressedFileService
+from .metadata_index import MetadataIndex
+from src.config import Config
+
+
+PACK = "pack"
+
+
+def create_backend(directory):
+    """
+    Create bottom layer of file service stack selected in config
+
+    :param directory: storage root
+    :return: raw or pack file service
+    """
+    if Config().backend() == PACK:
+        return PackFileService(directory)
+    return RawFileService(directory)
+
+
+def create_file_service(raw_file_service):
+    """
+    Wrap raw file service with layers enabled in config
+
+    :param raw_file_service: raw file service
+    :return: top level file service
+    """
+    file_service = raw_file_service
+    if Config().is_encrypted():
+        file_service = EncryptedFileService(file_service)
+    # compression must see plain content, encrypted data does not compress
+    if Config().is_compressed():
+        file_service = CompressedFileService(file_service)
+    if Config().is_signed():
+        file_service = SignedFileService(file_service)
+    # raw files are served from page cache, only verified, decrypted or decompressed content is worth caching
+    if file_service is not raw_file_service and Config().read_cache_size() > 0:
+        file_service = CachedFileService(file_service)
+    return file_service
+
+
+def reconcile_if_empty(root):
+    """
+    Build metadata index of storage root on first start, if index is enabled
+
+    :param root: storage root
+    """
+    if Config().is_indexed() and Config().backend() != PACK and MetadataIndex().is_empty():
+        RawFileService(root).reconcile()
@@ -1,5 +1,68 @@
-from typing import Optional
+from typing import Iterable, Iterator, Optional
 from abc import ABCMeta, abstractmethod
+from src.metrics import Histogram
+from . import blob_store, streams
+import os
+
+DURATION = Histogram("file_service_duration_seconds",
+                     "Duration of file service operations, time of wrapped layers included",
+                     ("layer", "operation"))
+OPERATIONS = ("read", "create", "ls", "cd", "remove", "read_metadata", "get_permissions", "set_permissions",
+              "get_etag", "open_read", "create_from_stream")
+
+
+def store(file_service, content):
+    """
+    Create file with unique name through top level file service. Name is reserved first,
+    then sidecars and data are written, data is published last by atomic rename
+
+    :param file_service: top level file service
+    :param content: content of created file
+    :return: unique filename
+    """
+    if file_service.content_addressed:
+        filename = file_service.create_blob(blob_store.digest(content),
+                                            lambda path, key: file_service.write_data(path, key, content))
+        file_service.reindex(filename)
+        return filename
+    filename = file_service.new_name()
+    try:
+        file_service.write_data(file_service.resolve(filename), file_service.relpath(filename), content)
+    except BaseException:
+        file_service.discard(filename)
+        raise
+    file_service.reindex(filename)
+    return filename
+
+
+def store_stream(file_service, chunks):
+    """
+    Create file with unique name from chunks through top level file service, same steps as store,
+    with content addressing chunks are spooled first, because address must be known before blob is written
+
+    :param file_service: top level file service
+    :param chunks: iterable or async iterable of bytes
+    :return: unique filename
+    """
+    chunks = streams.iterate(chunks)
+    if file_service.content_addressed:
+        spool, digest = file_service.spool(chunks)
+        try:
+            filename = file_service.create_blob(
+                digest, lambda path, key: file_service.write_stream(path, key, streams.read_chunks(spool)))
+        finally:
+            if os.path.exists(spool):
+                os.remove(spool)
+        file_service.reindex(filename)
+        return filename
+    filename = file_service.new_name()
+    try:
+        file_service.write_stream(file_service.resolve(filename), file_service.relpath(filename), chunks)
+    except BaseException:
+        file_service.discard(filename)
+        raise
+    file_service.reindex(filename)
+    return filename
 
 
 class FileService(metaclass=ABCMeta):
@@ -12,10 +75,22 @@ class FileService(metaclass=ABCMeta):
     def create(self, data: str) -> Optional[str]:
         raise Exception("Not implemented")
 
+    @abstractmethod
+    def open_read(self, filename: str) -> Iterator[bytes]:
+        raise Exception("Not implemented")
+
+    @abstractmethod
+    def create_from_stream(self, chunks: Iterable[bytes]) -> Optional[str]:
+        raise Exception("Not implemented")
+
     @abstractmethod
     def ls(self) -> Optional[list]:
         raise Exception("Not implemented")
 
+    @abstractmethod
+    def internal_paths(self) -> Optional[set]:
+        raise Exception("Not implemented")
+
     @abstractmethod
     def cd(self, directory: str) -> Optional[bool]:
         raise Exception("Not implemented")
@@ -36,3 +111,36 @@ class FileService(metaclass=ABCMeta):
     def set_permissions(self, filename: str, permissions: int) -> Optional[bool]:
         raise Exception("Not implemented")
 
+    @abstractmethod
+    def get_etag(self, filename: str) -> Optional[str]:
+        raise Exception("Not implemented")
+
+    def content_size(self, filename: str) -> Optional[int]:
+        """
+        Get size of content served for file
+
+        :param filename: name of file
+        :return: size in bytes, None if it is known only after reading the file
+        """
+        return self.metadata(filename).size
+
+    def open_encoded(self, filename: str, encodings: set) -> Optional[tuple]:
+        """
+        Open file for reading content as it is stored in one of content codings of http
+
+        :param filename: name of file
+        :param encodings: accepted content codings
+        :return: tuple (content coding, iterator of bytes), None if file is not stored in accepted coding
+        """
+        return None
+
+    def open_range(self, filename: str, start: int, stop: int) -> Optional[Iterator[bytes]]:
+        """
+        Open byte range of content for reading without reading the whole file
+
+        :param filename: name of file
+        :param start: first byte of range
+        :param stop: byte after the last byte of range
+        :return: iterator of bytes, None if only the whole file can be read, because it is verified as a whole
+        """
+        return None
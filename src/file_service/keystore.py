@@ -0,0 +1,314 @@
+from collections import OrderedDict
+from .durability import Durability
+from src.config import Config
+from src.crypto import Encryption
+from src.metrics import Counter
+from src.utils import Singleton
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+FILES = "files"
+SQLITE = "sqlite"
+KEYSTORES = (FILES, SQLITE)
+
+HITS = Counter("keystore_cache_hits_total", "Keystore cache hits")
+MISSES = Counter("keystore_cache_misses_total", "Keystore cache misses")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS keys (
+    key TEXT PRIMARY KEY,
+    label TEXT NOT NULL,
+    value BLOB NOT NULL
+) WITHOUT ROWID
+"""
+
+
+def create_keystore(file_service):
+    """
+    Create keystore chosen in config
+
+    :param file_service: wrapped file service of encryption layer, key files are removed through it
+    :return: FileKeystore or SqliteKeystore
+    """
+    keystore = Config().keystore()
+    if keystore not in KEYSTORES:
+        raise ValueError(f"Unknown keystore: {keystore}")
+    if keystore == SQLITE:
+        return SqliteKeystore()
+    return FileKeystore(file_service)
+
+
+class FileKeystore:
+    """
+    Key of every file in its own key file, named by sidecar key and label of encryptor
+    """
+
+    def __init__(self, file_service):
+        self.file_service = file_service
+
+    def get(self, encryptor, key, validator=None):
+        """
+        :param encryptor: encryptor of file
+        :param key: sidecar key of file
+        :param validator: function returning validator of data file, unused here
+        :return: encryption key of file
+        """
+        with open(encryptor.key_name(key), "rb") as f:
+            return f.read()
+
+    def put(self, encryptor, key, value):
+        """
+        Store encryption key of new file, it is durable on return
+
+        :param encryptor: encryptor of file
+        :param key: sidecar key of file
+        :param value: encryption key
+        """
+        key_name = encryptor.key_name(key)
+        os.makedirs(os.path.dirname(key_name), exist_ok=True)
+        Durability().write(key_name, bytes(value))
+
+    def discard(self, encryptor, key):
+        """
+        Drop key of file whose write has failed
+        """
+        key_name = encryptor.key_name(key)
+        if os.path.exists(key_name):
+            os.remove(key_name)
+
+    def find(self, key):
+        """
+        :param key: sidecar key of file
+        :return: encryptor of file, found by probing key files of every encryptor
+        """
+        return Encryption.get_encryptor(key)
+
+    def remove(self, key):
+        self.file_service.remove(self.find(key).key_name(key))
+
+
+class _Batch:
+    def __init__(self):
+        self.statements = []
+        self.done = threading.Event()
+        self.error = None
+
+
+class SqliteKeystore(metaclass=Singleton):
+    """
+    Keys of all files in one SQLite database keyed by sidecar key, so no inode and open per file.
+    Recently used keys are cached with validator of their data file, entry with other validator is stale,
+    like key of content addressed blob created again by another worker process. Keys of concurrent creates
+    are committed in one transaction, every writer waits until its key is on disk.
+    """
+
+    def __init__(self):
+        self.cache_size = Config().keystore_cache_size()
+        self.window = Config().keystore_batch_window()
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._batch = None
+        self._batch_lock = threading.Lock()
+        HITS.labels().set_function(lambda: self.hits)
+        MISSES.labels().set_function(lambda: self.misses)
+
+    @property
+    def connection(self):
+        path = Config().keystore_path()
+        if getattr(self._local, "path", None) != path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            connection = sqlite3.connect(path, isolation_level=None, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # key must survive a crash once its data file is published
+            connection.execute("PRAGMA synchronous=FULL")
+            connection.execute(SCHEMA)
+            self._local.connection, self._local.path = connection, path
+        return self._local.connection
+
+    def get(self, encryptor, key, validator=None):
+        """
+        :param encryptor: encryptor of file
+        :param key: sidecar key of file
+        :param validator: function returning validator of data file, cached key is used only with the same validator
+        :return: encryption key of file, raise FileNotFoundError if there is no key of encryptor
+        """
+        validator = validator() if validator is not None else None
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[:2] == (validator, encryptor.label):
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        row = self.connection.execute("SELECT label, value FROM keys WHERE key = ?", (key,)).fetchone()
+        if row is None or row[0] != encryptor.label:
+            raise FileNotFoundError(f"Key is not found: {key}")
+        value = bytes(row[1])
+        with self._lock:
+            self._cache[key] = (validator, encryptor.label, value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return value
+
+    def put(self, encryptor, key, value):
+        """
+        Store encryption key of new file, it is durable on return
+
+        :param encryptor: encryptor of file
+        :param key: sidecar key of file
+        :param value: encryption key
+        """
+        self._evict(key)
+        self._write(("INSERT OR REPLACE INTO keys VALUES (?, ?, ?)", (key, encryptor.label, bytes(value))))
+
+    def discard(self, encryptor, key):
+        """
+        Drop key of file whose write has failed
+        """
+        self._evict(key)
+        self._write(("DELETE FROM keys WHERE key = ? AND label = ?", (key, encryptor.label)))
+
+    def find(self, key):
+        """
+        :param key: sidecar key of file
+        :return: encryptor of file
+        """
+        row = self.connection.execute("SELECT label FROM keys WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise Exception("Encryptor is not found!")
+        return Encryption.get_encryptor_by_label(row[0])
+
+    def remove(self, key):
+        self._evict(key)
+        self._write(("DELETE FROM keys WHERE key = ?", (key,)))
+
+    def copy(self, old_key, new_key):
+        """
+        Store key of file also under new sidecar key, when its data file is moved, like by reshard.
+        Old key is removed by caller once the old data file is gone
+
+        :param old_key: sidecar key of file before the move
+        :param new_key: sidecar key of file after the move
+        """
+        self._evict(new_key)
+        self._write(("INSERT OR REPLACE INTO keys SELECT ?, label, value FROM keys WHERE key = ?", (new_key, old_key)))
+
+    def stored(self, key):
+        """
+        :param key: sidecar key of file
+        :return: tuple (label of encryptor, encryption key) as committed, None if there is no key
+        """
+        row = self.connection.execute("SELECT label, value FROM keys WHERE key = ?", (key,)).fetchone()
+        return (row[0], bytes(row[1])) if row else None
+
+    def import_keys(self, keys):
+        """
+        Add keys in one transaction, keys already in keystore are kept
+
+        :param keys: iterable of (sidecar key, label of encryptor, encryption key) tuples
+        :return: count of added keys
+        """
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            count = 0
+            for key, label, value in keys:
+                count += connection.execute("INSERT OR IGNORE INTO keys VALUES (?, ?, ?)",
+                                            (key, label, bytes(value))).rowcount
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return count
+
+    def _evict(self, key):
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def _write(self, *statements):
+        # first writer of a batch waits for the window and commits statements of all writers at once
+        with self._batch_lock:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = _Batch()
+            batch.statements.extend(statements)
+        if not leader:
+            batch.done.wait()
+        else:
+            time.sleep(self.window)
+            with self._batch_lock:
+                self._batch = None
+            try:
+                self._commit(batch.statements)
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        if batch.error:
+            raise batch.error
+
+    def _commit(self, statements):
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for statement, params in statements:
+                connection.execute(statement, params)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        logging.debug(f"Keystore batch of {len(statements)} statements committed")
+
+
+def migrate_key_files():
+    """
+    Import key files of every encryptor into SQLite keystore, then remove them.
+    Key file is removed only if keystore holds the same key, key file conflicting with key already
+    in keystore, like one left by an earlier run, is kept for manual check.
+    Server must be stopped, keystore is switched to sqlite in config afterwards
+
+    :return: tuple (count of imported keys, count of removed key files, list of paths of conflicting key files)
+    """
+    key_path = os.path.abspath(Config().key_path())
+    key_files = [(path, key, label, _read(path)) for path, key, label in _key_files(key_path)]
+    keystore = SqliteKeystore()
+    imported = keystore.import_keys((key, label, value) for _, key, label, value in key_files)
+    # files are removed only after their keys are committed
+    removed, conflicts = 0, []
+    for path, key, label, value in key_files:
+        if keystore.stored(key) != (label, value):
+            logging.warning(f"Key file {path} conflicts with key in keystore, it is kept")
+            conflicts.append(path)
+            continue
+        os.remove(path)
+        removed += 1
+    logging.debug(f"Imported {imported} of {len(key_files)} key files into keystore")
+    return imported, removed, conflicts
+
+
+def _key_files(key_path):
+    """
+    :return: generator of (path, sidecar key, label of encryptor) tuples, pem key and keystore itself are skipped
+    """
+    labels = list(Encryption._registry)
+    for directory, _, names in os.walk(key_path):
+        for name in names:
+            path = os.path.join(directory, name)
+            relpath = os.path.relpath(path, key_path)
+            for label in labels:
+                if relpath.endswith(f".{label}") and not name.startswith(".tmp-"):
+                    yield path, relpath[:-len(label) - 1], label
+                    break
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
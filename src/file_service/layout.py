@@ -0,0 +1,71 @@
+import hashlib
+import os
+import string
+
+MARKER = ".shard"
+
+
+class ShardLayout:
+    """
+    Placement of files inside of directory. Name is hashed and the first depth groups of width hex digits
+    of the hash become nested shard directories, e.g. ab/cd/name for depth 2 and width 2.
+    Shard directory holds marker file, so user directory with name like "ab" is not taken for shard.
+    Depth 0 is the flat layout.
+    """
+
+    def __init__(self, depth=0, width=2):
+        self.depth = depth
+        self.width = width
+
+    def path(self, directory, name):
+        """
+        Get path of file in directory
+
+        :param directory: directory of file as user sees it
+        :param name: name of file
+        :return: path of file on disk
+        """
+        if not self.depth:
+            return os.path.join(directory, name)
+        digest = hashlib.md5(name.encode()).hexdigest()
+        shards = [digest[level * self.width:(level + 1) * self.width] for level in range(self.depth)]
+        return os.path.join(directory, *shards, name)
+
+    def makedirs(self, path):
+        """
+        Create directories of file path, shard directories are marked
+
+        :param path: path of file from path()
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shard = os.path.dirname(path)
+        for _ in range(self.depth):
+            marker = os.path.join(shard, MARKER)
+            if not os.path.exists(marker):
+                open(marker, "a").close()
+            shard = os.path.dirname(shard)
+
+    def is_shard(self, path):
+        """
+        :param path: path of directory
+        :return: True, if directory is shard directory of layout
+        """
+        name = os.path.basename(path)
+        return (len(name) == self.width and all(char in string.hexdigits.lower() for char in name)
+                and os.path.exists(os.path.join(path, MARKER)))
+
+    def entries(self, directory, depth=None):
+        """
+        Iterate over entries of directory with shard directories flattened
+
+        :param directory: directory as user sees it
+        :param depth: remaining shard levels, layout depth if None
+        :return: generator of os.DirEntry
+        """
+        depth = self.depth if depth is None else depth
+        with os.scandir(directory) as iterator:
+            for entry in iterator:
+                if depth and entry.is_dir(follow_symlinks=False) and self.is_shard(entry.path):
+                    yield from self.entries(entry.path, depth - 1)
+                elif depth == self.depth or entry.name != MARKER:
+                    yield entry
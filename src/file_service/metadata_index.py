@@ -0,0 +1,148 @@
+from collections import namedtuple
+from src.config import Config
+from src.crypto import Encryption, Signature
+from src.utils import Singleton
+import logging
+import os
+import sqlite3
+import threading
+
+FILE = "file"
+DIR = "dir"
+
+FileMetadata = namedtuple("FileMetadata", ("kind", "size", "ctime_ns", "mtime_ns", "mode", "ino", "signer",
+                                           "encryption"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    directory TEXT NOT NULL,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    size INTEGER,
+    ctime_ns INTEGER,
+    mtime_ns INTEGER,
+    mode INTEGER,
+    ino INTEGER,
+    signer TEXT,
+    encryption TEXT,
+    PRIMARY KEY (directory, name)
+) WITHOUT ROWID
+"""
+
+
+def describe(path, key=None):
+    """
+    Build metadata of file or directory from filesystem
+
+    :param path: absolute path
+    :param key: sidecar key of file, signer and encryption labels are looked up if given
+    :return: FileMetadata
+    """
+    stat = os.stat(path)
+    if os.path.isdir(path):
+        return FileMetadata(DIR, None, stat.st_ctime_ns, stat.st_mtime_ns, stat.st_mode, stat.st_ino, None, None)
+    signer = encryption = None
+    if key is not None:
+        signer = next((label for label in Signature._registry
+                       if os.path.exists(Signature.get_signer_by_label(label).sig_filename(key))), None)
+        encryption = next((label for label in Encryption._registry
+                           if os.path.exists(Encryption.get_encryptor_by_label(label).key_name(key))), None)
+    return FileMetadata(FILE, stat.st_size, stat.st_ctime_ns, stat.st_mtime_ns, stat.st_mode, stat.st_ino,
+                        signer, encryption)
+
+
+class MetadataIndex(metaclass=Singleton):
+    """
+    SQLite index of metadata of files in storage root, keyed by directory and name as user sees them.
+    Shared by worker processes, every thread has own connection.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        path = Config().index_path()
+        if getattr(self._local, "path", None) != path:
+            connection = sqlite3.connect(path, isolation_level=None, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(SCHEMA)
+            self._local.connection, self._local.path = connection, path
+        return self._local.connection
+
+    def get(self, path):
+        """
+        Get metadata of entry
+
+        :param path: path relative to storage root
+        :return: FileMetadata, None if entry is not indexed
+        """
+        directory, name = _split(path)
+        row = self.connection.execute(
+            "SELECT kind, size, ctime_ns, mtime_ns, mode, ino, signer, encryption FROM entries "
+            "WHERE directory = ? AND name = ?", (directory, name)).fetchone()
+        return FileMetadata(*row) if row else None
+
+    def put(self, path, metadata):
+        """
+        Add or update entry
+
+        :param path: path relative to storage root
+        :param metadata: FileMetadata
+        """
+        self.connection.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                (*_split(path), *metadata))
+
+    def remove(self, path):
+        """
+        Remove entry
+
+        :param path: path relative to storage root
+        """
+        self.connection.execute("DELETE FROM entries WHERE directory = ? AND name = ?", _split(path))
+
+    def list(self, directory):
+        """
+        List names in directory
+
+        :param directory: path of directory relative to storage root
+        :return: list of names
+        """
+        rows = self.connection.execute("SELECT name FROM entries WHERE directory = ?", (_directory(directory),))
+        return [name for name, in rows]
+
+    def is_empty(self):
+        return self.connection.execute("SELECT 1 FROM entries LIMIT 1").fetchone() is None
+
+    def rebuild(self, entries):
+        """
+        Replace whole index in one transaction
+
+        :param entries: iterable of (path relative to storage root, FileMetadata) tuples
+        :return: count of indexed entries
+        """
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM entries")
+            count = 0
+            for path, metadata in entries:
+                connection.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                   (*_split(path), *metadata))
+                count += 1
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        logging.debug(f"Metadata index rebuilt with {count} entries")
+        return count
+
+
+def _directory(directory):
+    return "" if directory == "." else directory
+
+
+def _split(path):
+    directory, name = os.path.split(path)
+    return _directory(directory), name
@@ -0,0 +1,296 @@
+from .file_service import FileService, DURATION, OPERATIONS, store, store_stream
+from . import streams
+from .metadata_index import FileMetadata, FILE
+from .pack_store import PackStore
+from .raw_file_service import _to_dt
+import logging
+import os
+import stat
+import threading
+from src import utils
+from src.config import Config
+from src.metrics import instrument
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_pack_store(path):
+    """
+    Get pack store of directory, one store is shared by all pack file services of process
+
+    :param path: directory of pack store
+    :return: PackStore
+    """
+    path = os.path.abspath(path)
+    with _stores_lock:
+        pack_store = _stores.get(path)
+        if pack_store is None:
+            pack_store = _stores[path] = PackStore(path, Config().pack_segment_size(),
+                                                   Config().pack_checkpoint_interval())
+        return pack_store
+
+
+def close_pack_stores():
+    with _stores_lock:
+        for pack_store in _stores.values():
+            pack_store.close()
+        _stores.clear()
+
+
+@instrument(DURATION, OPERATIONS, "pack")
+class PackFileService(FileService):
+    """
+    Backend keeping files as records of pack store instead of one file per object.
+    It has one flat directory, names of files are keys of pack store.
+    Sidecar files of layers above are still written to their own directories.
+    """
+    on_disk = False
+
+    def __init__(self, root=".", workdir=None):
+        self.root = os.path.abspath(root)
+        self.workdir = self.root
+        self.store = open_pack_store(Config().pack_path())
+        if workdir:
+            self.cd(workdir)
+
+    @property
+    def content_addressed(self):
+        return False
+
+    @property
+    def indexed(self):
+        return False
+
+    def resolve(self, filename):
+        """
+        Get key of file in pack store
+
+        :param filename: name of file
+        :return: key, if it is valid name of file, else raise exception
+        """
+        if not filename or filename in (".", "..") or "/" in filename or filename.startswith("."):
+            raise ValueError(f"Access denied: {filename}")
+        return filename
+
+    def relpath(self, filename):
+        return self.resolve(filename)
+
+    def sidecar_key(self, filename):
+        return self.resolve(filename)
+
+    def released(self, key):
+        return key not in self.store.entries
+
+    def new_name(self):
+        """
+        Reserve name of new file
+
+        :return: unique filename
+        """
+        while True:
+            filename = utils.generate_random(10)
+            if self.store.reserve(filename):
+                logging.debug(f"Generated name: {filename}")
+                return filename
+
+    def discard(self, filename):
+        self.store.release(filename)
+
+    def write_data(self, path, key, content):
+        """
+        Append content of new file to pack store
+
+        :param path: key of file
+        :param key: sidecar key of file
+        :param content: str or bytes
+        """
+        if isinstance(content, str):
+            content = content.encode()
+        self.store.put(path, content)
+        self.store.release(path)
+
+    def write_stream(self, path, key, chunks):
+        """
+        Append new file to pack store chunk by chunk, memory use does not depend on size of file
+
+        :param path: key of file
+        :param key: sidecar key of file
+        :param chunks: iterable of bytes
+        """
+        self.store.put_stream(path, chunks)
+        self.store.release(path)
+
+    def metadata(self, filename):
+        """
+        Get metadata of file, inode is replaced by position of its record
+
+        :param filename: name of file
+        :return: FileMetadata, if file exists, else raise exception
+        """
+        entry = self._entry(filename)
+        return FileMetadata(FILE, entry.size, entry.ctime_ns, entry.mtime_ns, stat.S_IFREG | entry.mode,
+                            entry.segment << 40 | entry.offset, None, None)
+
+    def _entry(self, filename):
+        try:
+            return self.store.stat(self.resolve(filename))
+        except KeyError:
+            raise ValueError(f"Not Found: {filename}")
+
+    def reindex(self, filename):
+        pass
+
+    def read(self, filename):
+        """
+        Read file from pack store by filename
+
+        :param filename: name of file
+        :return: file content, if file exists, else raise exception
+        """
+        return self._get(filename).decode()
+
+    def _get(self, filename):
+        try:
+            return self.store.get(self.resolve(filename))
+        except KeyError:
+            raise ValueError(f"Not Found: {filename}")
+
+    def read_at(self, filename, offset, length):
+        """
+        Read part of file from pack store
+
+        :param filename: name of file
+        :param offset: position of the first byte
+        :param length: max count of bytes
+        :return: bytes, if file exists, else raise exception
+        """
+        try:
+            return self.store.get(self.resolve(filename), offset, length)
+        except KeyError:
+            raise ValueError(f"Not Found: {filename}")
+
+    def open_read(self, filename):
+        """
+        Read file from pack store by filename by chunks
+
+        :param filename: name of file
+        :return: iterator of bytes, if file exists, else raise exception
+        """
+        try:
+            return self.store.open(self.resolve(filename), Config().chunk_size())
+        except KeyError:
+            raise ValueError(f"Not Found: {filename}")
+
+    def get_etag(self, filename):
+        metadata = self.metadata(filename)
+        return f"{metadata.ino:x}-{metadata.size:x}-{metadata.mtime_ns:x}"
+
+    def create(self, content):
+        """
+        Create file with unique file name and desired content
+
+        :param content: content of created file
+        :return: unique filename
+        """
+        return store(self, content)
+
+    def create_from_stream(self, chunks):
+        return store_stream(self, chunks)
+
+    def create_from_file(self, path):
+        """
+        Copy already written file into pack store under unique file name, file is streamed, not loaded into memory
+
+        :param path: path of written file
+        :return: unique filename
+        """
+        return self.create_from_stream(streams.read_chunks(path))
+
+    def ls(self):
+        """
+        Return list of files
+
+        :return: list of names of files
+        """
+        return sorted(self.store.names())
+
+    def scan(self, cursor="", limit=None, details=False, hidden=()):
+        """
+        Iterate over files in name order
+
+        :param cursor: name of last entry of previous page, only entries after it are returned
+        :param limit: max count of entries, all entries if None
+        :param details: add type, size and modification time of entry to result
+        :param hidden: not used, pack store has no service files
+        :return: generator of dicts with name and, if desired, details of entry
+        """
+        names = [name for name in self.ls() if name > cursor]
+        for name in names[:limit]:
+            if not details:
+                yield {"name": name}
+                continue
+            try:
+                entry = self.store.stat(name)
+            except KeyError:
+                continue
+            yield {"name": name, "type": "file", "size": entry.size, "mtime": _to_dt(entry.mtime_ns / 1e9)}
+
+    def internal_paths(self):
+        return {self.store.path}
+
+    def cd(self, directory):
+        """
+        Change current directory, pack store has only the root directory
+
+        :param directory: name of directory
+        :return: True, if desired directory is the root
+        """
+        if directory in ("", ".", "/"):
+            return True
+        raise ValueError(f"Not Found: {directory}")
+
+    def remove(self, filename):
+        """
+        Delete file, paths of sidecar files given by layers above are deleted from disk,
+        only inside of directories of signatures and keys
+
+        :param filename: name of file or path of sidecar file
+        :return: True, if file deleted, else raise exception
+        """
+        if "/" in filename:
+            path = _sidecar_path(filename)
+            logging.debug(f"Deleting: {path}")
+            os.remove(path)
+            return True
+        if self.store.delete(self.resolve(filename)):
+            logging.debug(f"Deleting: {filename}")
+            return True
+        raise ValueError(f"Not Found: {filename}")
+
+    def read_metadata(self, filename):
+        """
+        Read file creation date, edit date, file size
+
+        :param filename:
+        :return tuple (create_date, modification_date, file size)
+        """
+        entry = self._entry(filename)
+        return _to_dt(entry.ctime_ns / 1e9), _to_dt(entry.mtime_ns / 1e9), entry.size
+
+    def get_permissions(self, filename):
+        return oct(self.metadata(filename).mode)
+
+    def set_permissions(self, filename, permissions):
+        self._entry(filename)
+        self.store.chmod(self.resolve(filename), permissions)
+        return True
+
+
+def _sidecar_path(path):
+    path = os.path.realpath(path)
+    sidecar_paths = (os.path.realpath(Config().sig_path()), os.path.realpath(Config().key_path()))
+    if not any(path.startswith(os.path.join(sidecar_path, "")) for sidecar_path in sidecar_paths) \
+            or not os.path.isfile(path):
+        raise ValueError(f"Access denied: {path}")
+    return path
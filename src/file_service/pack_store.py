@@ -0,0 +1,465 @@
+from collections import namedtuple
+from .durability import Durability
+import fcntl
+import json
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+PUT = 1
+DELETE = 2
+MODE = 3
+
+MAGIC = b"PACK"
+# magic, kind, mode, length of name, length of data, modification time, crc32 of the rest of record
+HEADER = struct.Struct("<4sBHHQQI")
+SEGMENT_SUFFIX = ".pack"
+CHECKPOINT = "checkpoint.json"
+SPOOL_BUFFER_SIZE = 1024 * 1024
+
+Entry = namedtuple("Entry", ("segment", "offset", "size", "ctime_ns", "mtime_ns", "mode"))
+Record = namedtuple("Record", ("kind", "name", "mode", "mtime_ns", "offset", "size", "end"))
+
+
+class PackStore:
+    """
+    Log structured store of small objects. Objects are appended to segment files as records,
+    the newest record of a name wins, delete appends a tombstone.
+
+    Offsets of live objects are kept in memory and saved to a checkpoint from time to time by a background thread,
+    on open the checkpoint is loaded and only records written after it are replayed.
+    Compaction rewrites live objects of sealed segments with a lot of garbage to the active segment.
+    Store belongs to one process, it is locked with flock while open.
+    """
+
+    def __init__(self, path, segment_size, checkpoint_interval):
+        """
+        :param path: directory of segments and checkpoint
+        :param segment_size: active segment is sealed when it grows over this size
+        :param checkpoint_interval: count of appended records between checkpoints
+        """
+        self.path = os.path.abspath(path)
+        self.segment_size = segment_size
+        self.checkpoint_interval = checkpoint_interval
+        self.entries = {}
+        self.live = {}
+        self._reserved = set()
+        self._lock = threading.RLock()
+        self._compaction = threading.Lock()
+        self._checkpoint_lock = threading.Lock()
+        self._checkpointer = None
+        self._readers = {}
+        self._appended = 0
+        os.makedirs(self.path, exist_ok=True)
+        self._owner = open(os.path.join(self.path, "LOCK"), "a")
+        try:
+            fcntl.flock(self._owner, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._owner.close()
+            raise RuntimeError(f"Pack store {self.path} is used by another process")
+        try:
+            self._recover()
+        except BaseException:
+            self._owner.close()
+            raise
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path, f"{segment:08d}{SEGMENT_SUFFIX}")
+
+    def segments(self):
+        """
+        :return: sorted ids of existing segments
+        """
+        return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.path)
+                      if name.endswith(SEGMENT_SUFFIX))
+
+    def _recover(self):
+        segment, offset = self._load_checkpoint()
+        segments = self.segments()
+        for replayed in segments:
+            if replayed < segment:
+                continue
+            start = offset if replayed == segment else 0
+            # only the active segment may end with a record torn by a crash
+            for record in _records(self._segment_path(replayed), start, truncate=replayed == segments[-1]):
+                self._apply(replayed, record)
+        self.active = segments[-1] if segments else 1
+        self._writer = open(self._segment_path(self.active), "ab")
+        logging.debug(f"Pack store {self.path} opened with {len(self.entries)} objects")
+
+    def _load_checkpoint(self):
+        try:
+            with open(os.path.join(self.path, CHECKPOINT)) as file:
+                checkpoint = json.load(file)
+            entries = {name: Entry(*entry) for name, entry in checkpoint["entries"].items()}
+            position = checkpoint["segment"], checkpoint["offset"]
+        except FileNotFoundError:
+            return 0, 0
+        except (ValueError, KeyError, TypeError) as e:
+            # checkpoint is synced after rename, crash in between may leave it incomplete
+            logging.warning(f"Invalid checkpoint of pack store, replaying all segments: {e}")
+            return 0, 0
+        for name, entry in entries.items():
+            self._put_entry(name, entry)
+        return position
+
+    def _apply(self, segment, record):
+        if record.kind == PUT:
+            previous = self.entries.get(record.name)
+            ctime_ns = previous.ctime_ns if previous else record.mtime_ns
+            self._put_entry(record.name, Entry(segment, record.offset, record.size, ctime_ns, record.mtime_ns,
+                                               record.mode))
+        elif record.kind == DELETE:
+            self._drop_entry(record.name)
+        elif record.kind == MODE and record.name in self.entries:
+            self._put_entry(record.name, self.entries[record.name]._replace(mode=record.mode,
+                                                                            ctime_ns=record.mtime_ns))
+
+    def _put_entry(self, name, entry):
+        self._drop_entry(name)
+        self.entries[name] = entry
+        self.live[entry.segment] = self.live.get(entry.segment, 0) + _record_size(name, entry)
+
+    def _drop_entry(self, name):
+        entry = self.entries.pop(name, None)
+        if entry is not None:
+            self.live[entry.segment] -= _record_size(name, entry)
+
+    def _append(self, kind, name, data=b"", mode=0o644, mtime_ns=None, check=None):
+        """
+        Append record and apply it. Record is synced after the lock is released,
+        so concurrent writers share one sync of group commit
+
+        :param check: function called under the lock, record is not appended if it returns False
+        :return: True, if record was appended
+        """
+        mtime_ns = time.time_ns() if mtime_ns is None else mtime_ns
+        crc = _crc(kind, mode, mtime_ns, name.encode(), data)
+        return self._append_record(kind, name, mode, mtime_ns, len(data), crc, lambda writer: writer.write(data), check)
+
+    def _append_record(self, kind, name, mode, mtime_ns, size, crc, write, check=None):
+        """
+        :param size: size of data of record
+        :param crc: checksum of record
+        :param write: function writing data of record to segment file
+        """
+        encoded = name.encode()
+        header = HEADER.pack(MAGIC, kind, mode, len(encoded), size, mtime_ns, crc)
+        with self._lock:
+            if check is not None and not check():
+                return False
+            if self._writer.tell() + len(header) + len(encoded) + size > self.segment_size \
+                    and self._writer.tell() > 0:
+                self._roll()
+            start = self._writer.tell()
+            try:
+                self._writer.write(header + encoded)
+                write(self._writer)
+                self._writer.flush()
+            except BaseException:
+                # torn record would hide all records appended after it from replay
+                self._writer.truncate(start)
+                raise
+            offset = start + HEADER.size + len(encoded)
+            record = Record(kind, name, mode, mtime_ns, offset, size, offset + size)
+            self._apply(self.active, record)
+            segment = self.active
+            # segment may be rolled by other writer before the sync
+            fd = os.dup(self._writer.fileno())
+            self._appended += 1
+            checkpoint = self._appended >= self.checkpoint_interval
+        try:
+            Durability().sync(fd)
+        except BaseException:
+            with self._lock:
+                entry = self.entries.get(name)
+                if kind == PUT and entry and (entry.segment, entry.offset) == (segment, offset):
+                    self._drop_entry(name)
+            raise
+        finally:
+            os.close(fd)
+        if checkpoint:
+            self._checkpoint_in_background()
+        return True
+
+    def _checkpoint_in_background(self):
+        with self._lock:
+            if self._checkpointer is not None and self._checkpointer.is_alive():
+                return
+            self._checkpointer = threading.Thread(target=self._background_checkpoint, name="pack-checkpoint",
+                                                  daemon=True)
+            self._checkpointer.start()
+
+    def _background_checkpoint(self):
+        try:
+            self.checkpoint()
+        except Exception:
+            logging.exception(f"Checkpoint of pack store {self.path} failed")
+
+    def _roll(self):
+        self._writer.close()
+        self.active += 1
+        self._writer = open(self._segment_path(self.active), "ab")
+        Durability().sync_path(self.path)
+        logging.debug(f"Pack store {self.path} rolled to segment {self.active}")
+
+    def put(self, name, data, mode=0o644):
+        """
+        Store object, replaces previous object of the same name
+
+        :param name: name of object
+        :param data: bytes
+        :param mode: permissions of object
+        """
+        self._append(PUT, name, bytes(data), mode)
+
+    def put_stream(self, name, chunks, mode=0o644):
+        """
+        Store object from chunks, size and checksum lead the record, so chunks are spooled to a temporary file first
+
+        :param name: name of object
+        :param chunks: iterable of bytes
+        :param mode: permissions of object
+        """
+        mtime_ns = time.time_ns()
+        crc = _crc(PUT, mode, mtime_ns, name.encode(), b"")
+        size = 0
+        with tempfile.TemporaryFile(dir=self.path) as spool:
+            for chunk in chunks:
+                spool.write(chunk)
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+            spool.seek(0)
+            self._append_record(PUT, name, mode, mtime_ns, size, crc,
+                                lambda writer: shutil.copyfileobj(spool, writer, SPOOL_BUFFER_SIZE))
+
+    def reserve(self, name):
+        """
+        Reserve name of object being created, so no other writer takes it
+
+        :param name: name of object
+        :return: True, if name is neither used nor reserved
+        """
+        with self._lock:
+            if name in self.entries or name in self._reserved:
+                return False
+            self._reserved.add(name)
+            return True
+
+    def release(self, name):
+        with self._lock:
+            self._reserved.discard(name)
+
+    def delete(self, name):
+        """
+        Delete object
+
+        :param name: name of object
+        :return: True, if object was deleted, False if it does not exist
+        """
+        return self._append(DELETE, name, check=lambda: name in self.entries)
+
+    def chmod(self, name, mode):
+        if not self._append(MODE, name, mode=mode, check=lambda: name in self.entries):
+            raise KeyError(name)
+
+    def get(self, name, offset=0, length=None):
+        """
+        Read object or part of it
+
+        :param name: name of object
+        :param offset: position of the first byte in object
+        :param length: max count of bytes, the rest of object if None
+        :return: bytes, if object exists, else raise KeyError
+        """
+        with self._lock:
+            entry = self.entries[name]
+        offset = min(offset, entry.size)
+        length = entry.size - offset if length is None else min(length, entry.size - offset)
+        return self._read(entry.segment, entry.offset + offset, length)
+
+    def open(self, name, chunk_size):
+        """
+        Read object by chunks, object is read as it was at the call, even if it is overwritten
+        or its segment is compacted meanwhile
+
+        :param name: name of object
+        :param chunk_size: size of chunk
+        :return: generator of bytes, if object exists, else raise KeyError
+        """
+        with self._lock:
+            entry = self.entries[name]
+            fd = os.open(self._segment_path(entry.segment), os.O_RDONLY)
+        return _chunks(fd, entry.offset, entry.size, chunk_size)
+
+    def _read(self, segment, offset, length):
+        with self._lock:
+            fd = self._readers.get(segment)
+            if fd is None:
+                fd = self._readers[segment] = os.open(self._segment_path(segment), os.O_RDONLY)
+            # segment may be compacted and its descriptor closed during the read
+            fd = os.dup(fd)
+        try:
+            return os.pread(fd, length, offset)
+        finally:
+            os.close(fd)
+
+    def stat(self, name):
+        """
+        :param name: name of object
+        :return: Entry, if object exists, else raise KeyError
+        """
+        with self._lock:
+            return self.entries[name]
+
+    def names(self):
+        with self._lock:
+            return list(self.entries)
+
+    def checkpoint(self):
+        """
+        Save offsets of live objects, records appended later are replayed on open.
+        Only copy of index is taken under the lock, it is serialised and written without blocking readers and writers
+        """
+        with self._checkpoint_lock:
+            with self._lock:
+                self._writer.flush()
+                segment, offset = self.active, self._writer.tell()
+                entries = dict(self.entries)
+                fd = os.dup(self._writer.fileno())
+                self._appended = 0
+            try:
+                # records of writers still waiting for their sync must not be skipped by replay
+                Durability().sync(fd)
+            finally:
+                os.close(fd)
+            checkpoint = {"segment": segment, "offset": offset,
+                          "entries": {name: list(entry) for name, entry in entries.items()}}
+            Durability().write(os.path.join(self.path, CHECKPOINT), json.dumps(checkpoint))
+
+    def garbage_ratio(self, segment):
+        """
+        :param segment: id of segment
+        :return: share of segment taken by records of overwritten or deleted objects, tombstones and mode changes
+        """
+        size = os.path.getsize(self._segment_path(segment))
+        return 1 - self.live.get(segment, 0) / size if size else 1.0
+
+    def compact(self, ratio):
+        """
+        Rewrite sealed segment with the biggest share of garbage, if the share is at least ratio
+
+        :param ratio: min share of garbage in segment, from 0 to 1
+        :return: id of compacted segment, None if no segment needed compaction
+        """
+        with self._compaction:
+            with self._lock:
+                sealed = [segment for segment in self.segments() if segment != self.active]
+            candidates = [(self.garbage_ratio(segment), segment) for segment in sealed]
+            candidates = [candidate for candidate in candidates if candidate[0] >= ratio]
+            if not candidates:
+                return None
+            _, segment = max(candidates)
+            oldest = segment == sealed[0]
+            for record in _records(self._segment_path(segment)):
+                name = record.name
+                with self._lock:
+                    entry = self.entries.get(name)
+
+                # writers go on meanwhile, record is rewritten only if its object has not changed since
+                def unchanged(entry=entry, name=name):
+                    return self.entries.get(name) is entry
+                if record.kind == PUT and entry and (entry.segment, entry.offset) == (segment, record.offset):
+                    data = self._read(segment, record.offset, record.size)
+                    self._append(PUT, name, data, entry.mode, entry.mtime_ns, check=unchanged)
+                elif record.kind == MODE and entry and entry.segment != segment:
+                    self._append(MODE, name, mode=entry.mode, mtime_ns=entry.ctime_ns, check=unchanged)
+                elif record.kind == DELETE and not oldest and entry is None:
+                    # older segments may still hold the deleted object
+                    self._append(DELETE, name, mtime_ns=record.mtime_ns, check=unchanged)
+            # new places of objects must be saved before the old ones disappear
+            self.checkpoint()
+            with self._lock:
+                fd = self._readers.pop(segment, None)
+                if fd is not None:
+                    os.close(fd)
+                os.remove(self._segment_path(segment))
+                self.live.pop(segment, None)
+            Durability().sync_path(self.path)
+            logging.debug(f"Compacted segment {segment} of pack store {self.path}")
+            return segment
+
+    def close(self):
+        if self._checkpointer is not None:
+            self._checkpointer.join()
+        self.checkpoint()
+        with self._lock:
+            self._writer.close()
+            for fd in self._readers.values():
+                os.close(fd)
+            self._readers.clear()
+            self._owner.close()
+
+
+def _chunks(fd, offset, size, chunk_size):
+    try:
+        for position in range(offset, offset + size, chunk_size):
+            yield os.pread(fd, min(chunk_size, offset + size - position), position)
+    finally:
+        os.close(fd)
+
+
+def _record_size(name, entry):
+    # header and name of live record are not garbage, segment of small objects would never look clean otherwise
+    return HEADER.size + len(name.encode()) + entry.size
+
+
+def _crc(kind, mode, mtime_ns, name, data):
+    crc = zlib.crc32(struct.pack("<BHQ", kind, mode, mtime_ns))
+    return zlib.crc32(data, zlib.crc32(name, crc))
+
+
+def _records(path, start=0, truncate=False):
+    """
+    Read records of segment. Broken record at the end of active segment is torn by a crash,
+    it is cut off, if truncate is set. In sealed segment record with damaged data is skipped,
+    damaged header makes the rest of segment unreadable, so it raises
+
+    :param path: path of segment
+    :param start: offset of first record
+    :return: generator of Record
+    """
+    with open(path, "rb") as file:
+        file.seek(start)
+        position = start
+        while True:
+            header = file.read(HEADER.size)
+            if not header:
+                return
+            record = end = None
+            if len(header) == HEADER.size:
+                magic, kind, mode, name_length, size, mtime_ns, crc = HEADER.unpack(header)
+                name, data = file.read(name_length), file.read(size)
+                if magic == MAGIC and len(name) == name_length and len(data) == size:
+                    offset = position + HEADER.size + name_length
+                    end = offset + size
+                    if _crc(kind, mode, mtime_ns, name, data) == crc:
+                        record = Record(kind, name.decode(), mode, mtime_ns, offset, size, end)
+            if record is None:
+                logging.warning(f"Broken record at {position} of {path}")
+                if truncate:
+                    os.truncate(path, position)
+                    return
+                if end is None:
+                    raise ValueError(f"Broken record header at {position} of {path}")
+                position = end
+                file.seek(position)
+                continue
+            yield record
+            position = record.end
+            file.seek(position)
@@ -1,7 +1,18 @@
-from .file_service import FileService
+from .file_service import FileService, DURATION, OPERATIONS, store, store_stream
+from . import streams
+from .durability import Durability
+from .blob_store import BlobStore
+from . import blob_store
+from . import sidecars
+from .layout import ShardLayout
+from .metadata_index import MetadataIndex, describe, FILE
 import os
+import heapq
+from contextlib import contextmanager
 import logging
 from src import utils
+from src.config import Config
+from src.metrics import instrument
 from datetime import datetime as dt
 from typing import Optional
 
@@ -10,10 +21,186 @@ def _to_dt(time: float) -> str:
     return dt.utcfromtimestamp(time).strftime("%Y-%m-%d %H:%M:%S")
 
 
+@instrument(DURATION, OPERATIONS, "raw")
 class RawFileService(FileService):
-    def __init__(self, workdir="."):
-        self.workdir = workdir
-        os.chdir(self.workdir)
+    on_disk = True
+
+    def __init__(self, root=".", workdir=None):
+        self.root = os.path.abspath(root)
+        self.workdir = self.root
+        self.layout = ShardLayout(Config().shard_depth(), Config().shard_width())
+        if workdir:
+            self.workdir = self.resolve(workdir)
+        self.blobs = BlobStore(Config().objects_path()) if Config().is_deduplicated() else None
+        self.index = MetadataIndex() if Config().is_indexed() else None
+
+    @property
+    def content_addressed(self):
+        return self.blobs is not None
+
+    @property
+    def indexed(self):
+        return self.index is not None
+
+    def resolve(self, filename):
+        """
+        Resolve filename against current directory, path must stay inside of storage root
+
+        :param filename: name of file, relative to current directory or absolute
+        :return: absolute path, if it is inside of storage root, else raise exception
+        """
+        path = os.path.normpath(os.path.join(self.workdir, filename))
+        if path != self.root and not path.startswith(self.root + os.sep):
+            raise ValueError(f"Access denied: {filename}")
+        if self.layout.depth and os.sep not in filename and filename not in ("", ".", ".."):
+            path = self._locate(path)
+        return path
+
+    def _locate(self, path):
+        # file is looked up in its shard, flat path is kept for directories and files not resharded yet
+        sharded = self.layout.path(os.path.dirname(path), os.path.basename(path))
+        if os.path.lexists(sharded) or not os.path.lexists(path):
+            return sharded
+        return path
+
+    def new_name(self):
+        """
+        Reserve name of new file in the current directory, empty file is created exclusively under that name
+
+        :return: unique filename
+        """
+        while True:
+            filename = utils.generate_random(10)
+            path = self.layout.path(self.workdir, filename)
+            if self.layout.depth:
+                if os.path.lexists(os.path.join(self.workdir, filename)):
+                    # flat file is not resharded yet
+                    continue
+                self.layout.makedirs(path)
+            if Durability().reserve(path):
+                logging.debug(f"Generated name: {filename}")
+                return filename
+
+    def discard(self, filename):
+        """
+        Remove reserved name of file which was not written
+
+        :param filename: name of file
+        """
+        path = self.resolve(filename)
+        if os.path.lexists(path):
+            os.remove(path)
+
+    def write_data(self, path, key, content):
+        """
+        Atomically write content of new file
+
+        :param path: absolute path of file
+        :param key: sidecar key of file
+        :param content: str or bytes
+        """
+        Durability().write(path, content)
+
+    def relpath(self, filename):
+        """
+        Get path of file relative to storage root
+
+        :param filename: name of file
+        :return: path relative to storage root
+        """
+        return os.path.relpath(self.resolve(filename), self.root)
+
+    def _logical(self, filename):
+        # path as user sees it, relative to storage root and without shard directories
+        self.resolve(filename)
+        return os.path.relpath(os.path.normpath(os.path.join(self.workdir, filename)), self.root)
+
+    def metadata(self, filename):
+        """
+        Get metadata of file, served from metadata index if it is enabled
+
+        :param filename: name of file
+        :return: FileMetadata, if file exists, else raise exception
+        """
+        logical = self._logical(filename)
+        if self.index is not None:
+            metadata = self.index.get(logical)
+            if metadata is not None and metadata.kind == FILE:
+                return metadata
+        path = self.resolve(filename)
+        if os.path.isfile(path) and (not os.path.isdir(path)):
+            if self.index is None:
+                return describe(path)
+            metadata = describe(path, self.sidecar_key(filename))
+            self.index.put(logical, metadata)
+            return metadata
+        else:
+            raise ValueError(f"Not Found: {filename}")
+
+    def reindex(self, filename):
+        """
+        Refresh metadata index entry of file after it is changed
+
+        :param filename: name of file
+        """
+        if self.index is not None:
+            self.index.put(self._logical(filename), describe(self.resolve(filename), self.sidecar_key(filename)))
+
+    def reconcile(self):
+        """
+        Rebuild metadata index from the whole storage root, needed after out-of-band changes
+
+        :return: count of indexed entries
+        """
+        return MetadataIndex().rebuild(self._walk(self.root))
+
+    def _walk(self, directory):
+        reserved = self.reserved_paths()
+        for entry in list(self.layout.entries(directory)):
+            if entry.name.startswith("."):
+                continue
+            logical = os.path.relpath(os.path.join(directory, entry.name), self.root)
+            if entry.is_dir():
+                yield logical, describe(entry.path)
+                if entry.path not in reserved:
+                    yield from self._walk(entry.path)
+            elif entry.is_file():
+                yield logical, describe(entry.path, os.path.relpath(self._blob_of(entry.path) or entry.path,
+                                                                    self.root))
+
+    def reserved_paths(self):
+        """
+        Get absolute paths of directories of storage root, which keep blobs and sidecars
+
+        :return: set of absolute paths
+        """
+        return self.internal_paths() | {os.path.abspath(path) for path in
+                                        (Config().sig_path(), Config().key_path(), Config().compressed_path())}
+
+    def sidecar_key(self, filename):
+        """
+        Get key of sidecar files (signature, encryption key) of file, all references of one blob share it
+
+        :param filename: name of file
+        :return: path relative to storage root of file or of its blob
+        """
+        path = self.resolve(filename)
+        return os.path.relpath(self._blob_of(path) or path, self.root)
+
+    def released(self, key):
+        """
+        Check whether data of sidecar key is gone, so its sidecar files may be deleted
+
+        :param key: sidecar key
+        :return: True, if nothing is stored under key, else False
+        """
+        return not os.path.lexists(os.path.join(self.root, key))
+
+    def _blob_of(self, path):
+        if self.blobs is None or not os.path.islink(path):
+            return None
+        target = os.path.normpath(os.path.join(os.path.dirname(path), os.readlink(path)))
+        return target if self.blobs.owns(target) else None
 
     def read(self, filename):
         """
@@ -22,13 +209,96 @@ class RawFileService(FileService):
         :param filename: name of file
         :return: file content, if file exists, else raise exception
         """
-        if os.path.isfile(filename) and (not os.path.isdir(filename)):
-            logging.debug(f"Opening: {filename}")
-            with open(filename, 'r') as file:
+        path = self.resolve(filename)
+        if os.path.isfile(path) and (not os.path.isdir(path)):
+            logging.debug(f"Opening: {path}")
+            with open(path, 'r') as file:
                 return file.read()
         else:
             raise ValueError(f"Not Found: {filename}")
 
+    def open_read(self, filename):
+        """
+        Open file from disk by filename for reading by chunks
+
+        :param filename: name of file
+        :return: iterator of bytes, if file exists, else raise exception
+        """
+        path = self.resolve(filename)
+        if os.path.isfile(path) and (not os.path.isdir(path)):
+            logging.debug(f"Opening: {path}")
+            return streams.read_chunks(path)
+        else:
+            raise ValueError(f"Not Found: {filename}")
+
+    @contextmanager
+    def open_buffer(self, filename):
+        """
+        Map file from disk by filename into memory, for callers accepting buffers instead of str.
+        Mapping is closed on exit from the block
+
+        :param filename: name of file
+        :return: memoryview of file content, if file exists, else raise exception
+        """
+        path = self.resolve(filename)
+        if os.path.isfile(path) and (not os.path.isdir(path)):
+            logging.debug(f"Mapping: {path}")
+            with streams.map_file(path) as view:
+                yield view
+        else:
+            raise ValueError(f"Not Found: {filename}")
+
+    def read_at(self, filename, offset, length):
+        """
+        Read part of file from disk
+
+        :param filename: name of file
+        :param offset: position of the first byte
+        :param length: max count of bytes
+        :return: bytes, if file exists, else raise exception
+        """
+        with open(self.get_path(filename), "rb") as file:
+            return os.pread(file.fileno(), length, offset)
+
+    def get_path(self, filename):
+        """
+        Get absolute path of file by filename
+
+        :param filename: name of file
+        :return: absolute path, if file exists, else raise exception
+        """
+        path = self.resolve(filename)
+        if os.path.isfile(path) and (not os.path.isdir(path)):
+            return path
+        else:
+            raise ValueError(f"Not Found: {filename}")
+
+    def stat(self, filename):
+        """
+        Get stat of file by filename
+
+        :param filename: name of file
+        :return: os.stat_result, if file exists, else raise exception
+        """
+        path = self.resolve(filename)
+        if os.path.isfile(path) and (not os.path.isdir(path)):
+            return os.stat(path)
+        else:
+            raise ValueError(f"Not Found: {filename}")
+
+    def get_etag(self, filename):
+        """
+        Get entity tag of file built from inode, size and modification time
+
+        :param filename: name of file
+        :return: entity tag, if file exists, else raise exception
+        """
+        if self.index is not None:
+            metadata = self.metadata(filename)
+            return f"{metadata.ino:x}-{metadata.size:x}-{metadata.mtime_ns:x}"
+        stat = self.stat(filename)
+        return f"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
     def create(self, content):
         """
         Create file with unique file name and desired content
@@ -36,20 +306,141 @@ class RawFileService(FileService):
         :param content: content of created file
         :return: unique filename
         """
-        filename = utils.generate_name(10)
-        logging.debug(f"Generated name: {filename}")
-        with open(filename, "w") as file:
-            file.write(content)
+        return store(self, content)
+
+    def create_from_stream(self, chunks):
+        """
+        Create file with unique file name from chunks, whole content is never held in memory
+
+        :param chunks: iterable or async iterable of bytes
+        :return: unique filename
+        """
+        return store_stream(self, chunks)
+
+    def write_stream(self, path, key, chunks):
+        """
+        Atomically write new file chunk by chunk
+
+        :param path: absolute path of file
+        :param key: sidecar key of file
+        :param chunks: iterable of bytes
+        """
+        Durability().write_stream(path, chunks)
+
+    def spool(self, chunks):
+        """
+        Write chunks to temporary file in blob store and get their content address
+
+        :param chunks: iterable of bytes
+        :return: (path, digest) tuple
+        """
+        os.makedirs(self.blobs.path, exist_ok=True)
+        fd, path = Durability().temp(self.blobs.path, ".spool-")
+        hasher = blob_store.hasher()
+        try:
+            with os.fdopen(fd, "wb") as file:
+                for chunk in chunks:
+                    hasher.update(chunk)
+                    file.write(chunk)
+        except BaseException:
+            os.remove(path)
+            raise
+        return path, hasher.hexdigest()
+
+    def create_from_file(self, path):
+        """
+        Move already written file in the current directory under unique file name
+
+        :param path: path of written file, must be on the same filesystem
+        :return: unique filename
+        """
+        if self.blobs is not None:
+            filename = self.create_blob(blob_store.file_digest(path), lambda blob_path, key: os.rename(path, blob_path))
+            self.reindex(filename)
+            return filename
+        filename = self.new_name()
+        Durability().publish(path, self.resolve(filename), synced=False)
+        self.reindex(filename)
         return filename
 
+    def create_blob(self, digest, write):
+        """
+        Create reference with unique file name in the current directory to content addressed blob
+
+        :param digest: content address
+        :param write: callback taking path and sidecar key of new blob, it writes the content and sidecars,
+                      it is not called if blob is already stored
+        :return: unique filename
+        """
+        key = os.path.relpath(self.blobs.blob_path(digest), self.root)
+        blob = self.blobs.acquire(digest, lambda path: write(path, key))
+        try:
+            filename = self.new_name()
+            path = self.resolve(filename)
+            link = os.path.join(os.path.dirname(path), f".tmp-{utils.generate_random(10)}")
+            os.symlink(os.path.relpath(blob, os.path.dirname(path)), link)
+            Durability().publish(link, path)
+            logging.debug(f"Linked {filename} to {blob}")
+            return filename
+        except BaseException:
+            self.blobs.release(blob)
+            raise
+
     def ls(self):
         """
         Return list of files and directories in the current directory
 
         :return: list of files and directories in the current directory
         """
-        logging.debug(f"Listing directories in current dir")
-        return os.listdir()
+        logging.debug(f"Listing directories in {self.workdir}")
+        if self.index is not None:
+            return self.index.list(os.path.relpath(self.workdir, self.root))
+        if self.layout.depth:
+            return [entry.name for entry in self.layout.entries(self.workdir)]
+        return os.listdir(self.workdir)
+
+    def scan(self, cursor="", limit=None, details=False, hidden=()):
+        """
+        Iterate over the current directory with os.scandir
+
+        With limit, entries come in name order and only limit entries, bigger than cursor, are kept in memory.
+        Without limit, entries come in directory order as they are read from disk.
+
+        :param cursor: name of last entry of previous page, only entries after it are returned
+        :param limit: max count of entries, all entries if None
+        :param details: add type, size and modification time of entry to result
+        :param hidden: absolute paths of entries to skip
+        :return: generator of dicts with name and, if desired, details of entry
+        """
+        logging.debug(f"Scanning {self.workdir} after {cursor!r}, limit {limit}")
+        iterator = self.layout.entries(self.workdir)
+        try:
+            entries = (entry for entry in iterator if entry.name > cursor and entry.path not in hidden)
+            if limit is not None:
+                entries = heapq.nsmallest(limit, entries, key=lambda entry: entry.name)
+            for entry in entries:
+                yield self._describe(entry, details)
+        finally:
+            iterator.close()
+
+    @staticmethod
+    def _describe(entry, details):
+        if not details:
+            return {"name": entry.name}
+        # type comes from d_type of directory record, stat is cached in entry after first call
+        if entry.is_dir():
+            return {"name": entry.name, "type": "dir"}
+        stat = entry.stat()
+        return {"name": entry.name, "type": "file" if entry.is_file() else "other",
+                "size": stat.st_size, "mtime": _to_dt(stat.st_mtime)}
+
+    def internal_paths(self):
+        """
+        Get absolute paths of service directories, which are not user files
+
+        :return: set of absolute paths
+        """
+        return {self.blobs.path} if self.blobs is not None else set()
 
     def cd(self, directory):
         """
@@ -58,10 +449,10 @@ class RawFileService(FileService):
         :param directory: name of directory
         :return: True, if desired directory is valid, else False
         """
-        if os.path.isdir(directory):
-            self.workdir = directory
-            logging.debug(f"Changing dir to: {directory}")
-            os.chdir(directory)
+        path = self.resolve(directory)
+        if os.path.isdir(path):
+            self.workdir = path
+            logging.debug(f"Changing dir to: {path}")
             return True
         else:
             raise ValueError(f"Not Found: {directory}")
@@ -73,9 +464,15 @@ class RawFileService(FileService):
         :param filename: name of file
         :return: True, if file deleted, else False
         """
-        if os.path.isfile(filename) and (not os.path.isdir(filename)):
-            logging.debug(f"Deleting: {filename}")
-            os.remove(filename)
+        path = self.resolve(filename)
+        if os.path.isfile(path) and (not os.path.isdir(path)):
+            logging.debug(f"Deleting: {path}")
+            blob = self._blob_of(path)
+            os.remove(path)
+            if self.index is not None:
+                self.index.remove(self._logical(filename))
+            if blob:
+                self.blobs.release(blob)
             return True
         else:
             raise ValueError(f"Not Found: {filename}")
@@ -87,9 +484,13 @@ class RawFileService(FileService):
         :param filename:
         :return tuple (create_date, modification_date, file size), file exists, else False
         """
-        if os.path.isfile(filename) and (not os.path.isdir(filename)):
-            stat = os.stat(filename)
-            logging.debug(f"Getting metadata: {filename}")
+        if self.index is not None:
+            metadata = self.metadata(filename)
+            return _to_dt(metadata.ctime_ns / 1e9), _to_dt(metadata.mtime_ns / 1e9), metadata.size
+        path = self.resolve(filename)
+        if os.path.isfile(path) and (not os.path.isdir(path)):
+            stat = os.stat(path)
+            logging.debug(f"Getting metadata: {path}")
             return _to_dt(stat.st_ctime), _to_dt(stat.st_mtime), stat.st_size
         else:
             raise ValueError(f"Not Found: {filename}")
@@ -101,9 +502,12 @@ class RawFileService(FileService):
         :param filename: name of file
         :return: permissions (oct), if file is valid, else False
         """
-        if os.path.isfile(filename) and (not os.path.isdir(filename)):
-            logging.debug(f"Getting permissions: {filename}")
-            return oct(os.stat(filename).st_mode)
+        if self.index is not None:
+            return oct(self.metadata(filename).mode)
+        path = self.resolve(filename)
+        if os.path.isfile(path) and (not os.path.isdir(path)):
+            logging.debug(f"Getting permissions: {path}")
+            return oct(os.stat(path).st_mode)
         else:
             raise ValueError(f"Not Found: {filename}")
 
@@ -115,9 +519,24 @@ class RawFileService(FileService):
         :param permissions: permissions of file in UNIX format, e.g 0777
         :return: True, if file is valid, else False
         """
-        if os.path.isfile(filename) and (not os.path.isdir(filename)):
-            logging.debug(f"Setting {permissions} to: {filename}")
-            os.chmod(filename, permissions)
+        path = self.resolve(filename)
+        if os.path.isfile(path) and (not os.path.isdir(path)):
+            logging.debug(f"Setting {permissions} to: {path}")
+            blob = self._blob_of(path)
+            if blob:
+                self._unshare(path, blob)
+            os.chmod(path, permissions)
+            self.reindex(filename)
             return True
         else:
             raise ValueError(f"Not Found: {filename}")
+
+    def _unshare(self, path, blob):
+        # mode of blob is shared by all its references, so reference gets its own copy of content and sidecars,
+        # readers see either the link with sidecars of blob or the copy with its own sidecars
+        key, new_key = os.path.relpath(blob, self.root), os.path.relpath(path, self.root)
+        sidecars.copy(key, new_key)
+        Durability().write_stream(path, streams.read_chunks(blob))
+        logging.debug(f"Copied {blob} to {path}")
+        if self.blobs.release(blob):
+            sidecars.remove(key)
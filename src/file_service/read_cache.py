@@ -0,0 +1,95 @@
+import sys
+import threading
+from collections import OrderedDict
+from src.config import Config
+from src.metrics import Counter, Gauge
+from src.utils import Singleton
+
+HITS = Counter("read_cache_hits_total", "Read cache hits")
+MISSES = Counter("read_cache_misses_total", "Read cache misses")
+EVICTIONS = Counter("read_cache_evictions_total", "Read cache evictions")
+RESIDENT = Gauge("read_cache_bytes", "Bytes of content in read cache")
+
+
+class ReadCache(metaclass=Singleton):
+    """
+    Process-wide LRU cache of verified plain content of files, bounded by total size in bytes.
+    Every entry keeps validator of the stored file, entry with other validator is stale
+    """
+
+    def __init__(self):
+        self.size = Config().read_cache_size()
+        self.max_file_size = Config().read_cache_max_file_size()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.resident = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        HITS.labels().set_function(lambda: self.hits)
+        MISSES.labels().set_function(lambda: self.misses)
+        EVICTIONS.labels().set_function(lambda: self.evictions)
+        RESIDENT.labels().set_function(lambda: self.resident)
+
+    def get(self, key, validator):
+        """
+        Get cached content
+
+        :param key: cache key
+        :param validator: current validator of stored file
+        :return: content, None if it is not cached or stale
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == validator:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            return None
+
+    def put(self, key, validator, content):
+        """
+        Cache content, least recently used entries are evicted to fit the budget
+
+        :param key: cache key
+        :param validator: validator of stored file the content was read from
+        :param content: str or bytes
+        """
+        cost = sys.getsizeof(content)
+        if cost > min(self.size, self.max_file_size):
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = validator, content, cost
+            self.resident += cost
+            while self.resident > self.size:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def remove(self, key):
+        """
+        Drop cached content
+
+        :param key: cache key
+        """
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def _drop(self, key):
+        _, _, cost = self._entries.pop(key)
+        self.resident -= cost
+
+    def stats(self):
+        """
+        :return: dict with hits, misses, hit ratio, evictions, resident bytes and count of entries
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit_ratio": self.hits / requests if requests else 0.0,
+                    "evictions": self.evictions, "resident_bytes": self.resident, "entries": len(self._entries)}
@@ -0,0 +1,70 @@
+from src.config import Config
+from src.crypto import Encryption, Signature
+from .compressed_file_service import MARKER_LABEL
+from .keystore import SQLITE, SqliteKeystore
+from .sidecars import pairs, link as _link
+import logging
+import os
+
+
+def reshard(raw_file_service):
+    """
+    Move files of flat directories into shard directories of configured layout, sidecars are moved with them.
+
+    Server may keep running: every file is linked at its new place together with its sidecars before the old
+    names are removed, and lookups prefer the sharded path as soon as it exists. Interrupted run can be repeated.
+
+    :param raw_file_service: raw file service of storage root, its layout is the target layout
+    :return: count of moved files
+    """
+    root = raw_file_service.root
+    layout = raw_file_service.layout
+    skipped = raw_file_service.reserved_paths()
+    labels = {f".{label}" for label in list(Signature._registry) + list(Encryption._registry) + [MARKER_LABEL]}
+    moved = 0
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        with os.scandir(directory) as iterator:
+            entries = list(iterator)
+        for entry in entries:
+            if entry.name.startswith(".") or entry.path in skipped:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                if not layout.is_shard(entry.path):
+                    pending.append(entry.path)
+                continue
+            if os.path.splitext(entry.name)[1] in labels:
+                # sidecar stored next to data, it is moved with its file
+                continue
+            target = layout.path(directory, entry.name)
+            if target != entry.path:
+                _move(raw_file_service, entry.path, target)
+                moved += 1
+    logging.debug(f"Resharded {moved} files in {root}")
+    return moved
+
+
+def _move(raw_file_service, path, target):
+    blob = raw_file_service._blob_of(path)
+    key, new_key = os.path.relpath(path, raw_file_service.root), os.path.relpath(target, raw_file_service.root)
+    # references share sidecars of their blob, those stay in place
+    sidecars = [] if blob else list(pairs(key, new_key))
+    for sidecar, new_sidecar in sidecars:
+        _link(sidecar, new_sidecar)
+    keystore = SqliteKeystore() if not blob and Config().keystore() == SQLITE else None
+    if keystore is not None:
+        # key kept in keystore is not a file, it must be found under the new name as soon as data is linked there
+        keystore.copy(key, new_key)
+    raw_file_service.layout.makedirs(target)
+    if blob:
+        if not os.path.lexists(target):
+            os.symlink(os.path.relpath(blob, os.path.dirname(target)), target)
+    else:
+        _link(path, target)
+    logging.debug(f"Moved {path} to {target}")
+    os.remove(path)
+    for sidecar, _ in sidecars:
+        os.remove(sidecar)
+    if keystore is not None:
+        keystore.remove(key)
@@ -0,0 +1,121 @@
+from itertools import islice
+from .compressed_file_service import MARKER_LABEL
+from .factory import create_backend
+from src.config import Config
+from src.crypto import Encryption, Signature
+from src.metrics import Counter
+import logging
+import os
+import time
+
+CHECKED = Counter("sidecar_gc_checked_total", "Sidecar files checked by garbage collector")
+REMOVED = Counter("sidecar_gc_removed_total", "Orphaned sidecar files removed by garbage collector")
+
+TEMP_PREFIX = ".tmp-"
+
+
+class SidecarCollector:
+    """
+    Incremental garbage collector of signatures, keys and compression markers whose data file is gone.
+
+    Every step checks one bounded batch of sidecar files, the walk over sidecar directories goes on
+    from the same place on the next step and starts again after the last file. Sidecars are written
+    before their data file, so only sidecars older than min_age are removed, younger ones may belong
+    to create in progress. Left over temporary files of interrupted writes are removed as well.
+    """
+
+    def __init__(self, root):
+        """
+        :param root: storage root, data of sidecar keys is looked up in backend of it
+        """
+        self.backend = create_backend(root)
+        self.batch_size = Config().gc_batch_size()
+        self.min_age = Config().gc_min_age()
+        self._pending = None
+
+    def step(self):
+        """
+        Check next batch of sidecar files and remove orphans
+
+        :return: tuple (count of checked files, count of removed files, True if the walk is finished)
+        """
+        if self._pending is None:
+            self._pending = self._sidecars()
+        checked = removed = 0
+        deadline = time.time() - self.min_age
+        for path, key in islice(self._pending, self.batch_size):
+            checked += 1
+            if self._is_orphan(path, key, deadline) and _remove(path):
+                logging.debug(f"Removed orphaned sidecar {path}")
+                removed += 1
+        CHECKED.labels().inc(checked)
+        REMOVED.labels().inc(removed)
+        finished = checked < self.batch_size
+        if finished:
+            self._pending = None
+        return checked, removed, finished
+
+    def collect(self, interval=0):
+        """
+        Make one full pass over sidecar directories
+
+        :param interval: pause between batches in seconds, bounds the rate of disk operations
+        :return: tuple (count of checked files, count of removed files)
+        """
+        self._pending = None
+        total_checked = total_removed = 0
+        while True:
+            checked, removed, finished = self.step()
+            total_checked += checked
+            total_removed += removed
+            if finished:
+                return total_checked, total_removed
+            time.sleep(interval)
+
+    def _sidecars(self):
+        sidecar_paths = ((Config().sig_path(), list(Signature._registry)),
+                         (Config().key_path(), list(Encryption._registry)),
+                         (Config().compressed_path(), [MARKER_LABEL]))
+        for sidecar_path, labels in sidecar_paths:
+            sidecar_path = os.path.abspath(sidecar_path)
+            pending = [sidecar_path]
+            while pending:
+                directory = pending.pop()
+                try:
+                    with os.scandir(directory) as iterator:
+                        entries = list(iterator)
+                except FileNotFoundError:
+                    continue
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.name.startswith(TEMP_PREFIX):
+                        yield entry.path, None
+                    else:
+                        key = _key(os.path.relpath(entry.path, sidecar_path), labels)
+                        if key is not None:
+                            yield entry.path, key
+
+    def _is_orphan(self, path, key, deadline):
+        try:
+            if os.lstat(path).st_mtime > deadline:
+                return False
+        except FileNotFoundError:
+            return False
+        return key is None or self.backend.released(key)
+
+
+def _key(relpath, labels):
+    # other files, like pem key of hybrid encryption, are never touched
+    for label in labels:
+        if relpath.endswith(f".{label}"):
+            return relpath[:-len(label) - 1]
+    return None
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    return True
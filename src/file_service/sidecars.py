@@ -0,0 +1,65 @@
+from src.config import Config
+from src.crypto import Encryption, Signature
+from .compressed_file_service import marker_filename
+from .keystore import SQLITE, SqliteKeystore
+import os
+
+
+def pairs(key, new_key):
+    """
+    Find sidecar files (signatures, key files and compression marker) of sidecar key
+
+    :param key: sidecar key of file
+    :param new_key: other sidecar key of the same data
+    :return: generator of (sidecar file of key, sidecar file of new key) tuples
+    """
+    for label in Signature._registry:
+        signer = Signature.get_signer_by_label(label)
+        if os.path.exists(signer.sig_filename(key)):
+            yield signer.sig_filename(key), signer.sig_filename(new_key)
+    for label in Encryption._registry:
+        encryptor = Encryption.get_encryptor_by_label(label)
+        if os.path.exists(encryptor.key_name(key)):
+            yield encryptor.key_name(key), encryptor.key_name(new_key)
+    if os.path.exists(marker_filename(key)):
+        yield marker_filename(key), marker_filename(new_key)
+
+
+def link(path, target):
+    """
+    Hard link file under other name, existing link to the same file is kept
+
+    :param path: path of file
+    :param target: new path of file
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(path, target, follow_symlinks=False)
+    except FileExistsError:
+        if not os.path.samefile(path, target):
+            raise
+
+
+def copy(key, new_key):
+    """
+    Make sidecars of key, including key kept in keystore, available under new key as well
+
+    :param key: sidecar key of file
+    :param new_key: other sidecar key of the same data
+    """
+    for sidecar, new_sidecar in pairs(key, new_key):
+        link(sidecar, new_sidecar)
+    if Config().keystore() == SQLITE:
+        SqliteKeystore().copy(key, new_key)
+
+
+def remove(key):
+    """
+    Remove all sidecars of key, including key kept in keystore
+
+    :param key: sidecar key of file whose data is gone
+    """
+    for sidecar, _ in pairs(key, key):
+        os.remove(sidecar)
+    if Config().keystore() == SQLITE:
+        SqliteKeystore().remove(key)
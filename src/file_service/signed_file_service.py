@@ -1,16 +1,65 @@
-from .file_service import FileService
+from .file_service import FileService, DURATION, OPERATIONS, store, store_stream
+from .durability import Durability
+from .compressed_file_service import get_codec
 from src.crypto import Signature
+import logging
 import os
 
 from src.config import Config
+from src.metrics import instrument
 
 
+@instrument(DURATION, OPERATIONS, "signed")
 class SignedFileService(FileService):
     def __init__(self, wrapped_file_service):
         self.wrapped_file_service = wrapped_file_service
-        self.workdir = wrapped_file_service.workdir
         os.makedirs(Config().sig_path(), exist_ok=True)
 
+    @property
+    def workdir(self):
+        return self.wrapped_file_service.workdir
+
+    def resolve(self, filename):
+        return self.wrapped_file_service.resolve(filename)
+
+    def relpath(self, filename):
+        return self.wrapped_file_service.relpath(filename)
+
+    @property
+    def content_addressed(self):
+        return self.wrapped_file_service.content_addressed
+
+    def sidecar_key(self, filename):
+        return self.wrapped_file_service.sidecar_key(filename)
+
+    def released(self, key):
+        return self.wrapped_file_service.released(key)
+
+    def new_name(self):
+        return self.wrapped_file_service.new_name()
+
+    def discard(self, filename):
+        return self.wrapped_file_service.discard(filename)
+
+    @property
+    def indexed(self):
+        return self.wrapped_file_service.indexed
+
+    def metadata(self, filename):
+        return self.wrapped_file_service.metadata(filename)
+
+    def reindex(self, filename):
+        return self.wrapped_file_service.reindex(filename)
+
+    def create_blob(self, digest, write):
+        return self.wrapped_file_service.create_blob(digest, write)
+
+    def spool(self, chunks):
+        return self.wrapped_file_service.spool(chunks)
+
+    def content_size(self, filename):
+        return self.wrapped_file_service.content_size(filename)
+
     def read(self, filename):
         """
             Read signed file from disk and check content
@@ -19,13 +68,54 @@ class SignedFileService(FileService):
             :return: file content, if file exists and not broken, else False
             """
         data = self.wrapped_file_service.read(filename)
+        signer, signature = self._signature(filename)
+        if str(signer(data)) == str(signature):
+            return data
+        else:
+            raise Exception("File is Broken")
+
+    def open_read(self, filename):
+        """
+        Open signed file for reading by chunks, content is checked on the way
+
+        :param filename: name of file
+        :return: iterator of bytes, broken file raises after the last chunk
+        """
+        chunks = self.wrapped_file_service.open_read(filename)
+        signer, signature = self._signature(filename)
+        return signer.verify_stream(chunks, signature)
 
-        signer = Signature().get_signer(filename)
-        with open(signer.sig_filename(filename), 'r') as sig_file:
-            if str(signer(data)) == str(sig_file.read()):
-                return data
-            else:
-                raise Exception("File is Broken")
+    def open_encoded(self, filename, encodings):
+        """
+        Open signed file for reading compressed data as it is stored, content is decompressed
+        on the way only to check it against signature of plain content
+
+        :param filename: name of file
+        :param encodings: accepted content codings of http
+        :return: tuple (content coding, iterator of bytes) or None, broken file raises after the last chunk
+        """
+        encoded = self.wrapped_file_service.open_encoded(filename, encodings)
+        if encoded is None:
+            return None
+        encoding, chunks = encoded
+        signer, signature = self._signature(filename)
+        return encoding, _verify_encoded(signer, signature, get_codec(encoding), chunks)
+
+    def _signature(self, filename):
+        # label from metadata index or configured signer save probing of sidecar files of every signer,
+        # only files signed before signature_algo was changed are probed
+        key = self.sidecar_key(filename)
+        if self.indexed:
+            label = self.metadata(filename).signer
+            if label:
+                signer = Signature.get_signer_by_label(label)
+                return signer, _read_signature(signer, key)
+        signer = Signature().get_default_signer()
+        try:
+            return signer, _read_signature(signer, key)
+        except FileNotFoundError:
+            signer = Signature().get_signer(key)
+            return signer, _read_signature(signer, key)
 
     def create(self, content):
         """
@@ -34,25 +124,74 @@ class SignedFileService(FileService):
         :param content: content of created file
         :return: unique filename
         """
-        filename = self.wrapped_file_service.create(content)
+        return store(self, content)
+
+    def create_from_stream(self, chunks):
+        """
+        Create signed file with unique file name from chunks
+
+        :param chunks: iterable or async iterable of bytes
+        :return: unique filename
+        """
+        return store_stream(self, chunks)
+
+    def write_stream(self, path, key, chunks):
+        """
+        Write file chunk by chunk, signature is written after the last chunk, before the file is published
+
+        :param path: absolute path of file
+        :param key: sidecar key of file
+        :param chunks: iterable of bytes
+        """
+        signer = Signature().get_default_signer()
+        sig_filename = signer.sig_filename(key)
+        os.makedirs(os.path.dirname(sig_filename), exist_ok=True)
+        try:
+            self.wrapped_file_service.write_stream(
+                path, key, signer.sign_stream(chunks, lambda signature: Durability().write(sig_filename, signature)))
+        except BaseException:
+            if os.path.exists(sig_filename):
+                os.remove(sig_filename)
+            raise
+
+    def write_data(self, path, key, content):
+        """
+        Write signature of new file, then the file itself
+
+        :param path: absolute path of file
+        :param key: sidecar key of file
+        :param content: content of file
+        """
         signer = Signature().get_default_signer()
-        sig_filename = signer.sig_filename(filename)
+        sig_filename = signer.sig_filename(key)
+        # tree hash of big content is split between workers of the process pool by signer itself
         sig_content = signer(content)
-        with open(sig_filename, "w") as file:
-            file.write(sig_content)
-        return filename
+        os.makedirs(os.path.dirname(sig_filename), exist_ok=True)
+        Durability().write(sig_filename, sig_content)
+        try:
+            self.wrapped_file_service.write_data(path, key, content)
+        except BaseException:
+            os.remove(sig_filename)
+            raise
 
     def ls(self):
         return self.wrapped_file_service.ls()
 
+    def internal_paths(self):
+        return self.wrapped_file_service.internal_paths() | {os.path.abspath(Config().sig_path())}
+
     def cd(self, directory):
         return self.wrapped_file_service.cd(directory)
 
     def remove(self, filename):
+        key = self.sidecar_key(filename)
         self.wrapped_file_service.remove(filename)
-        signer = Signature().get_signer(filename)
-        sig_filename = signer.sig_filename(filename)
-        self.wrapped_file_service.remove(sig_filename)
+        if self.released(key):
+            # sig file is not a file of layers below, encryption layer would look for its key
+            try:
+                _remove_signature(Signature().get_default_signer(), key)
+            except FileNotFoundError:
+                _remove_signature(Signature().get_signer(key), key)
 
     def read_metadata(self, filename):
         return self.wrapped_file_service.read_metadata(filename)
@@ -60,5 +199,38 @@ class SignedFileService(FileService):
     def get_permissions(self, filename):
         return self.wrapped_file_service.get_permissions(filename)
 
+    def get_etag(self, filename):
+        """
+        Get entity tag of signed file, stored signature is reused as content digest
+
+        :param filename: name of file
+        :return: entity tag
+        """
+        signer, signature = self._signature(filename)
+        return f"{signer.label}-{signature}"
+
     def set_permissions(self, filename, permissions):
-        return self.wrapped_file_service.get_permissions(filename, permissions)
+        return self.wrapped_file_service.set_permissions(filename, permissions)
+
+
+def _read_signature(signer, key):
+    with open(signer.sig_filename(key), 'r') as sig_file:
+        return sig_file.read()
+
+
+def _remove_signature(signer, key):
+    sig_filename = signer.sig_filename(key)
+    logging.debug(f"Deleting: {sig_filename}")
+    os.remove(sig_filename)
+
+
+def _verify_encoded(signer, signature, codec, chunks):
+    hasher = signer.hasher()
+    decompressor = codec.decompressor()
+    for chunk in chunks:
+        hasher.update(decompressor.decompress(chunk))
+        yield chunk
+    if hasattr(decompressor, "flush"):
+        hasher.update(decompressor.flush())
+    if not decompressor.eof or hasher.hexdigest() != signature:
+        raise Exception("File is Broken")
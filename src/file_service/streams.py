@@ -0,0 +1,121 @@
+from contextlib import contextmanager
+from itertools import chain
+from src.config import Config
+import asyncio
+import logging
+import mmap
+import os
+
+
+def read_chunks(path, chunk_size=None):
+    """
+    Read file by fixed size chunks, files above configured mmap threshold are mapped
+    and chunks are memoryviews into the mapping, so nothing is copied
+
+    :param path: path of file
+    :param chunk_size: size of chunk, configured chunk size if None
+    :return: generator of bytes-like objects
+    """
+    chunk_size = chunk_size or Config().chunk_size()
+    threshold = Config().mmap_threshold()
+    with open(path, "rb") as file:
+        if threshold > 0 and os.fstat(file.fileno()).st_size >= threshold:
+            with _mapped(file) as view:
+                for offset in range(0, len(view), chunk_size):
+                    yield view[offset:offset + chunk_size]
+        else:
+            for chunk in iter(lambda: file.read(chunk_size), b""):
+                yield chunk
+
+
+def head(chunks, size):
+    """
+    Read beginning of stream, like header of stored format
+
+    :param chunks: iterable of bytes
+    :param size: count of bytes to read
+    :return: tuple (at most size bytes, iterator of the rest of stream)
+    """
+    chunks = iter(chunks)
+    data = b""
+    for chunk in chunks:
+        data += bytes(chunk)
+        if len(data) >= size:
+            break
+    return data[:size], chain((data[size:],) if len(data) > size else (), chunks)
+
+
+@contextmanager
+def map_file(path):
+    """
+    Map file into memory read only, mapping is closed on exit from the block
+
+    :param path: path of file
+    :return: memoryview of whole file, must not be used after the block
+    """
+    with open(path, "rb") as file:
+        with _mapped(file) as view:
+            yield view
+
+
+@contextmanager
+def _mapped(file):
+    if os.fstat(file.fileno()).st_size == 0:
+        # empty file can not be mapped
+        yield memoryview(b"")
+        return
+    mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mmap, "MADV_SEQUENTIAL"):
+        mapping.madvise(mmap.MADV_SEQUENTIAL)
+    view = memoryview(mapping)
+    try:
+        yield view
+    finally:
+        view.release()
+        try:
+            mapping.close()
+        except BufferError:
+            # consumer still holds a chunk, mapping is unmapped together with the last chunk
+            logging.debug(f"Mapping of {file.name} is still in use")
+
+
+class BlockingIterator:
+    """
+    Iterate over async iterable from synchronous code running in a worker thread.
+    Must be created in the thread of event loop the iterable belongs to.
+    Without running event loop, iterable is driven by own loop of the iterator.
+    """
+
+    def __init__(self, chunks):
+        self.iterator = chunks.__aiter__()
+        try:
+            self.loop = asyncio.get_running_loop()
+            self.own_loop = False
+        except RuntimeError:
+            self.loop = asyncio.new_event_loop()
+            self.own_loop = True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            if self.own_loop:
+                return self.loop.run_until_complete(self.iterator.__anext__())
+            return asyncio.run_coroutine_threadsafe(self.iterator.__anext__(), self.loop).result()
+        except StopAsyncIteration:
+            if self.own_loop:
+                self.loop.close()
+            raise StopIteration
+
+
+def iterate(chunks):
+    """
+    Get synchronous iterator over sync or async iterable of chunks
+
+    :param chunks: iterable or async iterable of bytes
+    :return: iterator of bytes
+    """
+    if isinstance(chunks, BlockingIterator) or not hasattr(chunks, "__aiter__"):
+        return iter(chunks)
+    return BlockingIterator(chunks)
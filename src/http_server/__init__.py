@@ -1 +1,2 @@
-from .http_server import create_web_app
\ No newline at end of file
+from .http_server import create_web_app
+from .supervisor import Supervisor, serve_worker, notify_ready
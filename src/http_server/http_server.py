@@ -1,8 +1,28 @@
-from aiohttp import web
+from aiohttp import hdrs, web
 from src.config import Config
-from src.user_service import UserService
-from src.file_service import RawFileService, SignedFileService, EncryptedFileService
+from src.executor import Executor
+from src.metrics import Counter, Gauge, Histogram, Registry
+from src.user_service import SessionDirectories, UserService
+from src.file_service import ReadCache, create_backend, create_file_service, reconcile_if_empty
+from src.file_service import create_async_file_services, SidecarCollector, open_pack_store, close_pack_stores
+from collections import OrderedDict
+from contextlib import suppress
+import asyncio
+import functools
 import json
+import logging
+import os
+import sys
+import time
+
+REQUESTS = Counter("http_requests_total", "HTTP requests", ("route", "status"))
+IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests in progress", ("route",))
+RECEIVED_BYTES = Counter("http_request_bytes_total", "HTTP request body bytes", ("route",))
+SENT_BYTES = Counter("http_response_bytes_total", "HTTP response body bytes", ("route",))
+LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency", ("route", "status"))
+
+LS_PARAMS = ("limit", "cursor", "details", "hide_internal")
+LS_BATCH = 1000
 
 
 def authorize(func):
@@ -10,8 +30,10 @@ def authorize(func):
         user_service = self.user_service
         try:
             uuid = request.headers['Authorization']
-            user_service.check_authorization(uuid)
+            await self.executor.run_db(user_service.check_authorization, uuid)
             response = await func(self, request, *args, **kwargs)
+        except web.HTTPException:
+            raise
         except (KeyError, ValueError) as e:
             response = web.Response(status=401, text=str(e))
         except Exception as e:
@@ -20,16 +42,258 @@ def authorize(func):
     return wrapped
 
 
+def _route(request):
+    resource = request.match_info.route.resource
+    return resource.canonical if resource is not None else "unmatched"
+
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    route = _route(request)
+    in_flight = IN_FLIGHT.labels(route)
+    in_flight.inc()
+    start = time.perf_counter()
+    status = 500
+    response = None
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        in_flight.dec()
+        LATENCY.labels(route, status).observe(time.perf_counter() - start)
+        REQUESTS.labels(route, status).inc()
+        RECEIVED_BYTES.labels(route).inc(request.content.total_bytes)
+        if response is not None and response.prepared:
+            SENT_BYTES.labels(route).inc(response.body_length)
+        elif response is not None and not isinstance(response, web.FileResponse):
+            SENT_BYTES.labels(route).inc(response.content_length or 0)
+
+
+class _FileResponse(web.FileResponse):
+    """
+    File response which reports sent bytes, it is sent by sendfile after middlewares are finished.
+    Entity tag is the one of file service, so it is the same as on other ways of reading the file
+    """
+
+    def __init__(self, path, etag, **kwargs):
+        self._entity_tag = etag
+        super().__init__(path, **kwargs)
+
+    # aiohttp sets and compares its own tag built from stat of file, it is replaced by tag of file service
+    etag = property(web.FileResponse.etag.fget,
+                    lambda self, value: web.FileResponse.etag.fset(self, self._entity_tag))
+
+    def _etag_match(self, etag_value, etags, *, weak):
+        return web.FileResponse._etag_match(self._entity_tag, etags, weak=weak)
+
+    async def prepare(self, request):
+        writer = await super().prepare(request)
+        SENT_BYTES.labels(_route(request)).inc(self.content_length or 0)
+        return writer
+
+
+async def metrics(request):
+    return web.Response(body=Registry().render().encode(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+def _byte_range(request, size):
+    """
+    Parse Range header of request against content of given size
+
+    :param request: http request
+    :param size: full content size
+    :return: (start, stop) tuple, or None if the whole content is requested
+    """
+    try:
+        requested = request.http_range
+    except ValueError:
+        return None
+    if requested.start is None and requested.stop is None:
+        return None
+    if requested.start is not None and requested.start >= size:
+        raise web.HTTPRequestRangeNotSatisfiable(headers={"Content-Range": f"bytes */{size}"})
+    start, stop, _ = requested.indices(size)
+    return start, stop
+
+
+def _not_modified(request, etag, last_modified):
+    """
+    Evaluate conditional headers of request, If-None-Match takes precedence over If-Modified-Since
+
+    :param request: http request
+    :param etag: current entity tag
+    :param last_modified: current modification time (timestamp)
+    :return: True, if client copy is still valid, else False
+    """
+    if request.if_none_match is not None:
+        return any(match.value in (etag, "*") for match in request.if_none_match)
+    if request.if_modified_since is not None:
+        return int(last_modified) <= request.if_modified_since.timestamp()
+    return False
+
+
+def _accepted_encodings(request):
+    """
+    Parse Accept-Encoding header of request
+
+    :param request: http request
+    :return: set of accepted content codings, codings with zero quality are left out
+    """
+    accepted = set()
+    for item in request.headers.get(hdrs.ACCEPT_ENCODING, "").split(","):
+        coding, _, params = item.partition(";")
+        coding, params = coding.strip().lower(), params.strip().replace(" ", "")
+        if not coding:
+            continue
+        try:
+            quality = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            quality = 1.0
+        if quality > 0:
+            accepted.add(coding)
+    return accepted
+
+
+def _with_validators(response, etag, last_modified):
+    response.etag = etag
+    response.last_modified = last_modified
+    return response
+
+
+def _metadata_validators(metadata):
+    etag = f"{metadata.ino:x}-{metadata.size:x}-{metadata.mtime_ns:x}-{metadata.ctime_ns:x}"
+    return etag, metadata.mtime_ns / 1e9
+
+
+async def _body(request, max_body_size):
+    received = 0
+    async for chunk in request.content.iter_chunked(Config().chunk_size()):
+        received += len(chunk)
+        if received > max_body_size:
+            raise web.HTTPRequestEntityTooLarge(max_body_size, received)
+        yield chunk
+
+
+def _limit(request):
+    if "limit" not in request.query:
+        return None
+    try:
+        limit = int(request.query["limit"])
+    except ValueError:
+        limit = 0
+    if limit <= 0:
+        raise web.HTTPBadRequest(text=f"Invalid limit: {request.query['limit']}")
+    return limit
+
+
+async def _content_sizes(batches, file_service):
+    """
+    Replace stored sizes of files in batches of ls by sizes of their content, layers like compression
+    and encryption change size of stored data. Stored size is kept, if content size is known only after reading
+    """
+    try:
+        async for batch in batches:
+            for entry in batch:
+                if entry.get("type") == "file":
+                    try:
+                        size = await file_service.content_size(entry["name"])
+                    except Exception:
+                        size = None
+                    if size is not None:
+                        entry["size"] = size
+            yield batch
+    finally:
+        await batches.aclose()
+
+
+def _flag(request, name):
+    return request.query.get(name, "0").lower() in ("1", "true", "yes")
+
+
+def _relative_workdir(raw_file_service):
+    """
+    :return: current directory of session relative to storage root, server paths are not exposed
+    """
+    return os.path.relpath(raw_file_service.workdir, Config().storage_root())
+
+
+def _remove_if_exists(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
 class Handler:
 
-    def __init__(self, directory):
-        self.raw_file_service = RawFileService(directory)
-        self.file_service = self.raw_file_service
+    def __init__(self, directory, shared_sessions=False):
+        """
+        :param directory: storage root
+        :param shared_sessions: sessions are served by several worker processes, current directory of session
+            is kept in shared SessionDirectories and read on every request
+        """
+        self.directory = directory
+        self.shared_sessions = shared_sessions
         self.user_service = UserService()
-        if Config().is_encrypted():
-            self.file_service = EncryptedFileService(self.file_service)
-        if Config().is_signed():
-            self.file_service = SignedFileService(self.file_service)
+        self.executor = Executor()
+        self.sessions = OrderedDict()
+        # current directories of sessions relative to storage root, kept apart from cached services
+        self.directories = {}
+        self.io_limiter = asyncio.Semaphore(Config().io_backlog())
+
+    async def _file_services(self, request):
+        """
+        Get file services of request session, each session has its own current directory.
+        Services are cached for max_sessions sessions, current directory is kept apart from them,
+        so it survives eviction of services
+
+        :param request: authorized http request
+        :return: tuple (async raw file service, async top level file service)
+        """
+        uuid = request.headers['Authorization']
+        services = self.sessions.get(uuid)
+        created = services is None
+        if created:
+            raw_file_service = create_backend(self.directory)
+            services = create_async_file_services(raw_file_service, create_file_service(raw_file_service),
+                                                  self.io_limiter)
+            self.sessions[uuid] = services
+            while len(self.sessions) > Config().max_sessions():
+                self.sessions.popitem(last=False)
+        self.sessions.move_to_end(uuid)
+        if created or self.shared_sessions:
+            await self._restore_directory(uuid, services[0])
+        return services
+
+    async def _restore_directory(self, uuid, raw_file_service):
+        # services may be evicted from cache or directory may be changed by another worker
+        path = await self._get_directory(uuid)
+        workdir = os.path.normpath(os.path.join(Config().storage_root(), path or "."))
+        if raw_file_service.workdir != workdir:
+            try:
+                await raw_file_service.cd(workdir)
+            except ValueError:
+                logging.warning(f"Directory {path} of session is not found")
+
+    async def _get_directory(self, uuid):
+        if self.shared_sessions:
+            return await self.executor.run_io(SessionDirectories().get, uuid)
+        return self.directories.get(uuid)
+
+    async def _put_directory(self, uuid, path):
+        if self.shared_sessions:
+            await self.executor.run_io(SessionDirectories().put, uuid, path)
+        else:
+            self.directories[uuid] = path
+
+    async def _remove_directory(self, uuid):
+        if self.shared_sessions:
+            await self.executor.run_io(SessionDirectories().remove, uuid)
+        else:
+            self.directories.pop(uuid, None)
 
     async def login(self, request, *args, **kwargs):
         data = b''
@@ -37,7 +301,7 @@ class Handler:
             data += await request.content.read()
         data = json.loads(data.decode())
         try:
-            uuid = self.user_service.add_session(data['username'], data['password'])
+            uuid = await self.executor.run_db(self.user_service.add_session, data['username'], data['password'])
             response = web.Response(status=200, text=json.dumps({"Authorization": str(uuid)}))
         except Exception as e:
             response = web.Response(status=404, text=str(e))
@@ -49,7 +313,7 @@ class Handler:
             data += await request.content.read()
         data = json.loads(data.decode())
         try:
-            self.user_service.add_user(data['username'], data['password'])
+            await self.executor.run_db(self.user_service.add_user, data['username'], data['password'])
             response = web.Response(status=200, text="Sign Up success")
         except Exception as e:
             response = web.Response(status=406, text=str(e))
@@ -58,7 +322,9 @@ class Handler:
     async def logout(self, request, *args, **kwargs):
         uuid = request.headers["Authorization"]
         try:
-            self.user_service.logout(uuid)
+            await self.executor.run_db(self.user_service.logout, uuid)
+            self.sessions.pop(uuid, None)
+            await self._remove_directory(uuid)
             response = web.Response(status=200, text="Logout success")
         except Exception as e:
             response = web.Response(status=400, text=str(e))
@@ -66,50 +332,237 @@ class Handler:
 
     @authorize
     async def ls(self, request, *args, **kwargs):
-        dir_listing = self.file_service.ls()
-        return web.Response(text=json.dumps(dir_listing))
+        raw_file_service, file_service = await self._file_services(request)
+        if not any(param in request.query for param in LS_PARAMS):
+            dir_listing = await file_service.ls()
+            return web.Response(text=json.dumps(dir_listing))
+        limit = _limit(request)
+        hidden = await file_service.internal_paths() if _flag(request, "hide_internal") else ()
+        batches = raw_file_service.scan(request.query.get("cursor", ""), limit, _flag(request, "details"), hidden,
+                                        LS_BATCH if limit is None else limit)
+        if _flag(request, "details") and file_service is not raw_file_service:
+            batches = _content_sizes(batches, file_service)
+        try:
+            batch = await anext(batches, [])
+            response = web.StreamResponse()
+            response.content_type = "application/x-ndjson"
+            if limit is not None and len(batch) == limit:
+                response.headers["X-Next-Cursor"] = batch[-1]["name"]
+            await response.prepare(request)
+            while batch:
+                await response.write("".join(json.dumps(entry) + "\n" for entry in batch).encode())
+                batch = await anext(batches, [])
+        finally:
+            await batches.aclose()
+        await response.write_eof()
+        return response
 
     @authorize
     async def cd(self, request, *args, **kwargs):
         directory = request.query['dir']
-        cd = self.file_service.cd(directory)
+        raw_file_service, file_service = await self._file_services(request)
+        cd = await file_service.cd(directory)
+        await self._put_directory(request.headers['Authorization'], _relative_workdir(raw_file_service))
         return web.Response(text=str(cd))
 
     @authorize
     async def pwd(self, request, *args, **kwargs):
-        data = {"working_directory": self.file_service.workdir}
+        raw_file_service, _ = await self._file_services(request)
+        data = {"working_directory": _relative_workdir(raw_file_service)}
         return web.Response(text=json.dumps(data))
 
     @authorize
     async def read(self, request, *args, **kwargs):
         filename = request.query['filename']
-        data = {"file_content": self.file_service.read(filename)}
-        return web.Response(text=json.dumps(data))
+        as_json = request.query.get('format') == 'json'
+        raw_file_service, file_service = await self._file_services(request)
+        if not as_json and file_service is raw_file_service and raw_file_service.on_disk:
+            path = await raw_file_service.get_path(filename)
+            etag = await raw_file_service.get_etag(filename)
+            return _FileResponse(path, etag, chunk_size=Config().chunk_size())
+        etag = await file_service.get_etag(filename)
+        metadata = await raw_file_service.metadata(filename)
+        last_modified = metadata.mtime_ns / 1e9
+        if as_json:
+            etag = f"{etag}-json"
+        encoded = None
+        # compressed data is passed through only whole, ranges address content before compression
+        if not as_json and hdrs.RANGE not in request.headers:
+            encodings = _accepted_encodings(request)
+            if encodings:
+                encoded = await file_service.open_encoded(filename, encodings)
+        encoding, size = None, None
+        if encoded:
+            encoding, chunks = encoded
+            etag = f"{etag}-{encoding}"
+        if _not_modified(request, etag, last_modified):
+            if encoded:
+                await chunks.aclose()
+            return _with_validators(web.Response(status=304), etag, last_modified)
+        if as_json:
+            try:
+                data = {"file_content": await file_service.read(filename)}
+            except UnicodeDecodeError as e:
+                # binary file is readable only as octet stream
+                return web.Response(status=415, text=f"File is not text: {e.reason}")
+            return _with_validators(web.Response(text=json.dumps(data)), etag, last_modified)
+        offset = 0
+        if not encoded:
+            size = await file_service.content_size(filename)
+            byte_range = _byte_range(request, size) if size is not None else None
+            # layers able to decrypt a part of file read only the range, others read the whole file
+            chunks = await file_service.open_range(filename, *byte_range) if byte_range else None
+            if chunks is None:
+                chunks = await file_service.open_read(filename)
+            else:
+                offset = byte_range[0]
+        try:
+            return await self._stream(request, chunks, size, etag, last_modified, encoding, offset)
+        finally:
+            await chunks.aclose()
+
+    async def _stream(self, request, chunks, size, etag, last_modified, encoding=None, offset=0):
+        response = _with_validators(web.StreamResponse(), etag, last_modified)
+        response.content_type = "application/octet-stream"
+        if encoding:
+            response.headers[hdrs.CONTENT_ENCODING] = encoding
+            response.headers[hdrs.VARY] = hdrs.ACCEPT_ENCODING
+        if size is None:
+            # size is known only at the end of stream, nothing is held back,
+            # broken stream is cut off before the last chunk of chunked encoding
+            start, stop = 0, sys.maxsize
+            response.enable_chunked_encoding()
+        else:
+            start, stop = 0, size
+            response.headers[hdrs.ACCEPT_RANGES] = "bytes"
+            byte_range = _byte_range(request, size)
+            if byte_range:
+                start, stop = byte_range
+                response.set_status(206)
+                response.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+            response.content_length = stop - start
+        await response.prepare(request)
+        # last byte is held back until the whole file is read, so content of broken file
+        # is never delivered complete, verification of the layers fails at the end of stream.
+        # Chunks may be views of mapped file, they are written before the next one is requested
+        position, last = offset, b""
+        try:
+            async for chunk in chunks:
+                piece = chunk[max(start - position, 0):max(stop - position, 0)]
+                position += len(chunk)
+                if piece and position >= stop:
+                    last, piece = bytes(piece[-1:]), piece[:-1]
+                if piece:
+                    await response.write(piece)
+                del chunk, piece
+        except Exception:
+            logging.exception(f"Failed to stream {request.query['filename']}")
+            response.force_close()
+            if request.transport is not None:
+                request.transport.close()
+            return response
+        await response.write(last)
+        await response.write_eof()
+        return response
 
     @authorize
     async def write(self, request, *args, **kwargs):
-        result = ""
-        stream = request.content
-        while not stream.at_eof():
-            line = await stream.read()
-            result += line.decode("utf-8")
-        filename = self.file_service.create(result)
+        max_body_size = Config().max_body_size()
+        if request.content_length is not None and request.content_length > max_body_size:
+            raise web.HTTPRequestEntityTooLarge(max_body_size, request.content_length)
+        raw_file_service, file_service = await self._file_services(request)
+        if file_service is raw_file_service:
+            spool = await raw_file_service.spool(_body(request, max_body_size))
+            try:
+                filename = await raw_file_service.create_from_file(spool)
+            finally:
+                await raw_file_service.run(_remove_if_exists, spool)
+        else:
+            # body is spooled to disk first, then goes through the layers
+            filename = await file_service.create_from_stream(_body(request, max_body_size))
         data = {"created_file": filename}
         return web.Response(text=json.dumps(data))
 
     @authorize
     async def read_metadata(self, request, *args, **kwargs):
         filename = request.query['filename']
-        creation_date, modification_date, filesize = self.file_service.read_metadata(filename)
+        raw_file_service, file_service = await self._file_services(request)
+        etag, last_modified = _metadata_validators(await raw_file_service.metadata(filename))
+        if _not_modified(request, etag, last_modified):
+            return _with_validators(web.Response(status=304), etag, last_modified)
+        creation_date, modification_date, filesize = await file_service.read_metadata(filename)
         data = {"creation_date": creation_date,
                 "modification_date": modification_date,
                 "file_size": filesize}
+        return _with_validators(web.Response(text=json.dumps(data)), etag, last_modified)
+
+    @authorize
+    async def stats(self, request, *args, **kwargs):
+        data = {"session_cache": self.user_service.session_cache.stats(),
+                "read_cache": ReadCache().stats()}
         return web.Response(text=json.dumps(data))
 
 
-def create_web_app(directory):
-    app = web.Application()
-    handler = Handler(directory)
+async def _sidecar_gc(directory, app):
+    """
+    Run sidecar garbage collector in background while application is running, one batch per interval
+    """
+    collector = SidecarCollector(directory)
+
+    async def collect():
+        while True:
+            try:
+                await Executor().run_io(collector.step)
+            except Exception:
+                logging.exception("Sidecar garbage collection failed")
+            await asyncio.sleep(Config().gc_interval())
+
+    task = asyncio.create_task(collect())
+    yield
+    task.cancel()
+    with suppress(asyncio.CancelledError):
+        await task
+
+
+async def _pack_compaction(app):
+    """
+    Compact pack store in background while application is running, store is closed with application
+    """
+    pack_store = open_pack_store(Config().pack_path())
+
+    async def compact():
+        while True:
+            try:
+                await Executor().run_io(pack_store.compact, Config().pack_compact_ratio())
+            except Exception:
+                logging.exception("Pack store compaction failed")
+            await asyncio.sleep(Config().pack_compact_interval())
+
+    task = asyncio.create_task(compact())
+    yield
+    task.cancel()
+    with suppress(asyncio.CancelledError):
+        await task
+    await Executor().run_io(close_pack_stores)
+
+
+def create_web_app(directory, shared_sessions=False):
+    """
+    :param directory: storage root
+    :param shared_sessions: app is one of several worker processes, sessions are not cached in process
+        and their current directories are shared
+    """
+    Config().set_storage_root(directory)
+    if shared_sessions:
+        # logout in one worker can not evict session cached by another one
+        Config().set_param(Config.SESSION_CACHE, "size", "0")
+    reconcile_if_empty(directory)
+    app = web.Application(middlewares=[metrics_middleware])
+    if Config().backend() == "pack":
+        app.cleanup_ctx.append(_pack_compaction)
+    if Config().is_gc_enabled():
+        app.cleanup_ctx.append(functools.partial(_sidecar_gc, directory))
+    handler = Handler(directory, shared_sessions)
     app.add_routes([
         web.get('/ls', handler.ls),
         web.put('/cd', handler.cd),
@@ -117,6 +570,8 @@ def create_web_app(directory):
         web.get('/read', handler.read),
         web.get('/read_meta', handler.read_metadata),
         web.post('/write', handler.write),
+        web.get('/stats', handler.stats),
+        web.get('/metrics', metrics),
         web.post('/login', handler.login),
         web.post('/logout', handler.logout),
         web.post('/sign_up', handler.sign_up)
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import os
+import select
+import signal
+import time
+from aiohttp import web
+from src.config import Config
+from .http_server import create_web_app
+
+
+def notify_ready(ready_fd):
+    """
+    Report worker readiness to supervisor, supervisor may not wait for it
+
+    :param ready_fd: pipe to report that worker accepts connections
+    """
+    try:
+        os.write(ready_fd, b"1")
+    except BrokenPipeError:
+        pass
+    finally:
+        os.close(ready_fd)
+
+
+def serve_worker(directory, host, port, ready_fd):
+    """
+    Run one web worker on a SO_REUSEPORT socket until SIGTERM or SIGINT
+
+    :param directory: working directory
+    :param host: listening host
+    :param port: listening port
+    :param ready_fd: pipe to report that worker accepts connections
+    """
+    async def serve():
+        runner = web.AppRunner(create_web_app(directory, shared_sessions=True))
+        await runner.setup()
+        site = web.TCPSite(runner, host, port, reuse_port=True)
+        await site.start()
+        notify_ready(ready_fd)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+        loop.add_signal_handler(signal.SIGINT, stop.set)
+        await stop.wait()
+        await runner.cleanup()
+    asyncio.run(serve())
+
+
+class Supervisor:
+    """
+    Pre-fork supervisor: keeps workers alive and does rolling reload on SIGHUP
+    """
+
+    def __init__(self, workers, target, ready_timeout=30, restart_delay=1):
+        """
+        :param workers: number of workers
+        :param target: function run in worker process, receives pipe fd to report readiness
+        :param ready_timeout: seconds to wait for new worker readiness on reload
+        :param restart_delay: seconds between restarts of crashing workers
+        """
+        self.workers = workers
+        self.target = target
+        self.ready_timeout = ready_timeout
+        self.restart_delay = restart_delay
+        self.pids = set()
+        self.stopping = False
+        self.reload_requested = False
+
+    def spawn(self):
+        """
+        Fork new worker
+
+        :return: tuple (pid, read end of readiness pipe)
+        """
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                self.target(ready_write)
+            except BaseException:
+                logging.exception("Worker failed")
+                code = 1
+            finally:
+                os._exit(code)
+        os.close(ready_write)
+        self.pids.add(pid)
+        logging.info(f"Started worker {pid}")
+        return pid, ready_read
+
+    def wait_ready(self, ready_read):
+        """
+        Wait until worker reports readiness
+
+        :param ready_read: read end of readiness pipe
+        :return: True, if worker is ready, else False
+        """
+        try:
+            readable, _, _ = select.select([ready_read], [], [], self.ready_timeout)
+            return bool(readable) and os.read(ready_read, 1) == b"1"
+        finally:
+            os.close(ready_read)
+
+    def start(self):
+        for _ in range(self.workers):
+            _, ready_read = self.spawn()
+            os.close(ready_read)
+
+    def reap(self):
+        """
+        Collect exited workers and restart them, unless supervisor is stopping
+
+        :return: list of exited worker pids
+        """
+        exited = []
+        while self.pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            if pid not in self.pids:
+                continue
+            self.pids.discard(pid)
+            exited.append(pid)
+            if not self.stopping:
+                logging.error(f"Worker {pid} exited with status {status}, restarting")
+                time.sleep(self.restart_delay)
+                _, ready_read = self.spawn()
+                os.close(ready_read)
+        return exited
+
+    def reload(self):
+        """
+        Re-read config file and replace workers one by one, old worker is stopped only when its replacement is ready.
+        Workers are forked from supervisor, so changed code needs restart of supervisor
+        """
+        config = Config()
+        if config.filename:
+            config.load(config.filename)
+        for old_pid in list(self.pids):
+            pid, ready_read = self.spawn()
+            if not self.wait_ready(ready_read):
+                logging.error("New worker is not ready, reload aborted")
+                self.terminate(pid)
+                return
+            self.terminate(old_pid)
+
+    def terminate(self, pid):
+        self.pids.discard(pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+
+    def stop(self):
+        self.stopping = True
+        for pid in list(self.pids):
+            self.terminate(pid)
+
+    def run(self):
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        self.start()
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload()
+            self.reap()
+            time.sleep(0.2)
+        self.stop()
+
+    def _on_reload(self, signum, frame):
+        self.reload_requested = True
+
+    def _on_stop(self, signum, frame):
+        self.stopping = True
@@ -1,12 +1,18 @@
 import argparse
+import functools
 import os
 import yaml
 import logging
 import logging.config
 from aiohttp import web
 from src.config import Config
+from src.executor.benchmark import crossover, crossover_size
 from src.cli_app import ConsoleApp
-from src.http_server import create_web_app
+from src.file_service import RawFileService, SidecarCollector, reshard, migrate_key_files
+from src.http_server import create_web_app, Supervisor, serve_worker
+
+HOST = "0.0.0.0"
+PORT = 8080
 
 
 def console_main(directory):
@@ -36,15 +42,59 @@ def console_main(directory):
             print(f"Error on {command} execution: {ex}")
 
 
-def http_main(directory):
+def http_main(directory, workers=1):
+    if workers > 1 and Config().backend() == "pack":
+        raise ValueError("Pack backend is owned by one process, it can not be shared by workers")
+    if workers > 1:
+        logging.debug(f"Starting {workers} workers on port {PORT}")
+        Supervisor(workers, functools.partial(serve_worker, directory, HOST, PORT)).run()
+        return
     app = create_web_app(directory)
-    web.run_app(app)
+    web.run_app(app, host=HOST, port=PORT)
+
+
+def reshard_main(directory):
+    Config().set_storage_root(directory)
+    moved = reshard(RawFileService(directory))
+    print(f"Moved {moved} files into shards")
+
+
+def reindex_main(directory):
+    Config().set_storage_root(directory)
+    count = RawFileService(directory).reconcile()
+    print(f"Indexed {count} entries")
+
+
+def gc_main(directory):
+    Config().set_storage_root(directory)
+    checked, removed = SidecarCollector(directory).collect(Config().gc_interval())
+    print(f"Checked {checked} sidecars, removed {removed} orphans")
+
+
+def migrate_keys_main(directory):
+    Config().set_storage_root(directory)
+    imported, removed, conflicts = migrate_key_files()
+    print(f"Imported {imported} keys, removed {removed} key files")
+    for path in conflicts:
+        print(f"Kept {path}, it conflicts with key in keystore")
+
+
+def benchmark_main():
+    results = crossover()
+    print(f"{'operation':<12}{'size':>12}{'inline, s':>12}{'parallel, s':>14}")
+    for name, size, inline, parallel in results:
+        print(f"{name:<12}{size:>12}{inline:>12.4f}{parallel:>14.4f}")
+    for name in sorted({result[0] for result in results}):
+        size = crossover_size(results, name)
+        print(f"{name}: parallel is faster from {size} bytes" if size else f"{name}: parallel is never faster")
 
 
 def main():
     parser = argparse.ArgumentParser(description="Restful server")
     parser.add_argument('-d', '--directory', dest='path', help='Set working directory', default='files')
-    parser.add_argument('-m', '--mode', dest='mode', help='Set working mode (web, console)', default='console')
+    parser.add_argument('-m', '--mode', dest='mode', help='Set working mode (web, console, reshard, reindex, gc, migrate-keys, benchmark)', default='console')
+    parser.add_argument('-w', '--workers', dest='workers', type=int, default=1,
+                        help='Number of web worker processes sharing the port, SIGHUP reloads them')
     args = parser.parse_args()
     directory = args.path
     mode = args.mode
@@ -62,4 +112,14 @@ def main():
     if mode == "console":
         console_main(directory)
     elif mode == "web":
-        http_main(directory)
\ No newline at end of file
+        http_main(directory, args.workers)
+    elif mode == "reshard":
+        reshard_main(directory)
+    elif mode == "reindex":
+        reindex_main(directory)
+    elif mode == "gc":
+        gc_main(directory)
+    elif mode == "migrate-keys":
+        migrate_keys_main(directory)
+    elif mode == "benchmark":
+        benchmark_main()
\ No newline at end of file
@@ -0,0 +1,185 @@
+import bisect
+import functools
+import time
+from src.utils import Singleton
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _render_labels(names, values):
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _render_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _sample(name, labels, value):
+    if labels:
+        return f"{name}{{{labels}}} {_render_value(value)}"
+    return f"{name} {_render_value(value)}"
+
+
+class Registry(metaclass=Singleton):
+    """
+    Process-wide collection of metrics rendered in Prometheus text format
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for child in list(metric.children.values()):
+                child.render(metric.name, lines)
+        return "\n".join(lines) + "\n"
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        Registry().register(self)
+
+    def labels(self, *values):
+        """
+        Get child metric for label values, label string is rendered only once per child
+
+        :param values: label values in order of label names
+        :return: child metric
+        """
+        child = self.children.get(values)
+        if child is None:
+            child = self.children.setdefault(values, self._new_child(_render_labels(self.labelnames, values)))
+        return child
+
+    def _new_child(self, labels):
+        raise NotImplementedError
+
+
+class _CounterChild:
+    __slots__ = ("labels", "value", "function")
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.value = 0
+        self.function = None
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def set_function(self, function):
+        """
+        Read value from function on render instead of stored value
+
+        :param function: function without arguments returning current value
+        """
+        self.function = function
+
+    def render(self, name, lines):
+        value = self.function() if self.function else self.value
+        lines.append(_sample(name, self.labels, value))
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _HistogramChild:
+    __slots__ = ("labels", "bounds", "counts", "sum")
+
+    def __init__(self, labels, bounds):
+        self.labels = labels
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def render(self, name, lines):
+        separator = "," if self.labels else ""
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(_sample(f"{name}_bucket", f'{self.labels}{separator}le="{_render_value(bound)}"', cumulative))
+        lines.append(_sample(f"{name}_sum", self.labels, self.sum))
+        lines.append(_sample(f"{name}_count", self.labels, cumulative))
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self, labels):
+        return _CounterChild(labels)
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def _new_child(self, labels):
+        return _GaugeChild(labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        if self.buckets[-1] != float("inf"):
+            self.buckets += (float("inf"),)
+
+    def _new_child(self, labels):
+        return _HistogramChild(labels, self.buckets)
+
+
+def instrument(histogram, methods, *labels):
+    """
+    Class decorator recording duration of methods into histogram,
+    children are labelled with (*labels, method name) and created once at decoration time
+
+    :param histogram: histogram to record durations
+    :param methods: names of methods to instrument
+    :param labels: leading label values
+    :return: class decorator
+    """
+    def decorator(cls):
+        for name in methods:
+            setattr(cls, name, _timed(getattr(cls, name), histogram.labels(*labels, name)))
+        return cls
+    return decorator
+
+
+def _timed(method, child):
+    @functools.wraps(method)
+    def wrapped(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            child.observe(time.perf_counter() - start)
+    return wrapped
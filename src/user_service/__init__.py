@@ -1 +1,3 @@
 from .user_service import UserService
+from .session_cache import SessionCache
+from .session_directories import SessionDirectories
@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from src.config import Config
+from src.metrics import Counter, Gauge
+from src.utils import Singleton
+
+HITS = Counter("session_cache_hits_total", "Session cache hits")
+MISSES = Counter("session_cache_misses_total", "Session cache misses")
+SIZE = Gauge("session_cache_size", "Sessions in session cache")
+
+
+class SessionCache(metaclass=Singleton):
+    """
+    Process-wide LRU cache of validated session uuids,
+    each entry lives until TTL or session expiration
+    """
+
+    def __init__(self):
+        self.size = Config().session_cache_size()
+        self.ttl = Config().session_cache_ttl()
+        self.hits = 0
+        self.misses = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        HITS.labels().set_function(lambda: self.hits)
+        MISSES.labels().set_function(lambda: self.misses)
+        SIZE.labels().set_function(lambda: len(self._sessions))
+
+    def get(self, uuid):
+        """
+        Check if session is cached and still valid
+
+        :param uuid: session uuid
+        :return: True, if session is cached, else False
+        """
+        with self._lock:
+            deadline = self._sessions.get(uuid)
+            if deadline is not None and deadline > time.monotonic():
+                self._sessions.move_to_end(uuid)
+                self.hits += 1
+                return True
+            if deadline is not None:
+                del self._sessions[uuid]
+            self.misses += 1
+            return False
+
+    def put(self, uuid, expiration_date):
+        """
+        Cache validated session
+
+        :param uuid: session uuid
+        :param expiration_date: session expiration date (UTC)
+        """
+        if self.size <= 0:
+            return
+        now = time.monotonic()
+        expires_in = (expiration_date - datetime.utcnow()).total_seconds()
+        with self._lock:
+            self._sessions[uuid] = now + min(self.ttl, expires_in)
+            self._sessions.move_to_end(uuid)
+            while len(self._sessions) > self.size:
+                self._sessions.popitem(last=False)
+
+    def remove(self, uuid):
+        """
+        Drop session from cache
+
+        :param uuid: session uuid
+        """
+        with self._lock:
+            self._sessions.pop(uuid, None)
+
+    def stats(self):
+        """
+        :return: dict with hits, misses and current size of cache
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._sessions)}
@@ -0,0 +1,51 @@
+import os
+import sqlite3
+import threading
+from src.config import Config
+from src.utils import Singleton
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    uuid TEXT PRIMARY KEY,
+    path TEXT NOT NULL
+) WITHOUT ROWID
+"""
+
+
+class SessionDirectories(metaclass=Singleton):
+    """
+    Current directories of sessions in SQLite database under storage root, shared by web workers,
+    so session sees the same directory whichever worker serves its request
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        path = Config().session_dirs_path()
+        if getattr(self._local, "path", None) != path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            connection = sqlite3.connect(path, isolation_level=None, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(SCHEMA)
+            self._local.connection, self._local.path = connection, path
+        return self._local.connection
+
+    def get(self, uuid):
+        """
+        :param uuid: session uuid
+        :return: current directory of session relative to storage root, None if session has not changed it
+        """
+        row = self.connection.execute("SELECT path FROM directories WHERE uuid = ?", (uuid,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, uuid, path):
+        """
+        :param uuid: session uuid
+        :param path: current directory of session relative to storage root
+        """
+        self.connection.execute("INSERT OR REPLACE INTO directories VALUES (?, ?)", (uuid, path))
+
+    def remove(self, uuid):
+        self.connection.execute("DELETE FROM directories WHERE uuid = ?", (uuid,))
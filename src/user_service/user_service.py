@@ -1,10 +1,17 @@
 import psycopg2
+import threading
 import uuid
 from src.config import Config
+from src.metrics import Histogram, instrument
+from .session_cache import SessionCache
 from datetime import datetime, timedelta
 from psycopg2 import sql
 
+DURATION = Histogram("user_service_duration_seconds", "Duration of user service operations", ("operation",))
 
+
+@instrument(DURATION, ("add_user", "get_user_id", "add_session", "check_user", "is_user_exists", "delete_user",
+                       "check_authorization", "is_uuid_exists", "logout"))
 class UserService:
 
     def __init__(self):
@@ -12,8 +19,20 @@ class UserService:
         user = Config().get_param("Database", "username", "postgress")
         password = Config().get_param("Database", "password", "postgress")
         host = Config().get_param("Database", "host", "127.0.0.1")
-        self.connection = psycopg2.connect(dbname=db, user=user, password=password, host=host)
+        self._connection_params = dict(dbname=db, user=user, password=password, host=host)
+        self._local = threading.local()
+        self._local.connection = psycopg2.connect(**self._connection_params)
         self.expiration_time = 60 * 60 * 24
+        self.session_cache = SessionCache()
+
+    @property
+    def connection(self):
+        """
+        Connection owned by the calling thread, so database workers don't share one connection
+        """
+        if not hasattr(self._local, "connection"):
+            self._local.connection = psycopg2.connect(**self._connection_params)
+        return self._local.connection
 
     def add_user(self, username, password):
         if not self.is_user_exists(username):
@@ -61,10 +80,14 @@ class UserService:
     def check_authorization(self, uuid):
         if len(uuid) != 36:
             raise ValueError("Auth token is invalid!")
+        if self.session_cache.get(uuid):
+            return True
         request = sql.SQL(f'''SELECT * from public."Sessions" WHERE "uuid"='{uuid}' ''')
         response = self._execute(request)
         if len(response) > 0:
-            if datetime.strptime(response[0][2][:-3], '%Y-%m-%d %H:%M:%S') > datetime.utcnow():
+            expiration_date = datetime.strptime(response[0][2][:-3], '%Y-%m-%d %H:%M:%S')
+            if expiration_date > datetime.utcnow():
+                self.session_cache.put(uuid, expiration_date)
                 return True
             else:
                 raise ValueError("Session is expired!")
@@ -77,6 +100,7 @@ class UserService:
 
     def logout(self, uuid):
         if self.check_authorization(uuid):
+            self.session_cache.remove(uuid)
             request = sql.SQL(f'''DELETE FROM public."Sessions" WHERE "uuid"='{uuid}' ''')
             self._execute(request)
 
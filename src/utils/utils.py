@@ -16,14 +16,15 @@ def generate_random(length: int) -> str:
     return name
 
 
-def generate_name(length: int) -> str:
+def generate_name(length: int, directory: str = ".") -> str:
     """
     Generate unique filename
 
     :param length: length of name
+    :param directory: directory where name must be unique
     :return: generated name
     """
     name = generate_random(length)
-    while os.path.isfile(name) or os.path.isdir(name):
+    while os.path.isfile(os.path.join(directory, name)) or os.path.isdir(os.path.join(directory, name)):
         name = generate_random(length)
     return name
@@ -0,0 +1,84 @@
+import threading
+import pytest
+from src.executor import Executor
+from src.executor.benchmark import crossover_size
+from src.utils import Singleton
+
+
+@pytest.fixture()
+def executor(mocker):
+    mocker.patch("src.config.Config.io_workers").return_value = 2
+    mocker.patch("src.config.Config.db_workers").return_value = 1
+    mocker.patch("src.config.Config.cpu_workers").return_value = 0
+    Singleton._instances.pop(Executor, None)
+    executor = Executor()
+    yield executor
+    Singleton._instances.pop(Executor, None)
+
+
+async def test_run_io_off_loop_thread(executor):
+    result = await executor.run_io(threading.current_thread)
+
+    assert result is not threading.current_thread()
+    assert result.name.startswith("io")
+
+
+async def test_run_db_off_loop_thread(executor):
+    result = await executor.run_db(threading.current_thread)
+
+    assert result.name.startswith("db")
+
+
+def test_run_cpu_inline_when_disabled(executor):
+    assert executor.cpu_pool is None
+    assert executor.run_cpu(pow, 2, 10) == 1024
+
+
+def test_run_cpu_on_process_pool(mocker):
+    mocker.patch("src.config.Config.cpu_workers").return_value = 1
+    Singleton._instances.pop(Executor, None)
+    executor = Executor()
+    try:
+        assert executor.cpu_pool is not None
+        assert executor.run_cpu(pow, 2, 10) == 1024
+    finally:
+        executor.cpu_pool.shutdown()
+        Singleton._instances.pop(Executor, None)
+
+
+@pytest.fixture()
+def process_executor(mocker):
+    mocker.patch("src.config.Config.cpu_workers").return_value = 2
+    mocker.patch("src.config.Config.parallel_threshold").return_value = 1024
+    Singleton._instances.pop(Executor, None)
+    executor = Executor()
+    yield executor
+    executor.cpu_pool.shutdown()
+    Singleton._instances.pop(Executor, None)
+
+
+def test_map_cpu_inline_when_disabled(executor):
+    assert list(executor.map_cpu(pow, ((2, power) for power in range(5)))) == [1, 2, 4, 8, 16]
+    assert not executor.parallel(1 << 40)
+
+
+def test_map_cpu_keeps_order_on_process_pool(process_executor):
+    assert list(process_executor.map_cpu(pow, ((2, power) for power in range(20)))) == [2 ** power
+                                                                                         for power in range(20)]
+    assert not process_executor.parallel(1023)
+    assert process_executor.parallel(1024)
+
+
+def test_submit_cpu_inline_keeps_exception(executor):
+    future = executor.submit_cpu(int, "not a number")
+
+    with pytest.raises(ValueError):
+        future.result()
+
+
+def test_crossover_size():
+    results = [("aes", 1024, 0.1, 0.2), ("aes", 2048, 0.3, 0.2), ("aes", 4096, 0.5, 0.3),
+               ("sha256tree", 1024, 0.1, 0.05), ("sha256tree", 2048, 0.2, 0.3)]
+
+    assert crossover_size(results, "aes") == 2048
+    assert crossover_size(results, "sha256tree") is None
@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import pytest
+from src.file_service import RawFileService, create_async_file_services
+
+
+@pytest.fixture()
+def services(tmpdir):
+    raw_file_service = RawFileService(str(tmpdir))
+    return create_async_file_services(raw_file_service, raw_file_service, asyncio.Semaphore(2))
+
+
+async def test_raw_stack_shares_async_service(services):
+    raw_file_service, file_service = services
+    assert raw_file_service is file_service
+
+
+async def test_create_and_read(services):
+    _, file_service = services
+    filename = await file_service.create("data")
+
+    assert await file_service.read(filename) == "data"
+    assert await file_service.ls() == [filename]
+
+
+async def test_stream_round_trip(services, mocker):
+    mocker.patch("src.config.Config.chunk_size").return_value = 2
+
+    async def body():
+        yield b"\x00\x01"
+        yield b"\x02"
+
+    _, file_service = services
+    filename = await file_service.create_from_stream(body())
+    chunks = await file_service.open_read(filename)
+    assert [chunk async for chunk in chunks] == [b"\x00\x01", b"\x02"]
+
+
+async def test_open_read_missing(services):
+    _, file_service = services
+    with pytest.raises(ValueError):
+        await file_service.open_read("missing")
+
+
+async def test_scan_batches(services):
+    raw_file_service, _ = services
+    for _ in range(5):
+        await raw_file_service.create("data")
+
+    batches = [batch async for batch in raw_file_service.scan("", None, False, (), 2)]
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+
+
+async def test_limiter_bounds_calls(services):
+    raw_file_service, _ = services
+    running, peak = [0], [0]
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        threading.Event().wait(0.01)
+        with lock:
+            running[0] -= 1
+
+    await asyncio.gather(*(raw_file_service.run(call) for _ in range(10)))
+    assert peak[0] <= 2
+
+
+async def test_stream_is_spooled_before_layers(services, tmpdir):
+    raw_file_service, _ = services
+    received = []
+
+    async def body():
+        yield b"da"
+        # pool thread is not held while the client is slow
+        assert not received
+        yield b"ta"
+
+    def create_from_stream(chunks):
+        received.extend(bytes(chunk) for chunk in chunks)
+        return "created"
+
+    raw_file_service.file_service.create_from_stream = create_from_stream
+    assert await raw_file_service.create_from_stream(body()) == "created"
+    assert b"".join(received) == b"data"
+    assert not [name for name in tmpdir.listdir() if name.basename.startswith(".upload-")]
@@ -0,0 +1,59 @@
+import os
+from src.file_service.blob_store import BlobStore, digest, file_digest
+
+
+def _writer(content):
+    def write(path):
+        with open(path, "w") as file:
+            file.write(content)
+    return write
+
+
+def test_acquire_writes_blob_once(tmpdir):
+    store = BlobStore(str(tmpdir))
+    calls = []
+
+    def write(path):
+        calls.append(path)
+        _writer("data")(path)
+
+    first = store.acquire(digest("data"), write)
+    second = store.acquire(digest("data"), write)
+
+    assert first == second == store.blob_path(digest("data"))
+    assert len(calls) == 1
+    with open(f"{first}.refs") as refs:
+        assert refs.read() == "2"
+
+
+def test_release_deletes_blob_with_last_reference(tmpdir):
+    store = BlobStore(str(tmpdir))
+    blob = store.acquire(digest("data"), _writer("data"))
+    store.acquire(digest("data"), _writer("data"))
+
+    assert not store.release(blob)
+    assert os.path.exists(blob)
+    assert store.release(blob)
+    assert not os.path.exists(blob)
+    assert not os.path.exists(f"{blob}.refs")
+
+
+def test_acquire_failed_write(tmpdir):
+    store = BlobStore(str(tmpdir))
+
+    def write(path):
+        raise OSError("disk full")
+
+    try:
+        store.acquire(digest("data"), write)
+    except OSError:
+        pass
+    blob = store.blob_path(digest("data"))
+    assert not os.path.exists(blob)
+    assert not os.path.exists(f"{blob}.refs")
+
+
+def test_file_digest(tmpdir):
+    (tmpdir / "file").write("data")
+
+    assert file_digest(str(tmpdir / "file"), chunk_size=3) == digest(b"data")
@@ -0,0 +1,76 @@
+import mock
+import pytest
+from src.file_service import CachedFileService, ReadCache
+from src.file_service.metadata_index import FileMetadata, FILE
+from src.utils import Singleton
+
+
+@pytest.fixture()
+def file_service_mock():
+    file_service_mock = mock.Mock()
+    file_service_mock.resolve.side_effect = lambda filename: f"/root/{filename}"
+    file_service_mock.metadata.return_value = FileMetadata(FILE, 4, 1, 1, 0o644, 1, "md5", None)
+    file_service_mock.read.return_value = "data"
+    file_service_mock.open_read.side_effect = lambda filename: iter([b"da", b"ta"])
+    return file_service_mock
+
+
+@pytest.fixture()
+def read_cache(mocker):
+    mocker.patch("src.config.Config.read_cache_size").return_value = 1024 * 1024
+    mocker.patch("src.config.Config.read_cache_max_file_size").return_value = 1024
+    Singleton._instances.pop(ReadCache, None)
+    yield ReadCache()
+    Singleton._instances.pop(ReadCache, None)
+
+
+def test_read_is_cached(file_service_mock, read_cache):
+    service = CachedFileService(file_service_mock)
+
+    assert service.read("bla") == "data"
+    assert service.read("bla") == "data"
+    file_service_mock.read.assert_called_once_with("bla")
+    assert read_cache.stats()["hits"] == 1
+
+
+def test_read_changed_file(file_service_mock, read_cache):
+    service = CachedFileService(file_service_mock)
+    service.read("bla")
+    file_service_mock.metadata.return_value = FileMetadata(FILE, 4, 1, 2, 0o644, 1, "md5", None)
+    file_service_mock.read.return_value = "new!"
+
+    assert service.read("bla") == "new!"
+    assert file_service_mock.read.call_count == 2
+
+
+def test_open_read_cached_after_last_chunk(file_service_mock, read_cache):
+    service = CachedFileService(file_service_mock)
+    chunks = service.open_read("bla")
+    next(chunks)
+    assert read_cache.stats()["entries"] == 0
+    assert list(chunks) == [b"ta"]
+
+    assert list(service.open_read("bla")) == [b"data"]
+    file_service_mock.open_read.assert_called_once_with("bla")
+
+
+def test_open_read_broken_is_not_cached(file_service_mock, read_cache):
+    def broken(filename):
+        yield b"da"
+        raise Exception("File is Broken")
+
+    file_service_mock.open_read.side_effect = broken
+    service = CachedFileService(file_service_mock)
+    with pytest.raises(Exception):
+        list(service.open_read("bla"))
+    assert read_cache.stats()["entries"] == 0
+
+
+def test_remove_invalidates(file_service_mock, read_cache):
+    service = CachedFileService(file_service_mock)
+    service.read("bla")
+    list(service.open_read("bla"))
+
+    service.remove("bla")
+    assert read_cache.stats()["entries"] == 0
+    file_service_mock.remove.assert_called_once_with("bla")
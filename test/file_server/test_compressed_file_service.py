@@ -0,0 +1,151 @@
+import os
+import zlib
+import pytest
+from src.file_service import CompressedFileService, EncryptedFileService, RawFileService, SignedFileService
+from src.file_service.compressed_file_service import (HEADER, MAGIC, SAMPLE_SIZE, choose_codec, compress, get_codec,
+                                                      marker_filename)
+
+TEXT = "compressible content " * 100
+
+
+@pytest.fixture()
+def compression_config(mocker, tmpdir):
+    mocker.patch("src.config.Config.sig_path").return_value = str(tmpdir / "sigs")
+    mocker.patch("src.config.Config.key_path").return_value = str(tmpdir / "keys")
+    mocker.patch("src.config.Config.encryption_type").return_value = "aes"
+    mocker.patch("src.config.Config.chunk_size").return_value = 64
+    mocker.patch("src.config.Config.compressed_path").return_value = str(tmpdir / "compressed")
+    tmpdir.mkdir("files")
+    return str(tmpdir / "files")
+
+
+def test_choose_codec(mocker):
+    mocker.patch("src.config.Config.compression_lzma_min_size").return_value = 4096
+
+    assert choose_codec(b"short", 5).name == "identity"
+    assert choose_codec(os.urandom(2048), 2048).name == "identity"
+    assert choose_codec(TEXT.encode(), len(TEXT)).name == "zlib"
+    assert choose_codec(TEXT.encode(), 8192).name == "lzma"
+    mocker.patch("src.config.Config.compression_codec").return_value = "bz2"
+    assert choose_codec(TEXT.encode(), len(TEXT)).name == "bz2"
+
+
+@pytest.mark.parametrize("codec", ["zlib", "lzma", "bz2"])
+def test_create_read(compression_config, mocker, codec):
+    mocker.patch("src.config.Config.compression_codec").return_value = codec
+    service = CompressedFileService(EncryptedFileService(RawFileService(compression_config)))
+    filename = service.create(TEXT)
+
+    assert service.read(filename) == TEXT
+    assert b"".join(service.open_read(filename)) == TEXT.encode()
+
+
+def test_create_from_stream(compression_config):
+    raw_file_service = RawFileService(compression_config)
+    service = CompressedFileService(raw_file_service)
+    filename = service.create_from_stream(TEXT.encode()[offset:offset + 64] for offset in range(0, len(TEXT), 64))
+
+    assert b"".join(service.open_read(filename)) == TEXT.encode()
+    assert raw_file_service.metadata(filename).size < len(TEXT)
+    assert service.content_size(filename) == len(TEXT)
+    assert service.read_metadata(filename)[2] == len(TEXT)
+    assert b"".join(service.open_range(filename, 5, 30)) == TEXT.encode()[5:30]
+
+
+def test_long_stream_size_is_counted(compression_config, mocker):
+    mocker.patch("src.config.Config.compression_lzma_min_size").return_value = 1024
+    service = CompressedFileService(RawFileService(compression_config))
+    content = TEXT.encode() * 40
+    filename = service.create_from_stream(content[offset:offset + 4096] for offset in range(0, len(content), 4096))
+
+    assert len(content) > SAMPLE_SIZE
+    assert service.content_size(filename) is None
+    assert service.read_metadata(filename)[2] == len(content)
+
+
+def test_unmarked_file_with_magic_is_read_as_it_is(compression_config):
+    raw_file_service = RawFileService(compression_config)
+    content = HEADER.pack(MAGIC, get_codec("zlib").id, 5) + b"plain"
+    filename = raw_file_service.create_from_stream([content])
+    service = CompressedFileService(raw_file_service)
+
+    assert b"".join(service.open_read(filename)) == content
+    assert service.content_size(filename) == len(content)
+    assert service.open_encoded(filename, {"deflate"}) is None
+
+
+def test_marker_is_removed_with_file(compression_config):
+    raw_file_service = RawFileService(compression_config)
+    service = CompressedFileService(raw_file_service)
+    filename = service.create(TEXT)
+    marker = marker_filename(raw_file_service.sidecar_key(filename))
+    assert os.path.exists(marker)
+
+    service.remove(filename)
+
+    assert not os.path.exists(marker)
+
+
+def test_marker_is_removed_if_write_fails(compression_config, mocker, tmpdir):
+    raw_file_service = RawFileService(compression_config)
+    service = CompressedFileService(raw_file_service)
+    mocker.patch.object(raw_file_service, "write_data").side_effect = OSError("disk full")
+
+    with pytest.raises(OSError):
+        service.create(TEXT)
+
+    assert (tmpdir / "compressed").listdir() == []
+
+
+def test_incompressible_is_stored_as_it_is(compression_config):
+    raw_file_service = RawFileService(compression_config)
+    service = CompressedFileService(raw_file_service)
+    content = os.urandom(4096)
+    filename = service.create_from_stream([content])
+
+    assert raw_file_service.metadata(filename).size == len(content) + HEADER.size
+    assert b"".join(service.open_read(filename)) == content
+    assert service.open_encoded(filename, {"deflate"}) is None
+
+
+def test_file_without_header(compression_config):
+    raw_file_service = RawFileService(compression_config)
+    filename = raw_file_service.create(TEXT)
+    service = CompressedFileService(raw_file_service)
+
+    assert service.read(filename) == TEXT
+
+
+def test_open_encoded(compression_config):
+    service = CompressedFileService(RawFileService(compression_config))
+    filename = service.create(TEXT)
+
+    assert service.open_encoded(filename, {"gzip", "xz"}) is None
+    encoding, chunks = service.open_encoded(filename, {"deflate"})
+    assert encoding == "deflate"
+    assert zlib.decompress(b"".join(chunks)) == TEXT.encode()
+
+
+def test_truncated_file_is_broken(compression_config):
+    raw_file_service = RawFileService(compression_config)
+    service = CompressedFileService(raw_file_service)
+    filename = service.create(TEXT)
+    with open(raw_file_service.get_path(filename), "r+b") as file:
+        file.truncate(HEADER.size + 10)
+
+    with pytest.raises(Exception, match="File is Broken"):
+        service.read(filename)
+
+
+def test_signed_open_encoded_is_verified(compression_config):
+    raw_file_service = RawFileService(compression_config)
+    service = SignedFileService(CompressedFileService(raw_file_service))
+    filename = service.create(TEXT)
+    encoding, chunks = service.open_encoded(filename, {"deflate"})
+    assert zlib.decompress(b"".join(chunks)) == TEXT.encode()
+
+    with open(raw_file_service.get_path(filename), "wb") as file:
+        file.write(compress(get_codec("zlib").id, 6, TEXT.upper().encode()))
+    encoding, chunks = service.open_encoded(filename, {"deflate"})
+    with pytest.raises(Exception, match="File is Broken"):
+        list(chunks)
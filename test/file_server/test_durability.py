@@ -0,0 +1,118 @@
+import os
+import threading
+import pytest
+from src.file_service import durability
+from src.file_service.durability import Durability, GroupCommit
+from src.utils import Singleton
+
+
+@pytest.fixture()
+def fsync_policy(mocker):
+    Singleton._instances.pop(Durability, None)
+    yield mocker.patch("src.config.Config.fsync_policy")
+    Singleton._instances.pop(Durability, None)
+
+
+def test_write_replaces_file(fsync_policy, tmpdir):
+    fsync_policy.return_value = "none"
+    (tmpdir / "file").write("old")
+
+    Durability().write(str(tmpdir / "file"), "new")
+
+    assert (tmpdir / "file").read() == "new"
+    assert [path.basename for path in tmpdir.listdir()] == ["file"]
+
+
+def test_write_per_file_fsync(fsync_policy, mocker, tmpdir):
+    fsync_policy.return_value = "per-file"
+    fsync_mock = mocker.patch("os.fsync")
+
+    Durability().write(str(tmpdir / "file"), b"data")
+
+    # file and its directory
+    assert fsync_mock.call_count == 2
+
+
+def test_unknown_policy(fsync_policy):
+    fsync_policy.return_value = "sometimes"
+
+    with pytest.raises(ValueError):
+        Durability()
+
+
+def test_reserve(fsync_policy, tmpdir):
+    fsync_policy.return_value = "none"
+
+    assert Durability().reserve(str(tmpdir / "file"))
+    assert not Durability().reserve(str(tmpdir / "file"))
+
+
+def test_group_commit_batches_concurrent_syncs(mocker, tmpdir):
+    flush_mock = mocker.patch("src.file_service.durability._flush", return_value={})
+    group_commit = GroupCommit(0.1)
+    fds = [os.open(str(tmpdir / f"file{i}"), os.O_CREAT | os.O_WRONLY) for i in range(4)]
+    threads = [threading.Thread(target=group_commit.sync, args=(fd,)) for fd in fds]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for fd in fds:
+        os.close(fd)
+
+    assert flush_mock.call_count == 1
+    assert sorted(flush_mock.call_args[0][0]) == sorted(fds)
+
+
+def test_group_commit_error_is_raised_by_every_writer(mocker, tmpdir):
+    mocker.patch("src.file_service.durability._flush").side_effect = OSError("io error")
+    fd = os.open(str(tmpdir / "file"), os.O_CREAT | os.O_WRONLY)
+
+    with pytest.raises(OSError):
+        GroupCommit(0).sync(fd)
+    os.close(fd)
+
+
+def test_group_commit_file_error_is_raised_by_its_writer(mocker, tmpdir):
+    fds = [os.open(str(tmpdir / f"file{i}"), os.O_CREAT | os.O_WRONLY) for i in range(2)]
+    mocker.patch("src.file_service.durability._flush", return_value={fds[0]: OSError("io error")})
+
+    with pytest.raises(OSError):
+        GroupCommit(0).sync(fds[0])
+    GroupCommit(0).sync(fds[1])
+    for fd in fds:
+        os.close(fd)
+
+
+def test_write_group_commit_syncs_file_and_directory_in_one_window(fsync_policy, mocker, tmpdir):
+    fsync_policy.return_value = "group-commit"
+    flush_mock = mocker.patch("src.file_service.durability._flush", return_value={})
+
+    Durability().write(str(tmpdir / "file"), b"data")
+
+    assert flush_mock.call_count == 1
+    assert len(flush_mock.call_args[0][0]) == 2
+
+
+def test_flush(mocker, tmpdir):
+    fsync_mock = mocker.patch("os.fsync")
+    fdatasync_mock = mocker.patch("src.file_service.durability._fdatasync")
+    fds = [os.open(str(tmpdir / "file"), os.O_CREAT | os.O_WRONLY) for _ in range(2)]
+    fds.append(os.open(str(tmpdir), os.O_RDONLY))
+
+    assert durability._flush(fds) == {}
+    for fd in fds:
+        os.close(fd)
+
+    # file open twice is synced once
+    assert fdatasync_mock.call_count == 1
+    assert fsync_mock.call_count == 1
+
+
+def test_flush_reports_error_of_file(mocker, tmpdir):
+    error = OSError("io error")
+    mocker.patch("src.file_service.durability._fdatasync").side_effect = error
+    fds = [os.open(str(tmpdir / "file"), os.O_CREAT | os.O_WRONLY), os.open(str(tmpdir), os.O_RDONLY)]
+
+    assert durability._flush(fds) == {fds[0]: error}
+    for fd in fds:
+        os.close(fd)
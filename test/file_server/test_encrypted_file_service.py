@@ -6,6 +6,7 @@ from Crypto.Cipher import PKCS1_OAEP
 from Crypto.PublicKey import RSA
 
 from src.file_service import EncryptedFileService
+from src.file_service.encrypted_file_service import HEADER, MAGIC, VERSION
 from src.crypto import Encryption
 from mock import mock_open
 from Crypto import Random
@@ -15,6 +16,12 @@ from Crypto import Random
 def file_service_mock():
     file_service_mock = mock.Mock()
     file_service_mock.workdir = "."
+    file_service_mock.resolve.side_effect = lambda filename: filename
+    file_service_mock.relpath.side_effect = lambda filename: filename
+    file_service_mock.sidecar_key.side_effect = lambda filename: filename
+    file_service_mock.released.return_value = True
+    file_service_mock.content_addressed = False
+    file_service_mock.indexed = False
     return file_service_mock
 
 
@@ -47,12 +54,13 @@ def test_read_encrypted_success(file_service_mock, key_path_mock, rsa_key_mock,
         open_mock = mocker.patch('builtins.open', new_callable=mock_open, read_data=bytes(key))
         handlers = (open_mock.return_value, mock_open(read_data=bytes(encrypted_data)).return_value,)
         open_mock.side_effect = handlers
+        file_service_mock.open_read.return_value = [handlers[1].read()]
 
         result = EncryptedFileService(file_service_mock).read(filename)
 
         assert data == result
         open_mock.assert_any_call(os.path.join(".", f"{filename}.{_}"), "rb")
-        open_mock.assert_any_call(filename, "rb")
+        file_service_mock.open_read.assert_called_with(filename)
 
 
 def test_read_key_file_broken(file_service_mock, key_path_mock, rsa_key_mock, mocker):
@@ -68,12 +76,13 @@ def test_read_key_file_broken(file_service_mock, key_path_mock, rsa_key_mock, mo
         open_mock = mocker.patch('builtins.open', new_callable=mock_open, read_data=data)
         handlers = (open_mock.return_value, mock_open(read_data=bytes(encrypted_data)).return_value,)
         open_mock.side_effect = handlers
+        file_service_mock.open_read.return_value = [handlers[1].read()]
 
         with pytest.raises(Exception):
             EncryptedFileService(file_service_mock).read(filename)
 
         open_mock.assert_any_call(os.path.join(".", f"{filename}.{_}"), "rb")
-        open_mock.assert_any_call(filename, "rb")
+        file_service_mock.open_read.assert_called_with(filename)
 
 
 def test_read_encrypted_data_file_broken(file_service_mock, key_path_mock, rsa_key_mock, mocker):
@@ -89,12 +98,13 @@ def test_read_encrypted_data_file_broken(file_service_mock, key_path_mock, rsa_k
         open_mock = mocker.patch('builtins.open', new_callable=mock_open, read_data=bytes(key))
         handlers = (open_mock.return_value, mock_open(read_data=data).return_value,)
         open_mock.side_effect = handlers
+        file_service_mock.open_read.return_value = [handlers[1].read().encode()]
 
         with pytest.raises(Exception):
             EncryptedFileService(file_service_mock).read(filename)
 
         open_mock.assert_any_call(os.path.join(".", f"{filename}.{_}"), "rb")
-        open_mock.assert_any_call(filename, "rb")
+        file_service_mock.open_read.assert_called_with(filename)
 
 
 def test_read_key_file_is_missing(file_service_mock, key_path_mock, rsa_key_mock, mocker):
@@ -110,11 +120,12 @@ def test_read_key_file_is_missing(file_service_mock, key_path_mock, rsa_key_mock
         open_mock = mocker.patch('builtins.open', new_callable=mock_open, read_data=bytes(key))
         handlers = (open_mock.return_value, mock_open(read_data=bytes(encrypted_data)).return_value,)
         open_mock.side_effect = handlers
+        file_service_mock.open_read.return_value = [handlers[1].read()]
 
         with pytest.raises(Exception):
             EncryptedFileService(file_service_mock).read(filename)
 
-        open_mock.assert_any_call(filename, "rb")
+        file_service_mock.open_read.assert_called_with(filename)
 
 
 def test_read_encrypted_file_when_all_key_files_exists(file_service_mock, key_path_mock, rsa_key_mock, mocker):
@@ -130,6 +141,7 @@ def test_read_encrypted_file_when_all_key_files_exists(file_service_mock, key_pa
         open_mock = mocker.patch('builtins.open', new_callable=mock_open, read_data=bytes(key))
         handlers = (open_mock.return_value, mock_open(read_data=bytes(encrypted_data)).return_value,)
         open_mock.side_effect = handlers
+        file_service_mock.open_read.return_value = [handlers[1].read()]
 
         with pytest.raises(Exception):
             EncryptedFileService(file_service_mock).read(filename)
@@ -150,6 +162,7 @@ def test_read_signed_file_when_other_sig_files_exists(file_service_mock, key_pat
         open_mock = mocker.patch('builtins.open', new_callable=mock_open, read_data=bytes(key))
         handlers = (open_mock.return_value, mock_open(read_data=bytes(encrypted_data)).return_value,)
         open_mock.side_effect = handlers
+        file_service_mock.open_read.return_value = [handlers[1].read()]
 
         with pytest.raises(Exception):
             EncryptedFileService(file_service_mock).read(filename)
@@ -171,30 +184,33 @@ def test_read_encrypted_file_when_pem_key_is_broken(file_service_mock, key_path_
     open_mock = mocker.patch('builtins.open', new_callable=mock_open, read_data=data)
     handlers = (open_mock.return_value, mock_open(read_data=bytes(encrypted_data)).return_value,)
     open_mock.side_effect = handlers
+    file_service_mock.open_read.return_value = [handlers[1].read()]
 
     with pytest.raises(Exception):
         EncryptedFileService(file_service_mock).read(filename)
 
     open_mock.assert_any_call(os.path.join(".", f"{filename}.hybrid"), "rb")
-    open_mock.assert_any_call(filename, "rb")
+    file_service_mock.open_read.assert_called_with(filename)
 
 
-def test_create_encrypted_success(file_service_mock, key_path_mock, mocker):
+def test_create_encrypted_success(file_service_mock, key_path_mock, rsa_key_mock, mocker, tmpdir):
     data = "blabla"
     filename = "bla"
-    open_mock = mock_open()
+    key_path_mock.return_value = str(tmpdir)
     encryption_type_mock = mocker.patch("src.config.Config.encryption_type")
-    generate_name_mock = mocker.patch("src.utils.generate_name")
-    generate_name_mock.return_value = filename
+    file_service_mock.new_name.return_value = filename
     for label in ("aes", "hybrid"):
         encryption_type_mock.return_value = label
-        mocker.patch("builtins.open", open_mock, create=True)
 
         result = EncryptedFileService(file_service_mock).create(data)
 
         assert result == filename
-        open_mock.assert_any_call(filename, "wb")
-        open_mock.assert_called_with(os.path.join(".", f"{filename}.{label}"), "wb")
+        path, key, encrypted_data = file_service_mock.write_data.call_args[0]
+        assert (path, key) == (filename, filename)
+        encryptor = Encryption.get_encryptor_by_label(label)
+        assert encrypted_data[:HEADER.size] == HEADER.pack(MAGIC, VERSION, encryptor.algorithm)
+        with open(str(tmpdir / f"{filename}.{label}"), "rb") as file:
+            assert encryptor.decrypt(encrypted_data[HEADER.size:], file.read()) == data
 
 
 def test_remove_success(file_service_mock, key_path_mock, mocker):
@@ -250,3 +266,203 @@ def test_remove_when_all_key_files_exists(file_service_mock, key_path_mock, mock
             EncryptedFileService(file_service_mock).remove(filename)
 
         file_service_mock.remove.assert_called_with(filename)
+
+
+def test_stream_binary_round_trip(key_path_mock, rsa_key_mock, mocker, tmpdir):
+    from src.file_service import RawFileService, SignedFileService
+    key_path_mock.return_value = str(tmpdir / "keys")
+    mocker.patch("src.config.Config.sig_path").return_value = str(tmpdir / "sigs")
+    mocker.patch("src.config.Config.chunk_size").return_value = 7
+    service = SignedFileService(EncryptedFileService(RawFileService(str(tmpdir.mkdir("files")))))
+    content = bytes(range(256)) * 3
+
+    filename = service.create_from_stream(content[i:i + 100] for i in range(0, len(content), 100))
+
+    with open(str(tmpdir / "files" / filename), "rb") as file:
+        assert file.read() != content
+    assert b"".join(service.open_read(filename)) == content
+
+
+def test_open_read_encrypted_data_broken(key_path_mock, rsa_key_mock, tmpdir):
+    from src.file_service import RawFileService
+    key_path_mock.return_value = str(tmpdir / "keys")
+    service = EncryptedFileService(RawFileService(str(tmpdir.mkdir("files"))))
+    filename = service.create_from_stream([b"data"])
+    with open(str(tmpdir / "files" / filename), "r+b") as file:
+        file.write(b"x")
+
+    with pytest.raises(ValueError):
+        b"".join(service.open_read(filename))
+
+
+def _legacy_encrypt(data):
+    from Crypto.Cipher import AES
+    from src.crypto.encryption import _session_key
+    key = os.urandom(16)
+    aes = AES.new(key, AES.MODE_EAX)
+    encrypted_data, tag = aes.encrypt_and_digest(data)
+    return encrypted_data, _session_key(aes.nonce, tag, key)
+
+
+def test_legacy_file_is_readable(key_path_mock, tmpdir):
+    from src.file_service import RawFileService
+    key_path_mock.return_value = str(tmpdir / "keys")
+    raw_file_service = RawFileService(str(tmpdir.mkdir("files")))
+    service = EncryptedFileService(raw_file_service)
+    encrypted_data, key = _legacy_encrypt(b"old content")
+    filename = raw_file_service.create(encrypted_data)
+    with open(Encryption.get_encryptor_by_label("aes").key_name(filename), "wb") as file:
+        file.write(bytes(key))
+
+    assert service.read(filename) == "old content"
+    assert b"".join(service.open_read(filename)) == b"old content"
+    assert service.content_size(filename) == len(b"old content")
+    assert service.open_range(filename, 0, 3) is None
+
+
+@pytest.mark.parametrize("prefix", [HEADER.pack(MAGIC, VERSION + 1, 1), HEADER.pack(MAGIC, VERSION, 2),
+                                    HEADER.pack(MAGIC, VERSION, 99)])
+def test_legacy_file_beginning_like_header_is_readable(key_path_mock, tmpdir, prefix):
+    from Crypto.Cipher import AES
+    from src.crypto.encryption import _session_key
+    from src.file_service import RawFileService
+    key_path_mock.return_value = str(tmpdir / "keys")
+    raw_file_service = RawFileService(str(tmpdir.mkdir("files")))
+    service = EncryptedFileService(raw_file_service)
+    key, nonce = os.urandom(16), os.urandom(16)
+    # plain text is chosen so that encrypted data begins with prefix
+    keystream = AES.new(key, AES.MODE_EAX, nonce=nonce).encrypt(bytes(len(prefix)))
+    content = bytes(a ^ b for a, b in zip(prefix, keystream)) + b"old content"
+    aes = AES.new(key, AES.MODE_EAX, nonce=nonce)
+    encrypted_data, tag = aes.encrypt_and_digest(content)
+    assert encrypted_data.startswith(prefix)
+    filename = raw_file_service.create(encrypted_data)
+    with open(Encryption.get_encryptor_by_label("aes").key_name(filename), "wb") as file:
+        file.write(bytes(_session_key(nonce, tag, key)))
+
+    assert b"".join(service.open_read(filename)) == content
+    assert service.content_size(filename) == len(content)
+
+
+@pytest.mark.parametrize("label", ["aes", "hybrid"])
+def test_open_range_reads_covering_chunks(key_path_mock, rsa_key_mock, mocker, tmpdir, label):
+    from src.file_service import RawFileService
+    key_path_mock.return_value = str(tmpdir / "keys")
+    mocker.patch("src.config.Config.encryption_type").return_value = label
+    mocker.patch("src.config.Config.encryption_chunk_size").return_value = 100
+    raw_file_service = RawFileService(str(tmpdir.mkdir("files")))
+    service = EncryptedFileService(raw_file_service)
+    content = os.urandom(1000)
+    filename = service.create_from_stream(content[i:i + 64] for i in range(0, len(content), 64))
+
+    assert raw_file_service.metadata(filename).size == HEADER.size + 1000 + 10 * 16
+    assert service.content_size(filename) == 1000
+    assert service.read_metadata(filename)[2] == 1000
+    read_at = mocker.spy(raw_file_service, "read_at")
+    assert b"".join(service.open_range(filename, 250, 420)) == content[250:420]
+    assert [call.args[1] for call in read_at.call_args_list] == [0] + [HEADER.size + i * 116 for i in (2, 3, 4)]
+    assert b"".join(service.open_range(filename, 990, 1000)) == content[990:]
+
+
+def test_truncated_at_chunk_boundary_is_broken(key_path_mock, mocker, tmpdir):
+    from src.file_service import RawFileService
+    key_path_mock.return_value = str(tmpdir / "keys")
+    mocker.patch("src.config.Config.encryption_chunk_size").return_value = 100
+    raw_file_service = RawFileService(str(tmpdir.mkdir("files")))
+    service = EncryptedFileService(raw_file_service)
+    filename = service.create(b"x" * 300)
+    os.truncate(raw_file_service.get_path(filename), HEADER.size + 2 * 116)
+
+    with pytest.raises(ValueError):
+        b"".join(service.open_read(filename))
+    with pytest.raises(ValueError):
+        b"".join(service.open_range(filename, 150, 200))
+
+
+def test_hybrid_wraps_data_key_once_per_epoch(key_path_mock, rsa_key_mock, mocker):
+    from src.crypto import Keyring
+    from src.utils import Singleton
+    master = mocker.patch("src.crypto.encryption.HybridEncryption.rsa_key")
+    master.encrypt = mock.Mock(side_effect=rsa_key_mock.encrypt)
+    master.decrypt = mock.Mock(side_effect=rsa_key_mock.decrypt)
+    encryptor = Encryption.get_encryptor_by_label("hybrid")
+
+    encrypted = [encryptor.encrypt(f"data {i}") for i in range(5)]
+    Singleton._instances.pop(Keyring, None)
+    assert [encryptor.decrypt(data, key) for data, key in encrypted] == [f"data {i}" for i in range(5)]
+    assert master.encrypt.call_count == 1
+    assert master.decrypt.call_count == 1
+
+    Keyring().rotate()
+    rotated_data, rotated_key = encryptor.encrypt("rotated")
+    assert master.encrypt.call_count == 2
+    # wrapped data key follows envelope header
+    assert rotated_key[6:134] != encrypted[0][1][6:134]
+    assert encrypted[1][1][6:134] == encrypted[0][1][6:134]
+    assert encryptor.decrypt(rotated_data, rotated_key) == "rotated"
+    assert encryptor.decrypt(*encrypted[0]) == "data 0"
+
+
+def test_hybrid_legacy_key_is_readable(key_path_mock, rsa_key_mock):
+    encryptor = Encryption.get_encryptor_by_label("hybrid")
+    encrypted_data, session_key = _legacy_encrypt(b"old content")
+
+    assert encryptor.decrypt(encrypted_data, rsa_key_mock.encrypt(bytes(session_key))) == "old content"
+
+
+def test_keyring_loads_master_key_once(mocker, tmpdir):
+    from src.crypto import Keyring
+    pem_path = str(tmpdir / "key.pem")
+    master = Keyring().master(pem_path)
+    import_key = mocker.patch("src.crypto.keyring.RSA.import_key")
+
+    assert os.path.exists(pem_path)
+    assert Keyring().master(pem_path) is master
+    import_key.assert_not_called()
+
+
+def test_header_names_encryptor_without_probing(key_path_mock, rsa_key_mock, mocker, tmpdir):
+    from src.file_service import RawFileService
+    key_path_mock.return_value = str(tmpdir / "keys")
+    service = EncryptedFileService(RawFileService(str(tmpdir.mkdir("files"))))
+    encryption_type = mocker.patch("src.config.Config.encryption_type")
+    filenames = []
+    for label in ("aes", "hybrid"):
+        encryption_type.return_value = label
+        filenames.append(service.create_from_stream([b"data"]))
+    get_encryptor = mocker.patch("src.crypto.Encryption.get_encryptor")
+
+    for filename in filenames:
+        assert service.read(filename) == "data"
+        assert b"".join(service.open_read(filename)) == b"data"
+        assert service.content_size(filename) == 4
+    get_encryptor.assert_not_called()
+
+
+def test_encryptors_are_shared():
+    assert Encryption.get_encryptor_by_label("aes") is Encryption.get_encryptor_by_label("aes")
+    assert Encryption.get_encryptor_by_algorithm(2) is Encryption.get_encryptor_by_label("hybrid")
+    assert Encryption.get_encryptor_by_label("unknown") is None
+
+
+@pytest.mark.parametrize("size", [0, 100, 1024, 1000])
+def test_parallel_encryption_matches_inline(mocker, size):
+    from src.crypto.encryption import _seal, _seal_parallel
+    from src.executor import Executor
+    from src.utils import Singleton
+    mocker.patch("src.config.Config.cpu_workers").return_value = 2
+    mocker.patch("src.config.Config.parallel_threshold").return_value = 256
+    mocker.patch("src.config.Config.parallel_segment_size").return_value = 200
+    mocker.patch("src.config.Config.encryption_chunk_size").return_value = 64
+    Singleton._instances.pop(Executor, None)
+    key = Random.get_random_bytes(16)
+    data = os.urandom(size)
+    try:
+        encrypted_data = b"".join(_seal_parallel(key, 64, [data[offset:offset + 50] for offset in range(0, size, 50)]))
+        assert encrypted_data == b"".join(_seal(key, 64, (data,)))
+        encryptor = Encryption.get_encryptor_by_label("aes")
+        encrypted_data, session_key = encryptor.encrypt(data)
+        assert b"".join(encryptor.decrypt_stream((encrypted_data,), session_key)) == data
+    finally:
+        Executor().cpu_pool.shutdown()
+        Singleton._instances.pop(Executor, None)
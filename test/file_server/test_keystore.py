@@ -0,0 +1,89 @@
+import os
+import threading
+import pytest
+from src.crypto import Encryption
+from src.file_service import EncryptedFileService, RawFileService, SqliteKeystore, migrate_key_files
+from src.utils import Singleton
+
+
+@pytest.fixture()
+def storage(mocker, tmpdir):
+    mocker.patch("src.config.Config.key_path").return_value = str(tmpdir / "keys")
+    mocker.patch("src.config.Config.encryption_type").return_value = "aes"
+    mocker.patch("src.config.Config.encryption_chunk_size").return_value = 64
+    mocker.patch("src.config.Config.keystore_batch_window").return_value = 0.01
+    Singleton._instances.pop(SqliteKeystore, None)
+    tmpdir.mkdir("files")
+    yield str(tmpdir / "files")
+    Singleton._instances.pop(SqliteKeystore, None)
+
+
+def test_sqlite_keystore_round_trip(storage, mocker, tmpdir):
+    mocker.patch("src.config.Config.keystore").return_value = "sqlite"
+    service = EncryptedFileService(RawFileService(storage))
+    content = "keystore content " * 20
+    filename = service.create(content)
+
+    assert service.read(filename) == content
+    assert b"".join(service.open_range(filename, 100, 150)) == content.encode()[100:150]
+    assert all(name.startswith(".keys.sqlite") for name in os.listdir(str(tmpdir / "keys")))
+    assert SqliteKeystore().hits > 0
+
+    service.remove(filename)
+    with pytest.raises(Exception, match="Encryptor is not found"):
+        SqliteKeystore().find(filename)
+
+
+def test_stale_cached_key_is_not_used(storage, mocker):
+    mocker.patch("src.config.Config.keystore").return_value = "sqlite"
+    keystore = SqliteKeystore()
+    encryptor = Encryption.get_encryptor_by_label("aes")
+    keystore.put(encryptor, "blob", b"old")
+    assert keystore.get(encryptor, "blob", lambda: 1) == b"old"
+
+    # another worker process replaces the key, this process sees new validator of data file
+    keystore.connection.execute("UPDATE keys SET value = ? WHERE key = ?", (b"new", "blob"))
+    assert keystore.get(encryptor, "blob", lambda: 1) == b"old"
+    assert keystore.get(encryptor, "blob", lambda: 2) == b"new"
+    with pytest.raises(FileNotFoundError):
+        keystore.get(Encryption.get_encryptor_by_label("hybrid"), "blob")
+
+
+def test_concurrent_puts_are_batched(storage, mocker):
+    mocker.patch("src.config.Config.keystore").return_value = "sqlite"
+    keystore = SqliteKeystore()
+    encryptor = Encryption.get_encryptor_by_label("aes")
+    commit_spy = mocker.spy(keystore, "_commit")
+    threads = [threading.Thread(target=keystore.put, args=(encryptor, f"file{index}", bytes([index])))
+               for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [keystore.get(encryptor, f"file{index}") for index in range(8)] == [bytes([index]) for index in range(8)]
+    assert commit_spy.call_count < 8
+
+
+def test_migrate_key_files(storage, mocker, tmpdir):
+    service = EncryptedFileService(RawFileService(storage))
+    contents = [f"content {index}" for index in range(3)]
+    filenames = [service.create(content) for content in contents]
+    assert len(os.listdir(str(tmpdir / "keys"))) == 3
+
+    assert migrate_key_files() == (3, 3, [])
+    mocker.patch("src.config.Config.keystore").return_value = "sqlite"
+    service = EncryptedFileService(RawFileService(storage))
+
+    assert [service.read(filename) for filename in filenames] == contents
+    assert not any(name.endswith(".aes") for name in os.listdir(str(tmpdir / "keys")))
+
+
+def test_migrate_keeps_conflicting_key_files(storage, mocker, tmpdir):
+    service = EncryptedFileService(RawFileService(storage))
+    filename = service.create("content")
+    key_file = os.path.join(str(tmpdir / "keys"), f"{filename}.aes")
+    SqliteKeystore().import_keys([(filename, "aes", b"left by earlier run")])
+
+    assert migrate_key_files() == (0, 0, [key_file])
+    assert os.path.isfile(key_file)
@@ -0,0 +1,72 @@
+import os
+import pytest
+from src.file_service import RawFileService, create_file_service
+from src.file_service.metadata_index import MetadataIndex, FileMetadata
+
+
+@pytest.fixture()
+def index_config(mocker, tmpdir):
+    mocker.patch("src.config.Config.is_indexed").return_value = True
+    mocker.patch("src.config.Config.index_path").return_value = str(tmpdir / ".metadata.sqlite")
+
+
+def test_put_get_remove(index_config):
+    metadata = FileMetadata("file", 4, 1, 2, 0o100644, 3, "md5", None)
+
+    MetadataIndex().put(os.path.join("dir", "name"), metadata)
+
+    assert MetadataIndex().get(os.path.join("dir", "name")) == metadata
+    assert MetadataIndex().list("dir") == ["name"]
+    MetadataIndex().remove(os.path.join("dir", "name"))
+    assert MetadataIndex().get(os.path.join("dir", "name")) is None
+
+
+def test_metadata_served_from_index(index_config, mocker, tmpdir):
+    raw_file_service = RawFileService(str(tmpdir))
+    filename = raw_file_service.create("data")
+    stat_mock = mocker.patch("os.stat")
+
+    assert raw_file_service.read_metadata(filename)[2] == 4
+    assert raw_file_service.get_permissions(filename) == oct(os.lstat(str(tmpdir / filename)).st_mode)
+    assert raw_file_service.ls() == [filename]
+    stat_mock.assert_not_called()
+
+
+def test_index_follows_changes(index_config, tmpdir):
+    raw_file_service = RawFileService(str(tmpdir))
+    filename = raw_file_service.create("data")
+
+    raw_file_service.set_permissions(filename, 0o600)
+    assert raw_file_service.get_permissions(filename) == oct(0o100600)
+    raw_file_service.remove(filename)
+    assert raw_file_service.ls() == []
+
+
+def test_reconcile(index_config, tmpdir):
+    raw_file_service = RawFileService(str(tmpdir))
+    filename = raw_file_service.create("data")
+    os.remove(str(tmpdir / filename))
+    tmpdir.mkdir("dir")
+    (tmpdir / "dir" / "file").write("data")
+
+    assert raw_file_service.reconcile() == 2
+
+    assert raw_file_service.ls() == ["dir"]
+    raw_file_service.cd("dir")
+    assert raw_file_service.read_metadata("file")[2] == 4
+
+
+def test_signer_label_indexed(index_config, mocker, tmpdir):
+    mocker.patch("src.config.Config.is_signed").return_value = True
+    mocker.patch("src.config.Config.is_encrypted").return_value = False
+    mocker.patch("src.config.Config.sig_path").return_value = str(tmpdir / "sigs")
+    mocker.patch("src.config.Config.signature_algo").return_value = "sha256"
+    raw_file_service = RawFileService(str(tmpdir))
+    file_service = create_file_service(raw_file_service)
+
+    filename = file_service.create("data")
+
+    assert raw_file_service.metadata(filename).signer == "sha256"
+    get_signer_mock = mocker.patch("src.crypto.Signature.get_signer")
+    assert file_service.read(filename) == "data"
+    get_signer_mock.assert_not_called()
@@ -0,0 +1,109 @@
+import os
+import pytest
+from src.file_service import (PackFileService, SignedFileService, EncryptedFileService, close_pack_stores,
+                              create_backend)
+
+
+@pytest.fixture()
+def pack_config(mocker, tmpdir):
+    mocker.patch("src.config.Config.backend").return_value = "pack"
+    mocker.patch("src.config.Config.pack_path").return_value = str(tmpdir / "packs")
+    mocker.patch("src.config.Config.sig_path").return_value = str(tmpdir / "sigs")
+    mocker.patch("src.config.Config.key_path").return_value = str(tmpdir / "keys")
+    mocker.patch("src.config.Config.encryption_type").return_value = "aes"
+    yield
+    close_pack_stores()
+
+
+def test_backend_from_config(pack_config, tmpdir):
+    assert isinstance(create_backend(str(tmpdir)), PackFileService)
+
+
+def test_create_read_remove(pack_config, tmpdir):
+    service = PackFileService(str(tmpdir))
+    filename = service.create("data")
+
+    assert service.read(filename) == "data"
+    assert service.ls() == [filename]
+    assert service.read_metadata(filename)[2] == 4
+    service.remove(filename)
+    with pytest.raises(ValueError):
+        service.read(filename)
+    assert service.ls() == []
+
+
+def test_create_from_file_and_open_read_by_chunks(pack_config, mocker, tmpdir):
+    mocker.patch("src.config.Config.chunk_size").return_value = 4
+    upload = tmpdir / "upload"
+    upload.write_binary(b"0123456789")
+    service = PackFileService(str(tmpdir))
+    filename = service.create_from_file(str(upload))
+    chunks = service.open_read(filename)
+    first = next(chunks)
+    # object is read as it was opened
+    service.store.put(filename, b"overwritten")
+
+    assert [first, *chunks] == [b"0123", b"4567", b"89"]
+    assert service.read(filename) == "overwritten"
+
+
+def test_permissions_survive_reopen(pack_config, tmpdir):
+    service = PackFileService(str(tmpdir))
+    filename = service.create("data")
+    service.set_permissions(filename, 0o600)
+    close_pack_stores()
+
+    service = PackFileService(str(tmpdir))
+    assert service.get_permissions(filename) == oct(0o100600)
+    assert service.read(filename) == "data"
+
+
+def test_names_must_be_flat(pack_config, tmpdir):
+    service = PackFileService(str(tmpdir))
+    with pytest.raises(ValueError):
+        service.read("../etc/passwd")
+    with pytest.raises(ValueError):
+        service.cd("dir")
+
+
+def test_remove_only_deletes_sidecar_paths(pack_config, tmpdir):
+    outside = tmpdir / "outside.txt"
+    outside.write("keep")
+    service = PackFileService(str(tmpdir))
+
+    with pytest.raises(ValueError, match="Access denied"):
+        service.remove(str(outside))
+    with pytest.raises(ValueError, match="Access denied"):
+        service.remove(str(tmpdir / "sigs" / ".." / "outside.txt"))
+    assert outside.read() == "keep"
+
+
+def test_signed_encrypted_stack(pack_config, tmpdir):
+    service = SignedFileService(EncryptedFileService(PackFileService(str(tmpdir))))
+    filename = service.create("secret")
+    streamed = service.create_from_stream([b"\x00", b"\xff"])
+
+    assert service.read(filename) == "secret"
+    assert b"".join(service.open_read(streamed)) == b"\x00\xff"
+    assert os.listdir(str(tmpdir / "packs")) != []
+    assert not os.path.exists(str(tmpdir / filename))
+
+
+
+@pytest.mark.parametrize("layer, sidecars", [(SignedFileService, "sigs"), (EncryptedFileService, "keys")])
+def test_remove_with_sidecar(pack_config, tmpdir, layer, sidecars):
+    service = layer(PackFileService(str(tmpdir)))
+    filename = service.create("secret")
+    assert os.listdir(str(tmpdir / sidecars)) != []
+
+    service.remove(filename)
+    assert os.listdir(str(tmpdir / sidecars)) == []
+    assert service.ls() == []
+
+
+def test_sidecar_gc_keeps_sidecars_of_packed_files(pack_config, mocker, tmpdir):
+    from src.file_service import SidecarCollector
+    mocker.patch("src.config.Config.gc_min_age").return_value = 0
+    service = SignedFileService(PackFileService(str(tmpdir)))
+    service.create("kept")
+    assert SidecarCollector(str(tmpdir)).collect() == (1, 0)
@@ -0,0 +1,211 @@
+import os
+import pytest
+from src.file_service.pack_store import PackStore, HEADER
+
+
+def _open(tmpdir, segment_size=1024, checkpoint_interval=1000):
+    return PackStore(str(tmpdir / "pack"), segment_size, checkpoint_interval)
+
+
+def test_put_get_delete(tmpdir):
+    store = _open(tmpdir)
+    store.put("a", b"first")
+    store.put("a", b"second")
+    store.put("b", b"\x00\xff")
+
+    assert store.get("a") == b"second"
+    assert store.get("b") == b"\x00\xff"
+    assert store.delete("a") is True
+    assert store.delete("a") is False
+    with pytest.raises(KeyError):
+        store.get("a")
+    store.close()
+
+
+def test_replay_without_checkpoint(tmpdir):
+    store = _open(tmpdir)
+    store.put("a", b"data")
+    store.chmod("a", 0o600)
+    store.put("b", b"gone")
+    store.delete("b")
+    store._writer.close()
+    store._owner.close()
+
+    store = _open(tmpdir)
+    assert store.names() == ["a"]
+    assert store.get("a") == b"data"
+    assert store.stat("a").mode == 0o600
+    store.close()
+
+
+def test_checkpoint_and_later_records(tmpdir):
+    store = _open(tmpdir, checkpoint_interval=2)
+    store.put("a", b"1")
+    store.put("b", b"2")
+    store.put("c", b"3")
+    store._checkpointer.join()
+    assert os.path.exists(str(tmpdir / "pack" / "checkpoint.json"))
+    store._writer.close()
+    store._owner.close()
+
+    store = _open(tmpdir)
+    assert sorted(store.names()) == ["a", "b", "c"]
+    assert store.get("c") == b"3"
+    store.close()
+
+
+def test_invalid_checkpoint_replays_segments(tmpdir):
+    store = _open(tmpdir)
+    store.put("a", b"data")
+    store.close()
+    with open(str(tmpdir / "pack" / "checkpoint.json"), "w") as file:
+        file.write('{"segment": 0, "entr')
+
+    store = _open(tmpdir)
+    assert store.get("a") == b"data"
+    store.close()
+
+
+def test_torn_record_is_cut_off(tmpdir):
+    store = _open(tmpdir)
+    store.put("a", b"data")
+    store._writer.write(HEADER.pack(b"PACK", 1, 0o644, 1, 100, 0, 0) + b"b" + b"short")
+    store._writer.close()
+    store._owner.close()
+
+    store = _open(tmpdir)
+    assert store.names() == ["a"]
+    store.put("b", b"after")
+    store._writer.close()
+    store._owner.close()
+
+    store = _open(tmpdir)
+    assert store.get("b") == b"after"
+    store.close()
+
+
+def test_compaction_keeps_live_objects(tmpdir):
+    store = _open(tmpdir, segment_size=200)
+    for name in "abcdef":
+        store.put(name, name.encode() * 40)
+    for name in "abcde":
+        store.delete(name)
+    segments = len(store.segments())
+
+    compacted = store.compact(0.5)
+    assert compacted is not None
+    assert compacted not in store.segments()
+    while store.compact(0.5) is not None:
+        pass
+    assert len(store.segments()) < segments
+    assert store.names() == ["f"]
+    assert store.get("f") == b"f" * 40
+    store.close()
+
+    store = _open(tmpdir, segment_size=200)
+    assert store.names() == ["f"]
+    store.close()
+
+
+def test_store_is_locked(tmpdir):
+    store = _open(tmpdir)
+    with pytest.raises(RuntimeError):
+        _open(tmpdir)
+    store.close()
+    _open(tmpdir).close()
+    assert os.path.exists(str(tmpdir / "pack" / "checkpoint.json"))
+
+
+def test_segment_of_live_small_objects_is_not_garbage(tmpdir):
+    store = _open(tmpdir, segment_size=200)
+    for name in "abcdefgh":
+        store.put(name, b"x")
+    sealed = [segment for segment in store.segments() if segment != store.active]
+
+    assert sealed
+    assert all(store.garbage_ratio(segment) == 0 for segment in sealed)
+    assert store.compact(0.5) is None
+    store.close()
+
+
+def test_damaged_record_of_sealed_segment_is_skipped(tmpdir):
+    store = _open(tmpdir, segment_size=200)
+    for name in "abcdefgh":
+        store.put(name, name.encode() * 10)
+    first = store.segments()[0]
+    damaged = store.stat("a")
+    store._writer.close()
+    store._owner.close()
+    path = str(tmpdir / "pack" / f"{first:08d}.pack")
+    size = os.path.getsize(path)
+    with open(path, "r+b") as file:
+        file.seek(damaged.offset)
+        file.write(b"X")
+
+    store = _open(tmpdir, segment_size=200)
+    assert os.path.getsize(path) == size
+    assert "a" not in store.names()
+    assert store.get("b") == b"b" * 10
+    assert store.get("h") == b"h" * 10
+    store.close()
+
+
+def test_damaged_header_of_sealed_segment_raises(tmpdir):
+    store = _open(tmpdir, segment_size=200)
+    for name in "abcdefgh":
+        store.put(name, name.encode() * 10)
+    first = store.segments()[0]
+    store._writer.close()
+    store._owner.close()
+    with open(str(tmpdir / "pack" / f"{first:08d}.pack"), "r+b") as file:
+        file.write(b"JUNK")
+
+    with pytest.raises(ValueError, match="Broken record header"):
+        _open(tmpdir, segment_size=200)
+
+
+def test_writers_sync_outside_of_lock(tmpdir, mocker):
+    import threading
+    import time
+    store = _open(tmpdir)
+    active, overlapped = [0], []
+    lock = threading.Lock()
+
+    def sync(self, *fds):
+        with lock:
+            active[0] += 1
+        time.sleep(0.05)
+        with lock:
+            overlapped.append(active[0])
+            active[0] -= 1
+    mocker.patch("src.file_service.durability.Durability.sync", sync)
+    threads = [threading.Thread(target=store.put, args=(name, b"data")) for name in "abcd"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(overlapped) > 1
+    assert sorted(store.names()) == ["a", "b", "c", "d"]
+    store.close()
+
+
+def test_put_stream_and_reserve(tmpdir):
+    store = _open(tmpdir, segment_size=64)
+    store.put("small", b"x")
+    chunks = [bytes([index]) * 50 for index in range(10)]
+
+    assert store.reserve("big")
+    assert not store.reserve("big")
+    assert not store.reserve("small")
+    store.put_stream("big", iter(chunks))
+    store.release("big")
+    assert store.get("big") == b"".join(chunks)
+    # spool is gone
+    assert all(name == "LOCK" or name.endswith(".pack") for name in os.listdir(str(tmpdir / "pack")))
+    store._writer.close()
+    store._owner.close()
+
+    store = _open(tmpdir, segment_size=64)
+    assert store.get("big") == b"".join(chunks)
+    store.close()
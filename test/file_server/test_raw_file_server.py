@@ -1,3 +1,4 @@
+import os
 import pytest
 import mock
 from src import file_service
@@ -14,55 +15,58 @@ def test_list_dir_success_flow(mocker):
     assert res == ["a", "b", "c"]
 
 
-def test_create_file_success(mocker):
-    open_mock = mock_open()
-    mocker.patch("builtins.open", open_mock, create=True)
-    mocker.patch("src.utils.generate_name").return_value = "blabla"
+def test_create_file_success(mocker, tmpdir):
+    mocker.patch("src.utils.generate_random").return_value = "blabla"
 
-    result = file_service.RawFileService().create("bla")
+    result = file_service.RawFileService(str(tmpdir)).create("bla")
 
     assert result == "blabla"
-    open_mock.assert_called_with("blabla", "w")
-    open_mock().write.assert_called_with("bla")
+    assert (tmpdir / "blabla").read() == "bla"
+    assert [path.basename for path in tmpdir.listdir()] == ["blabla"]
 
 
-def test_create_file_with_existing_dir_name(mocker):
-    open_mock = mock_open()
-    mocker.patch("builtins.open", open_mock, create=True)
-    generate_name_mock = mocker.patch("src.utils.utils.generate_random")
-    mocker.patch("os.path.isfile").side_effect = iter([False, False])
-    mocker.patch("os.path.isdir").side_effect = iter([True, False])
+def test_create_file_with_existing_dir_name(mocker, tmpdir):
+    tmpdir.mkdir("taken")
+    generate_name_mock = mocker.patch("src.utils.generate_random")
+    generate_name_mock.side_effect = iter(["taken", "free"])
 
-    file_service.RawFileService().create("bla")
+    result = file_service.RawFileService(str(tmpdir)).create("bla")
 
+    assert result == "free"
     assert generate_name_mock.call_count == 2
-    open_mock.assert_called_once()
 
 
-def test_create_file_with_existing_file_name(mocker):
-    open_mock = mock_open()
-    mocker.patch("builtins.open", open_mock, create=True)
-    generate_name_mock = mocker.patch("src.utils.utils.generate_random")
-    mocker.patch("os.path.isfile").side_effect = iter([True, False])
-    mocker.patch("os.path.isdir").side_effect = iter([False, False])
+def test_create_file_with_existing_file_name(mocker, tmpdir):
+    (tmpdir / "taken").write("data")
+    generate_name_mock = mocker.patch("src.utils.generate_random")
+    generate_name_mock.side_effect = iter(["taken", "free"])
 
-    file_service.RawFileService().create("bla")
+    result = file_service.RawFileService(str(tmpdir)).create("bla")
 
+    assert result == "free"
+    assert (tmpdir / "taken").read() == "data"
     assert generate_name_mock.call_count == 2
-    open_mock.assert_called_once()
 
 
-def test_create_file_with_existing_name(mocker):
-    open_mock = mock_open()
-    mocker.patch("builtins.open", open_mock, create=True)
-    generate_name_mock = mocker.patch("src.utils.utils.generate_random")
-    mocker.patch("os.path.isfile").side_effect = iter([True, False, False])
-    mocker.patch("os.path.isdir").side_effect = iter([True, False, False])
+def test_create_file_with_existing_name(mocker, tmpdir):
+    tmpdir.mkdir("dir")
+    (tmpdir / "file").write("data")
+    generate_name_mock = mocker.patch("src.utils.generate_random")
+    generate_name_mock.side_effect = iter(["dir", "file", "free"])
 
-    file_service.RawFileService().create("bla")
+    file_service.RawFileService(str(tmpdir)).create("bla")
 
     assert generate_name_mock.call_count == 3
-    open_mock.assert_called_once()
+
+
+def test_create_file_failed_write(mocker, tmpdir):
+    mocker.patch("src.utils.generate_random").return_value = "blabla"
+    mocker.patch("os.replace").side_effect = OSError("disk full")
+
+    with pytest.raises(OSError):
+        file_service.RawFileService(str(tmpdir)).create("bla")
+
+    assert tmpdir.listdir() == []
 
 
 def test_read_file_success(mocker):
@@ -73,7 +77,7 @@ def test_read_file_success(mocker):
     result = file_service.RawFileService().read("bla")
 
     assert result == "blabla"
-    open_mock.assert_called_with("bla", "r")
+    open_mock.assert_called_with(os.path.join(os.getcwd(), "bla"), "r")
 
 
 def test_read_non_existing_file(mocker):
@@ -115,7 +119,7 @@ def test_delete_success(mocker):
     result = file_service.RawFileService().remove("bla")
 
     assert result is True
-    delete_mock.assert_called_with("bla")
+    delete_mock.assert_called_with(os.path.join(os.getcwd(), "bla"))
 
 
 def test_delete_non_existing_file(mocker):
@@ -151,20 +155,54 @@ def test_delete_directory(mocker):
 def test_cd_success(mocker):
     ch_dir = mocker.patch("os.chdir")
     mocker.patch("os.path.isdir").return_value = True
+    raw_file_service = file_service.RawFileService()
 
-    result = file_service.RawFileService().cd("bla")
+    result = raw_file_service.cd("bla")
 
     assert result is True
-    ch_dir.assert_called_with("bla")
+    assert raw_file_service.workdir == os.path.join(os.getcwd(), "bla")
+    ch_dir.assert_not_called()
 
 
 def test_cd_not_existing_directory(mocker):
     ch_dir = mocker.patch("os.chdir")
     mocker.patch("os.path.isdir").return_value = False
+    raw_file_service = file_service.RawFileService()
+
+    with pytest.raises(ValueError):
+        assert raw_file_service.cd("bla")
+    assert raw_file_service.workdir == os.getcwd()
+    ch_dir.assert_not_called()
+
+
+def test_cd_outside_of_root(mocker):
+    mocker.patch("os.path.isdir").return_value = True
+    raw_file_service = file_service.RawFileService("root")
+
+    with pytest.raises(ValueError):
+        assert raw_file_service.cd("..")
+    assert raw_file_service.workdir == os.path.join(os.getcwd(), "root")
+
+
+def test_cd_is_per_instance(mocker):
+    mocker.patch("os.path.isdir").return_value = True
+    first = file_service.RawFileService()
+    second = file_service.RawFileService()
+
+    first.cd("bla")
+
+    assert first.workdir == os.path.join(os.getcwd(), "bla")
+    assert second.workdir == os.getcwd()
+
+
+def test_read_outside_of_root(mocker):
+    open_mock = mocker.patch("builtins.open", new_callable=mock_open, read_data="blabla")
+    mocker.patch("os.path.isfile").return_value = True
+    mocker.patch("os.path.isdir").return_value = False
 
     with pytest.raises(ValueError):
-        assert file_service.RawFileService().cd("bla")
-    ch_dir.assert_called_once()
+        assert file_service.RawFileService("root").read("../bla")
+    open_mock.assert_not_called()
 
 
 def test_set_permissions_success(mocker):
@@ -175,7 +213,7 @@ def test_set_permissions_success(mocker):
     result = file_service.RawFileService().set_permissions("bla", 111)
 
     assert result is True
-    permock.assert_called_with("bla", 111)
+    permock.assert_called_with(os.path.join(os.getcwd(), "bla"), 111)
 
 
 def test_set_permissions_non_existing_file(mocker):
@@ -219,7 +257,7 @@ def test_get_permissions_success(mocker):
     result = file_service.RawFileService().get_permissions("bla")
 
     assert result == oct(True)
-    permock.assert_called_with("bla")
+    permock.assert_called_with(os.path.join(os.getcwd(), "bla"))
 
 
 def test_get_permissions_non_existing_file(mocker):
@@ -267,7 +305,7 @@ def test_get_file_metadata_success(mocker):
     assert result == (file_service.raw_file_service._to_dt(1),
                       file_service.raw_file_service._to_dt(2),
                       3)
-    metadatamock.assert_called_with("bla")
+    metadatamock.assert_called_with(os.path.join(os.getcwd(), "bla"))
 
 
 def test_get_non_existing_file_metadata(mocker):
@@ -289,3 +327,182 @@ def test_get_file_with_dirname_metadata(mocker):
         assert file_service.RawFileService().read_metadata("bla")
     metadatamock.assert_not_called()
 
+
+
+def test_get_etag_success(mocker):
+    statmock = mocker.patch("os.stat")
+    result_mock = mock.Mock()
+    result_mock.st_ino = 10
+    result_mock.st_size = 11
+    result_mock.st_mtime_ns = 12
+    statmock.return_value = result_mock
+    mocker.patch("os.path.isfile").return_value = True
+    mocker.patch("os.path.isdir").return_value = False
+
+    result = file_service.RawFileService().get_etag("bla")
+
+    assert result == "a-b-c"
+    statmock.assert_called_with(os.path.join(os.getcwd(), "bla"))
+
+
+def test_get_etag_non_existing_file(mocker):
+    statmock = mocker.patch("os.stat")
+    mocker.patch("os.path.isfile").return_value = False
+    mocker.patch("os.path.isdir").return_value = False
+
+    with pytest.raises(ValueError):
+        assert file_service.RawFileService().get_etag("bla")
+    statmock.assert_not_called()
+
+
+def test_scan_page_after_cursor(tmpdir):
+    for name in ("d", "a", "c", "b"):
+        (tmpdir / name).write("data")
+
+    result = list(file_service.RawFileService(str(tmpdir)).scan(cursor="a", limit=2))
+
+    assert result == [{"name": "b"}, {"name": "c"}]
+
+
+def test_scan_details(tmpdir):
+    (tmpdir / "file").write("data")
+    tmpdir.mkdir("dir")
+
+    result = sorted(file_service.RawFileService(str(tmpdir)).scan(details=True), key=lambda entry: entry["name"])
+
+    assert result[0] == {"name": "dir", "type": "dir"}
+    assert result[1]["type"] == "file"
+    assert result[1]["size"] == 4
+    assert "mtime" in result[1]
+
+
+def test_scan_hidden(tmpdir):
+    (tmpdir / "file").write("data")
+    tmpdir.mkdir("sigs")
+
+    result = list(file_service.RawFileService(str(tmpdir)).scan(hidden={str(tmpdir / "sigs")}))
+
+    assert result == [{"name": "file"}]
+
+
+@pytest.fixture()
+def dedup_config(mocker, tmpdir):
+    mocker.patch("src.config.Config.is_deduplicated").return_value = True
+    mocker.patch("src.config.Config.objects_path").return_value = str(tmpdir / "objects")
+
+
+def test_create_deduplicated(dedup_config, tmpdir):
+    service = file_service.RawFileService(str(tmpdir))
+
+    first = service.create("data")
+    second = service.create("data")
+
+    assert first != second
+    assert service.read(first) == service.read(second) == "data"
+    assert service.sidecar_key(first) == service.sidecar_key(second)
+    assert service.sidecar_key(first).startswith("objects" + os.sep)
+
+
+def test_remove_deduplicated(dedup_config, tmpdir):
+    service = file_service.RawFileService(str(tmpdir))
+    first = service.create("data")
+    second = service.create("data")
+    key = service.sidecar_key(first)
+
+    service.remove(first)
+    assert not service.released(key)
+    assert service.read(second) == "data"
+    service.remove(second)
+    assert service.released(key)
+    assert service.ls() == ["objects"]
+
+
+def test_set_permissions_deduplicated(dedup_config, tmpdir):
+    service = file_service.RawFileService(str(tmpdir))
+    first = service.create("data")
+    second = service.create("data")
+    key = service.sidecar_key(second)
+    mode = os.stat(os.path.join(str(tmpdir), key)).st_mode
+
+    service.set_permissions(first, 0o600)
+
+    assert oct(os.stat(service.resolve(first)).st_mode & 0o777) == oct(0o600)
+    assert os.stat(service.resolve(second)).st_mode == os.stat(os.path.join(str(tmpdir), key)).st_mode == mode
+    assert service.sidecar_key(first) == first
+    assert service.read(first) == service.read(second) == "data"
+    service.remove(second)
+    assert service.released(key)
+
+
+def test_set_permissions_deduplicated_keeps_sidecars(dedup_config, mocker, tmpdir):
+    mocker.patch("src.config.Config.sig_path").return_value = str(tmpdir / "sigs")
+    mocker.patch("src.config.Config.key_path").return_value = str(tmpdir / "keys")
+    mocker.patch("src.config.Config.encryption_type").return_value = "aes"
+    service = file_service.SignedFileService(file_service.EncryptedFileService(file_service.RawFileService(str(tmpdir))))
+    first = service.create("data")
+    second = service.create("data")
+
+    service.set_permissions(first, 0o600)
+
+    assert service.read(first) == service.read(second) == "data"
+    service.remove(second)
+    assert service.read(first) == "data"
+
+
+def test_create_from_stream_binary(mocker, tmpdir):
+    mocker.patch("src.config.Config.chunk_size").return_value = 4
+    service = file_service.RawFileService(str(tmpdir))
+    content = bytes(range(256))
+
+    filename = service.create_from_stream(content[i:i + 10] for i in range(0, len(content), 10))
+
+    chunks = list(service.open_read(filename))
+    assert b"".join(chunks) == content
+    assert max(len(chunk) for chunk in chunks) == 4
+
+
+def test_create_from_async_stream(tmpdir):
+    async def chunks():
+        yield b"\xff\x00"
+        yield b"data"
+
+    service = file_service.RawFileService(str(tmpdir))
+    filename = service.create_from_stream(chunks())
+    assert b"".join(service.open_read(filename)) == b"\xff\x00data"
+
+
+def test_create_from_stream_failed(tmpdir):
+    def chunks():
+        yield b"data"
+        raise OSError("connection lost")
+
+    service = file_service.RawFileService(str(tmpdir))
+    with pytest.raises(OSError):
+        service.create_from_stream(chunks())
+    assert service.ls() == []
+
+
+def test_open_read_missing(tmpdir):
+    service = file_service.RawFileService(str(tmpdir))
+    with pytest.raises(ValueError):
+        service.open_read("missing")
+
+
+def test_create_from_stream_deduplicated(dedup_config, tmpdir):
+    service = file_service.RawFileService(str(tmpdir))
+    first = service.create_from_stream([b"da", b"ta"])
+    second = service.create("data")
+
+    assert service.sidecar_key(first) == service.sidecar_key(second)
+    assert b"".join(service.open_read(first)) == b"data"
+    assert sorted(os.listdir(str(tmpdir / "objects"))) == [file_service.blob_store.digest("data")[:2]]
+
+
+def test_open_buffer(tmpdir):
+    service = file_service.RawFileService(str(tmpdir))
+    filename = service.create_from_stream([b"\x00data"])
+    with service.open_buffer(filename) as view:
+        assert view[1:] == b"data"
+    with pytest.raises(ValueError):
+        with service.open_buffer("missing"):
+            pass
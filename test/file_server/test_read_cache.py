@@ -0,0 +1,58 @@
+import sys
+import pytest
+from src.file_service import ReadCache
+from src.utils import Singleton
+
+
+@pytest.fixture()
+def read_cache(mocker):
+    mocker.patch("src.config.Config.read_cache_size").return_value = 2 * sys.getsizeof(b"x" * 100)
+    mocker.patch("src.config.Config.read_cache_max_file_size").return_value = 1024
+    Singleton._instances.pop(ReadCache, None)
+    yield ReadCache()
+    Singleton._instances.pop(ReadCache, None)
+
+
+def test_hit_after_put(read_cache):
+    read_cache.put("a", 1, b"x" * 100)
+
+    assert read_cache.get("a", 1) == b"x" * 100
+    stats = read_cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_ratio"]) == (1, 0, 1.0)
+    assert stats["resident_bytes"] == sys.getsizeof(b"x" * 100)
+
+
+def test_stale_entry_is_dropped(read_cache):
+    read_cache.put("a", 1, b"x" * 100)
+
+    assert read_cache.get("a", 2) is None
+    assert read_cache.stats()["resident_bytes"] == 0
+    assert read_cache.stats()["misses"] == 1
+
+
+def test_evicts_least_recently_used(read_cache):
+    read_cache.put("a", 1, b"a" * 100)
+    read_cache.put("b", 1, b"b" * 100)
+    read_cache.get("a", 1)
+    read_cache.put("c", 1, b"c" * 100)
+
+    assert read_cache.get("b", 1) is None
+    assert read_cache.get("a", 1) == b"a" * 100
+    assert read_cache.stats()["evictions"] == 1
+    assert read_cache.stats()["entries"] == 2
+
+
+def test_large_content_is_not_cached(read_cache):
+    read_cache.put("a", 1, b"x" * 2048)
+
+    assert read_cache.get("a", 1) is None
+    assert read_cache.stats()["entries"] == 0
+
+
+def test_remove(read_cache):
+    read_cache.put("a", 1, "text")
+    read_cache.remove("a")
+    read_cache.remove("b")
+
+    assert read_cache.get("a", 1) is None
+    assert read_cache.stats()["resident_bytes"] == 0
@@ -0,0 +1,111 @@
+import importlib
+import os
+import pytest
+from src.file_service import RawFileService, create_file_service, reshard
+from src.file_service.layout import ShardLayout
+
+
+@pytest.fixture()
+def signed_config(mocker, tmpdir):
+    mocker.patch("src.config.Config.is_signed").return_value = True
+    mocker.patch("src.config.Config.is_encrypted").return_value = False
+    mocker.patch("src.config.Config.sig_path").return_value = str(tmpdir / "sigs")
+    return mocker.patch("src.config.Config.shard_depth")
+
+
+def test_layout_path():
+    layout = ShardLayout(2, 2)
+
+    path = layout.path("dir", "name")
+
+    assert path == os.path.join("dir", "b0", "68", "name")
+
+
+def test_user_directory_is_not_shard(signed_config, tmpdir):
+    signed_config.return_value = 2
+    tmpdir.mkdir("ab")
+    raw_file_service = RawFileService(str(tmpdir))
+    layout = raw_file_service.layout
+    filename = create_file_service(raw_file_service).create("data")
+    shard = os.path.dirname(os.path.dirname(layout.path(str(tmpdir), filename)))
+
+    assert layout.is_shard(shard)
+    assert not layout.is_shard(str(tmpdir / "ab"))
+    assert sorted(raw_file_service.ls()) == sorted([filename, "ab", "sigs"])
+
+
+def test_flat_layout_path():
+    assert ShardLayout(0).path("dir", "name") == os.path.join("dir", "name")
+
+
+def test_create_sharded(signed_config, tmpdir):
+    signed_config.return_value = 2
+    raw_file_service = RawFileService(str(tmpdir))
+    file_service = create_file_service(raw_file_service)
+
+    filename = file_service.create("data")
+
+    path = raw_file_service.layout.path(str(tmpdir), filename)
+    assert os.path.isfile(path)
+    assert os.path.isfile(str(tmpdir / "sigs" / f"{os.path.relpath(path, str(tmpdir))}.md5"))
+    assert file_service.read(filename) == "data"
+    assert sorted(raw_file_service.ls()) == sorted([filename, "sigs"])
+
+
+def test_reshard(signed_config, tmpdir):
+    signed_config.return_value = 0
+    tmpdir.mkdir("sub")
+    flat_file_service = create_file_service(RawFileService(str(tmpdir)))
+    filename = flat_file_service.create("data")
+    flat_file_service.cd("sub")
+    nested_filename = flat_file_service.create("nested")
+
+    signed_config.return_value = 2
+    raw_file_service = RawFileService(str(tmpdir))
+    file_service = create_file_service(raw_file_service)
+
+    assert file_service.read(filename) == "data"
+    assert reshard(raw_file_service) == 2
+    assert reshard(raw_file_service) == 0
+    assert not (tmpdir / filename).exists()
+    assert os.path.isfile(raw_file_service.layout.path(str(tmpdir), filename))
+    assert file_service.read(filename) == "data"
+    file_service.cd("sub")
+    assert file_service.read(nested_filename) == "nested"
+    file_service.remove(nested_filename)
+    assert [path for path in (tmpdir / "sigs" / "sub").visit() if path.isfile()] == []
+
+
+def test_reshard_moves_keys_of_sqlite_keystore(mocker, tmpdir):
+    from src.file_service import SqliteKeystore
+    from src.utils import Singleton
+    shard_depth = mocker.patch("src.config.Config.shard_depth")
+    shard_depth.return_value = 0
+    mocker.patch("src.config.Config.is_signed").return_value = False
+    mocker.patch("src.config.Config.is_encrypted").return_value = True
+    mocker.patch("src.config.Config.encryption_type").return_value = "aes"
+    mocker.patch("src.config.Config.key_path").return_value = str(tmpdir / "keys")
+    mocker.patch("src.config.Config.keystore").return_value = "sqlite"
+    mocker.patch("src.config.Config.keystore_batch_window").return_value = 0
+    Singleton._instances.pop(SqliteKeystore, None)
+    try:
+        filename = create_file_service(RawFileService(str(tmpdir))).create("data")
+        shard_depth.return_value = 2
+        raw_file_service = RawFileService(str(tmpdir))
+        file_service = create_file_service(raw_file_service)
+        link = importlib.import_module("src.file_service.reshard")._link
+        linked_keys = []
+
+        def checked_link(path, target):
+            # online reader finds the key as soon as data is at its new place
+            linked_keys.append(SqliteKeystore().stored(os.path.relpath(target, str(tmpdir))))
+            link(path, target)
+        mocker.patch("src.file_service.reshard._link", checked_link)
+
+        assert reshard(raw_file_service) == 1
+        assert linked_keys and None not in linked_keys
+        assert file_service.read(filename) == "data"
+        with pytest.raises(Exception, match="Encryptor is not found"):
+            SqliteKeystore().find(filename)
+    finally:
+        Singleton._instances.pop(SqliteKeystore, None)
@@ -0,0 +1,62 @@
+import os
+import pytest
+from src.file_service import RawFileService, SignedFileService, SidecarCollector
+
+
+@pytest.fixture()
+def gc_config(mocker, tmpdir):
+    mocker.patch("src.config.Config.sig_path").return_value = str(tmpdir / "sigs")
+    mocker.patch("src.config.Config.key_path").return_value = str(tmpdir / "keys")
+    mocker.patch("src.config.Config.gc_batch_size").return_value = 2
+    min_age = mocker.patch("src.config.Config.gc_min_age")
+    min_age.return_value = 0
+    return min_age
+
+
+@pytest.fixture()
+def service(gc_config, tmpdir):
+    return SignedFileService(RawFileService(str(tmpdir.mkdir("files"))))
+
+
+def _has_sig(tmpdir, filename):
+    return any(name.startswith(f"{filename}.") for name in os.listdir(str(tmpdir / "sigs")))
+
+
+def test_collect_removes_orphans(service, tmpdir):
+    kept = service.create("kept")
+    orphan = service.create("orphan")
+    os.remove(str(tmpdir / "files" / orphan))
+
+    checked, removed = SidecarCollector(str(tmpdir / "files")).collect()
+
+    assert (checked, removed) == (2, 1)
+    assert _has_sig(tmpdir, kept)
+    assert not _has_sig(tmpdir, orphan)
+
+
+def test_young_sidecars_are_kept(service, gc_config, tmpdir):
+    gc_config.return_value = 3600
+    orphan = service.create("orphan")
+    os.remove(str(tmpdir / "files" / orphan))
+
+    assert SidecarCollector(str(tmpdir / "files")).collect() == (1, 0)
+    assert _has_sig(tmpdir, orphan)
+
+
+def test_step_is_bounded_and_resumes(service, tmpdir):
+    for _ in range(3):
+        os.remove(str(tmpdir / "files" / service.create("orphan")))
+    collector = SidecarCollector(str(tmpdir / "files"))
+
+    assert collector.step() == (2, 2, False)
+    assert collector.step() == (1, 1, True)
+    assert os.listdir(str(tmpdir / "sigs")) == []
+
+
+def test_temporary_files_removed_and_foreign_files_kept(gc_config, tmpdir):
+    keys = tmpdir.mkdir("keys")
+    (keys / ".tmp-abc").write("partial")
+    (keys / "key.pem").write("pem")
+
+    assert SidecarCollector(str(tmpdir)).collect() == (1, 1)
+    assert os.listdir(str(keys)) == ["key.pem"]
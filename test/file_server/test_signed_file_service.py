@@ -10,6 +10,12 @@ from mock import mock_open
 def file_service():
     file_service_mock = mock.Mock()
     file_service_mock.workdir = "."
+    file_service_mock.resolve.side_effect = lambda filename: filename
+    file_service_mock.relpath.side_effect = lambda filename: filename
+    file_service_mock.sidecar_key.side_effect = lambda filename: filename
+    file_service_mock.released.return_value = True
+    file_service_mock.content_addressed = False
+    file_service_mock.indexed = False
     return file_service_mock
 
 
@@ -20,133 +26,120 @@ def sig_path_mock(mocker):
     return sig_path_mock
 
 
-def test_read_signed_success(file_service, sig_path_mock, mocker):
-    signers_labels = {"md5": iter([True, False, False]),
-                      "sha512": iter([False, True, False]),
-                      "sha256": iter([False, False, True])}
-    os_exists_mock = mocker.patch("os.path.exists")
+@pytest.fixture()
+def sig_files(file_service, sig_path_mock, mocker, tmpdir):
+    """
+    Sig files in tmpdir, md5 is the configured signer
+    """
+    sig_path_mock.return_value = str(tmpdir)
+    mocker.patch("src.config.Config.signature_algo").return_value = "md5"
+
+    def write(signatures):
+        for path in tmpdir.listdir():
+            path.remove()
+        for label, signature in signatures.items():
+            (tmpdir / f"bla.{label}").write(signature)
+    return write
+
+
+def test_read_signed_success(file_service, sig_files):
     data = "blabla"
-    filename = "bla"
     file_service.read.return_value = data
-    for label in signers_labels:
-        signer = Signature().get_signer_by_label(label)
-        os_exists_mock.side_effect = signers_labels[label]
-        open_mock = mocker.patch("builtins.open", new_callable=mock_open, read_data=signer(data))
+    for label in Signature._registry:
+        sig_files({label: Signature.get_signer_by_label(label)(data)})
 
         result = SignedFileService(file_service).read("bla")
 
         assert result == data
-        file_service.read.assert_called_with(filename)
-        open_mock.assert_called_with(os.path.join(".", f"{filename}.{label}"), "r")
+        file_service.read.assert_called_with("bla")
 
 
-def test_read_signed_file_broken(file_service, sig_path_mock, mocker):
-    signers_labels = {"md5": iter([True, False, False]),
-                      "sha512": iter([False, True, False]),
-                      "sha256": iter([False, False, True])}
-    os_exists_mock = mocker.patch("os.path.exists")
+def test_read_signed_file_broken(file_service, sig_files):
     data = "blabla"
-    filename = "bla"
     file_service.read.return_value = data
+    for label in Signature._registry:
+        sig_files({label: data})
 
-    for label in signers_labels:
-        os_exists_mock.side_effect = signers_labels[label]
-        open_mock = mocker.patch("builtins.open", new_callable=mock_open, read_data=data)
+        with pytest.raises(Exception, match="File is Broken"):
+            SignedFileService(file_service).read("bla")
 
-        with pytest.raises(Exception):
-            assert SignedFileService(file_service).read("bla")
 
-        file_service.read.assert_called_with(filename)
-        open_mock.assert_called_with(os.path.join(".", f"{filename}.{label}"), "r")
+def test_read_signed_file_is_missing(file_service, sig_files):
+    file_service.read.return_value = "blabla"
+    sig_files({})
 
+    with pytest.raises(Exception, match="Signer is not found"):
+        SignedFileService(file_service).read("bla")
 
-def test_read_signed_file_is_missing(file_service, sig_path_mock, mocker):
-    os_exists_mock = mocker.patch("os.path.exists")
+
+def test_read_signed_file_when_all_sig_files_exists(file_service, sig_files):
     data = "blabla"
-    filename = "bla"
     file_service.read.return_value = data
-    for label in ("md5", "sha512", "sha256"):
-        os_exists_mock.return_value = False
-        signer = Signature().get_signer_by_label(label)
-        open_mock = mocker.patch("builtins.open", new_callable=mock_open, read_data=signer(data))
+    sig_files({label: Signature.get_signer_by_label(label)(data) for label in Signature._registry})
 
-        with pytest.raises(Exception):
-            assert SignedFileService(file_service).read("bla")
+    # sig file of configured signer is read without probing
+    assert SignedFileService(file_service).read("bla") == data
 
-        file_service.read.assert_called_with(filename)
-        open_mock.assert_not_called()
 
-
-def test_read_signed_file_when_all_sig_files_exists(file_service, sig_path_mock, mocker):
-    os_exists_mock = mocker.patch("os.path.exists")
+def test_read_signed_file_when_other_sig_files_exists(file_service, sig_files):
     data = "blabla"
-    filename = "bla"
     file_service.read.return_value = data
-    for label in ("md5", "sha512", "sha256"):
-        os_exists_mock.return_value = True
-        signer = Signature().get_signer_by_label(label)
-        open_mock = mocker.patch("builtins.open", new_callable=mock_open, read_data=signer(data))
-
-        with pytest.raises(Exception):
-            assert SignedFileService(file_service).read("bla")
+    sig_files({label: Signature.get_signer_by_label(label)(data) for label in ("sha512", "sha256")})
 
-        file_service.read.assert_called_with(filename)
-        open_mock.assert_not_called()
+    with pytest.raises(Exception, match="More than one signer"):
+        SignedFileService(file_service).read("bla")
 
 
-def test_read_signed_file_when_other_sig_files_exists(file_service, sig_path_mock, mocker):
-    signers_labels = {"md5": iter([False, True, False]),
-                      "sha512": iter([True, False, False]),
-                      "sha256": iter([True, False, False])}
-    os_exists_mock = mocker.patch("os.path.exists")
+def test_read_signed_does_not_probe_configured_signer(file_service, sig_files, mocker):
     data = "blabla"
-    filename = "bla"
     file_service.read.return_value = data
-    for label in signers_labels:
-        os_exists_mock.side_effect = signers_labels[label]
-        signer = Signature().get_signer_by_label(label)
-        open_mock = mocker.patch("builtins.open", new_callable=mock_open, read_data=signer(data))
+    sig_files({"md5": Signature.get_signer_by_label("md5")(data)})
+    service = SignedFileService(file_service)
+    exists_mock = mocker.patch("os.path.exists")
 
-        with pytest.raises(Exception):
-            assert SignedFileService(file_service).read("bla")
+    assert service.read("bla") == data
+    exists_mock.assert_not_called()
 
-        file_service.read.assert_called_with(filename)
-        open_mock.assert_called_once()
 
-
-def test_create_signed_success(file_service, sig_path_mock, mocker):
+def test_create_signed_success(file_service, sig_path_mock, mocker, tmpdir):
     data = "blabla"
     filename = "bla"
-    open_mock = mock_open()
-    file_service.create.return_value = filename
+    sig_path_mock.return_value = str(tmpdir)
+    file_service.new_name.return_value = filename
     algo_mock = mocker.patch("src.config.Config.signature_algo")
     for label in ("md5", "sha512", "sha256"):
         signer = Signature().get_signer_by_label(label)
         algo_mock.return_value = label
-        mocker.patch("builtins.open", open_mock, create=True)
 
         result = SignedFileService(file_service).create(data)
 
         assert result == filename
-        open_mock.assert_called_with(os.path.join(".", f"{filename}.{label}"), "w")
-        open_mock().write.assert_called_with(signer(data))
-        file_service.create.assert_called_with(data)
+        assert (tmpdir / f"{filename}.{label}").read() == signer(data)
+        file_service.write_data.assert_called_with(filename, filename, data)
+
 
+def test_create_signed_failed_write(file_service, sig_path_mock, tmpdir):
+    sig_path_mock.return_value = str(tmpdir)
+    file_service.new_name.return_value = "bla"
+    file_service.write_data.side_effect = OSError("disk full")
 
-def test_remove_success(file_service, sig_path_mock, mocker):
-    signers_labels = {"md5": iter([True, False, False]),
-                      "sha512": iter([False, True, False]),
-                      "sha256": iter([False, False, True])}
+    with pytest.raises(OSError):
+        SignedFileService(file_service).create("blabla")
+
+    file_service.discard.assert_called_with("bla")
+    assert tmpdir.listdir() == []
+
+
+def test_remove_success(file_service, sig_files, tmpdir):
     file_service.remove.return_value = True
-    os_exists_mock = mocker.patch("os.path.exists")
-    filename = "bla"
-    for label in signers_labels:
-        os_exists_mock.side_effect = signers_labels[label]
+    for label in Signature._registry:
+        sig_files({label: "digest"})
 
-        SignedFileService(file_service).remove(filename)
+        SignedFileService(file_service).remove("bla")
 
-        file_service.remove.assert_any_call(filename)
-        file_service.remove.assert_any_call(os.path.join(".", f"{filename}.{label}"))
+        file_service.remove.assert_called_once_with("bla")
+        assert tmpdir.listdir() == []
+        file_service.remove.reset_mock()
 
 
 def test_remove_sig_file_doesnt_exists(file_service, sig_path_mock, mocker):
@@ -163,11 +156,13 @@ def test_remove_sig_file_doesnt_exists(file_service, sig_path_mock, mocker):
 
 
 def test_remove_other_sig_file_exists(file_service, sig_path_mock,mocker):
-    signers_labels = {"md5": iter([False, True, False]),
-                      "sha512": iter([True, False, False]),
-                      "sha256": iter([True, False, False])}
+    signers_labels = {"md5": iter([False, True, False, False]),
+                      "sha512": iter([True, False, False, False]),
+                      "sha256": iter([True, False, False, False]),
+                      "sha256tree": iter([True, False, False, False])}
     file_service.remove.return_value = True
     os_exists_mock = mocker.patch("os.path.exists")
+    mocker.patch("os.remove")
     filename = "bla"
     for label in signers_labels:
         os_exists_mock.side_effect = signers_labels[label]
@@ -188,3 +183,72 @@ def test_remove_when_all_sig_files_exists(file_service, sig_path_mock, mocker):
             SignedFileService(file_service).remove(filename)
 
         file_service.remove.assert_called_with(filename)
+
+
+def test_get_etag_from_signature(file_service, sig_files):
+    for label in Signature._registry:
+        sig_files({label: "digest"})
+
+        result = SignedFileService(file_service).get_etag("bla")
+
+        assert result == f"{label}-digest"
+        file_service.read.assert_not_called()
+
+
+def test_open_read_signed_broken(sig_path_mock, tmpdir):
+    from src.file_service import RawFileService
+    sig_path_mock.return_value = str(tmpdir / "sigs")
+    service = SignedFileService(RawFileService(str(tmpdir.mkdir("files"))))
+    filename = service.create_from_stream([b"bla", b"bla"])
+    assert b"".join(service.open_read(filename)) == b"blabla"
+    with open(str(tmpdir / "files" / filename), "wb") as file:
+        file.write(b"broken")
+
+    with pytest.raises(Exception, match="File is Broken"):
+        b"".join(service.open_read(filename))
+
+
+def test_remove_on_encrypted_stack(sig_path_mock, mocker, tmpdir):
+    from src.file_service import EncryptedFileService, RawFileService
+    sig_path_mock.return_value = str(tmpdir / "sigs")
+    mocker.patch("src.config.Config.key_path").return_value = str(tmpdir / "keys")
+    mocker.patch("src.config.Config.encryption_type").return_value = "aes"
+    service = SignedFileService(EncryptedFileService(RawFileService(str(tmpdir))))
+    filename = service.create("data")
+
+    service.remove(filename)
+
+    assert [path for path in tmpdir.visit() if path.isfile()] == []
+
+
+def test_signers_are_shared():
+    assert Signature.get_signer_by_label("sha256") is Signature.get_signer_by_label("sha256")
+    assert Signature().get_default_signer() is Signature.get_signer_by_label(Signature().get_default_signer().label)
+    assert Signature.get_signer_by_label("unknown") is None
+
+
+@pytest.mark.parametrize("cpu_workers", [0, 2])
+@pytest.mark.parametrize("size", [0, 64, 200, 256])
+def test_tree_hash_does_not_depend_on_chunks_and_workers(mocker, cpu_workers, size):
+    import hashlib
+    from src.executor import Executor
+    from src.utils import Singleton
+    mocker.patch("src.crypto.signature.TREE_SEGMENT_SIZE", 64)
+    mocker.patch("src.config.Config.cpu_workers").return_value = cpu_workers
+    mocker.patch("src.config.Config.parallel_threshold").return_value = 128
+    Singleton._instances.pop(Executor, None)
+    data = os.urandom(size)
+    leaves = [hashlib.sha256(b"\x00" + data[offset:offset + 64]).digest() for offset in range(0, max(size, 1), 64)]
+    expected = hashlib.sha256(b"\x01" + size.to_bytes(8, "big") + b"".join(leaves)).hexdigest()
+    signer = Signature.get_signer_by_label("sha256tree")
+    signatures = []
+    try:
+        assert signer(data) == expected
+        chunks = [data[offset:offset + 50] for offset in range(0, size, 50)]
+        assert b"".join(signer.sign_stream(chunks, signatures.append)) == data
+        assert signatures == [expected]
+        assert list(signer.verify_stream(chunks, expected)) == chunks
+    finally:
+        if Executor().cpu_pool is not None:
+            Executor().cpu_pool.shutdown()
+        Singleton._instances.pop(Executor, None)
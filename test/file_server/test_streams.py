@@ -0,0 +1,55 @@
+import pytest
+from src.file_service.streams import read_chunks, map_file, iterate
+
+
+@pytest.fixture()
+def mmap_threshold_mock(mocker):
+    mmap_threshold_mock = mocker.patch("src.config.Config.mmap_threshold")
+    mmap_threshold_mock.return_value = 8
+    return mmap_threshold_mock
+
+
+def _file(tmpdir, content):
+    path = tmpdir / "file"
+    path.write_binary(content)
+    return str(path)
+
+
+def test_read_chunks_small_file(mmap_threshold_mock, tmpdir):
+    chunks = list(read_chunks(_file(tmpdir, b"data"), chunk_size=3))
+    assert chunks == [b"dat", b"a"]
+    assert all(isinstance(chunk, bytes) for chunk in chunks)
+
+
+def test_read_chunks_mapped_file(mmap_threshold_mock, tmpdir):
+    content = bytes(range(100))
+    chunks = read_chunks(_file(tmpdir, content), chunk_size=30)
+    first = next(chunks)
+    assert isinstance(first, memoryview)
+    assert b"".join([first, *chunks]) == content
+
+
+def test_read_chunks_mmap_disabled(mmap_threshold_mock, tmpdir):
+    mmap_threshold_mock.return_value = 0
+    chunks = list(read_chunks(_file(tmpdir, bytes(100)), chunk_size=30))
+    assert all(isinstance(chunk, bytes) for chunk in chunks)
+
+
+def test_map_file_is_closed(tmpdir):
+    with map_file(_file(tmpdir, b"data")) as view:
+        assert view == b"data"
+    with pytest.raises(ValueError):
+        view.tobytes()
+
+
+def test_map_empty_file(tmpdir):
+    with map_file(_file(tmpdir, b"")) as view:
+        assert len(view) == 0
+
+
+def test_iterate_async():
+    async def chunks():
+        yield b"a"
+        yield b"b"
+
+    assert list(iterate(chunks())) == [b"a", b"b"]
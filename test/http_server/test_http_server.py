@@ -1,7 +1,9 @@
 import json
 import pytest
+from src.config import Config
 from src.http_server import create_web_app
-from src.user_service import UserService
+from src.user_service import SessionCache, UserService
+from src.utils import Singleton
 
 
 @pytest.fixture()
@@ -43,6 +45,22 @@ async def client_server(aiohttp_client, tmpdir):
     return client, server
 
 
+@pytest.fixture()
+def web_client(aiohttp_client, tmpdir, mocker):
+    """
+    Connect to web app on tmpdir with new session, keyword arguments are return values of patched Config methods
+
+    :return: async function returning tuple (client, headers)
+    """
+    async def connect(auto_decompress=True, **config):
+        for name, value in config.items():
+            mocker.patch(f"src.config.Config.{name}").return_value = value
+        client = await aiohttp_client(create_web_app(str(tmpdir)), auto_decompress=auto_decompress)
+        headers = {'Authorization': str(UserService().add_session("test", "test"))}
+        return client, headers
+    return connect
+
+
 @pytest.fixture()
 def raw_file_service(mocker):
     config = mocker.patch("src.config.Config")
@@ -156,7 +174,7 @@ async def test_raw_check_pwd(client_server_with_raw_file_service, tmpdir):
     data = data.decode()
     data = json.loads(data)
     assert "working_directory" in data
-    assert data["working_directory"] == str(tmpdir)
+    assert data["working_directory"] == "."
 
 
 async def test_raw_check_write(client_server_with_raw_file_service, tmpdir):
@@ -177,7 +195,7 @@ async def test_raw_read_file(client_server_with_raw_file_service, tmpdir):
     with test_file.open("w") as f:
         f.write("data")
     client, _, headers = client_server_with_raw_file_service
-    responce = await client.get(f'/read?filename={str(test_file)}', headers=headers)
+    responce = await client.get(f'/read?filename={str(test_file)}&format=json', headers=headers)
     assert responce.status == 200
     data = b''
     while not responce.content.at_eof():
@@ -238,7 +256,7 @@ async def test_encrypted_check_pwd(client_server_with_encrypted_file_service, tm
     data = data.decode()
     data = json.loads(data)
     assert "working_directory" in data
-    assert data["working_directory"] == str(tmpdir)
+    assert data["working_directory"] == "."
 
 
 async def test_encrypted_check_write(client_server_with_encrypted_file_service, tmpdir):
@@ -259,7 +277,7 @@ async def test_encrypted_read_file(client_server_with_encrypted_file_service, tm
     with test_file.open("w") as f:
         f.write("data")
     client, _, headers = client_server_with_encrypted_file_service
-    responce = await client.get(f'/read?filename={str(test_file)}', headers=headers)
+    responce = await client.get(f'/read?filename={str(test_file)}&format=json', headers=headers)
     assert responce.status == 200
     data = b''
     while not responce.content.at_eof():
@@ -320,7 +338,7 @@ async def test_signed_check_pwd(client_server_with_signed_file_service, tmpdir):
     data = data.decode()
     data = json.loads(data)
     assert "working_directory" in data
-    assert data["working_directory"] == str(tmpdir)
+    assert data["working_directory"] == "."
 
 
 async def test_signed_check_write(client_server_with_signed_file_service, tmpdir):
@@ -341,7 +359,7 @@ async def test_signed_read_file(client_server_with_signed_file_service, tmpdir):
     with test_file.open("w") as f:
         f.write("data")
     client, _, headers = client_server_with_signed_file_service
-    responce = await client.get(f'/read?filename={str(test_file)}', headers=headers)
+    responce = await client.get(f'/read?filename={str(test_file)}&format=json', headers=headers)
     assert responce.status == 200
     data = b''
     while not responce.content.at_eof():
@@ -402,7 +420,7 @@ async def test_signed_and_encrypted_check_pwd(client_server_with_encrypted_and_s
     data = data.decode()
     data = json.loads(data)
     assert "working_directory" in data
-    assert data["working_directory"] == str(tmpdir)
+    assert data["working_directory"] == "."
 
 
 async def test_signed_and_encrypted_check_write(client_server_with_encrypted_and_signed_file_service, tmpdir):
@@ -423,7 +441,7 @@ async def test_encrypted_and_signed_read_file(client_server_with_encrypted_and_s
     with test_file.open("w") as f:
         f.write("data")
     client, _, headers = client_server_with_encrypted_and_signed_file_service
-    responce = await client.get(f'/read?filename={str(test_file)}', headers=headers)
+    responce = await client.get(f'/read?filename={str(test_file)}&format=json', headers=headers)
     assert responce.status == 200
     data = b''
     while not responce.content.at_eof():
@@ -498,3 +516,490 @@ async def test_unauth_cd(client_server):
     responce = await client.put(f"/cd?dir=test")
     assert responce.status == 401
 
+
+
+async def test_raw_read_file_stream(client_server_with_raw_file_service, tmpdir):
+    test_file = tmpdir / "test_file"
+    with test_file.open("w") as f:
+        f.write("data")
+    client, _, headers = client_server_with_raw_file_service
+    responce = await client.get(f'/read?filename={str(test_file)}', headers=headers)
+    assert responce.status == 200
+    data = await responce.read()
+    assert data == b"data"
+
+
+async def test_raw_read_file_range(client_server_with_raw_file_service, tmpdir):
+    test_file = tmpdir / "test_file"
+    with test_file.open("w") as f:
+        f.write("0123456789")
+    client, _, headers = client_server_with_raw_file_service
+    headers = dict(headers, Range="bytes=2-5")
+    responce = await client.get(f'/read?filename={str(test_file)}', headers=headers)
+    assert responce.status == 206
+    assert responce.headers["Content-Range"] == "bytes 2-5/10"
+    data = await responce.read()
+    assert data == b"2345"
+
+
+async def test_signed_read_file_range(web_client, tmpdir):
+    client, headers = await web_client(is_signed=True, sig_path=str(tmpdir / "sigs"))
+    responce = await client.post('/write', data=b'0123456789', headers=headers)
+    filename = json.loads(await responce.text())["created_file"]
+    headers["Range"] = "bytes=-3"
+    responce = await client.get(f'/read?filename={filename}', headers=headers)
+    assert responce.status == 206
+    assert responce.headers["Content-Range"] == "bytes 7-9/10"
+    data = await responce.read()
+    assert data == b"789"
+
+
+async def test_signed_read_file_range_not_satisfiable(web_client, tmpdir):
+    client, headers = await web_client(is_signed=True, sig_path=str(tmpdir / "sigs"))
+    responce = await client.post('/write', data=b'0123456789', headers=headers)
+    filename = json.loads(await responce.text())["created_file"]
+    headers["Range"] = "bytes=10-"
+    responce = await client.get(f'/read?filename={filename}', headers=headers)
+    assert responce.status == 416
+    assert responce.headers["Content-Range"] == "bytes */10"
+
+
+async def test_raw_write_too_large(web_client, tmpdir):
+    client, headers = await web_client(max_body_size=4)
+    responce = await client.post('/write', data=b'test data', headers=headers)
+    assert responce.status == 413
+    assert [name for name in tmpdir.listdir() if name.basename.startswith(".upload-")] == []
+
+
+async def test_signed_write_multibyte(web_client, tmpdir):
+    client, headers = await web_client(is_signed=True, sig_path=str(tmpdir / "sigs"), chunk_size=3)
+    content = "привет мир"
+    responce = await client.post('/write', data=content.encode(), headers=headers)
+    assert responce.status == 200
+    filename = json.loads(await responce.text())["created_file"]
+    responce = await client.get(f'/read?filename={filename}&format=json', headers=headers)
+    assert json.loads(await responce.text())["file_content"] == content
+
+
+async def test_session_cache_stats(client_server_with_raw_file_service):
+    client, _, headers = client_server_with_raw_file_service
+    responce = await client.get("/stats", headers=headers)
+    before = json.loads(await responce.text())["session_cache"]
+    responce = await client.get("/stats", headers=headers)
+    after = json.loads(await responce.text())["session_cache"]
+    assert after["hits"] == before["hits"] + 1
+    assert after["misses"] == before["misses"]
+
+
+async def test_logout_drops_cached_session(client_server_with_raw_file_service):
+    client, _, headers = client_server_with_raw_file_service
+    responce = await client.get("/ls", headers=headers)
+    assert responce.status == 200
+    responce = await client.post('/logout', headers=headers)
+    assert responce.status == 200
+    responce = await client.get("/ls", headers=headers)
+    assert responce.status == 401
+
+
+async def test_unauth_stats(client_server):
+    client, _ = client_server
+    responce = await client.get("/stats")
+    assert responce.status == 401
+
+
+async def test_raw_read_json_not_modified(client_server_with_raw_file_service, tmpdir):
+    test_file = tmpdir / "test_file"
+    with test_file.open("w") as f:
+        f.write("data")
+    client, _, headers = client_server_with_raw_file_service
+    responce = await client.get(f'/read?filename={str(test_file)}&format=json', headers=headers)
+    assert responce.status == 200
+    etag = responce.headers["ETag"]
+    assert "Last-Modified" in responce.headers
+    headers = dict(headers, **{"If-None-Match": etag})
+    responce = await client.get(f'/read?filename={str(test_file)}&format=json', headers=headers)
+    assert responce.status == 304
+    assert responce.headers["ETag"] == etag
+
+
+async def test_raw_read_etag_from_file_service(client_server_with_raw_file_service, tmpdir):
+    test_file = tmpdir / "test_file"
+    with test_file.open("w") as f:
+        f.write("data")
+    stat = test_file.stat()
+    client, _, headers = client_server_with_raw_file_service
+    responce = await client.get(f'/read?filename={str(test_file)}', headers=headers)
+    assert responce.status == 200
+    etag = responce.headers["ETag"]
+    assert etag == f'"{stat.ino:x}-{stat.size:x}-{stat.mtime_ns:x}"'
+    headers = dict(headers, **{"If-None-Match": etag})
+    responce = await client.get(f'/read?filename={str(test_file)}', headers=headers)
+    assert responce.status == 304
+    assert responce.headers["ETag"] == etag
+    headers = dict(headers, **{"If-None-Match": '"other"', "If-Match": etag})
+    responce = await client.get(f'/read?filename={str(test_file)}', headers=headers)
+    assert responce.status == 200
+    assert await responce.text() == "data"
+
+
+async def test_read_json_of_binary_file(web_client, tmpdir):
+    client, headers = await web_client(is_signed=True, sig_path=str(tmpdir / "sigs"))
+    responce = await client.post('/write', data=b"\xff\x00binary", headers=headers)
+    filename = json.loads(await responce.text())["created_file"]
+
+    responce = await client.get(f'/read?filename={filename}&format=json', headers=headers)
+    assert responce.status == 415
+    responce = await client.get(f'/read?filename={filename}', headers=headers)
+    assert await responce.read() == b"\xff\x00binary"
+
+
+async def test_raw_read_json_modified(client_server_with_raw_file_service, tmpdir):
+    test_file = tmpdir / "test_file"
+    with test_file.open("w") as f:
+        f.write("data")
+    client, _, headers = client_server_with_raw_file_service
+    responce = await client.get(f'/read?filename={str(test_file)}&format=json', headers=headers)
+    etag = responce.headers["ETag"]
+    with test_file.open("w") as f:
+        f.write("new data")
+    headers = dict(headers, **{"If-None-Match": etag})
+    responce = await client.get(f'/read?filename={str(test_file)}&format=json', headers=headers)
+    assert responce.status == 200
+    assert json.loads(await responce.text())["file_content"] == "new data"
+
+
+async def test_signed_read_etag_from_signature(web_client, tmpdir):
+    client, headers = await web_client(is_signed=True, signature_algo="sha256", sig_path=str(tmpdir / "sigs"))
+    responce = await client.post('/write', data=b'data', headers=headers)
+    filename = json.loads(await responce.text())["created_file"]
+    responce = await client.get(f'/read?filename={filename}', headers=headers)
+    assert responce.status == 200
+    etag = responce.headers["ETag"]
+    assert etag == '"sha256-3a6eb0790f39ac87c94f3856b2dd2c5d110e6811602261a9a923d3bb23adc8b7"'
+    headers["If-None-Match"] = etag
+    responce = await client.get(f'/read?filename={filename}', headers=headers)
+    assert responce.status == 304
+
+
+async def test_raw_read_metadata_not_modified_since(client_server_with_raw_file_service, tmpdir):
+    test_file = tmpdir / "test_file"
+    with test_file.open("w") as f:
+        f.write("data")
+    client, _, headers = client_server_with_raw_file_service
+    responce = await client.get(f'/read_meta?filename={str(test_file)}', headers=headers)
+    assert responce.status == 200
+    headers = dict(headers, **{"If-Modified-Since": responce.headers["Last-Modified"]})
+    responce = await client.get(f'/read_meta?filename={str(test_file)}', headers=headers)
+    assert responce.status == 304
+
+
+async def test_cd_is_per_session(client_server_with_raw_file_service, tmpdir):
+    p = tmpdir.mkdir("test_dir")
+    client, _, headers = client_server_with_raw_file_service
+    other_headers = {'Authorization': str(UserService().add_session("test", "test"))}
+    responce = await client.put("/cd?dir=test_dir", headers=headers)
+    assert responce.status == 200
+    responce = await client.get("/pwd", headers=headers)
+    assert json.loads(await responce.text())["working_directory"] == "test_dir"
+    responce = await client.get("/pwd", headers=other_headers)
+    assert json.loads(await responce.text())["working_directory"] == "."
+
+
+async def test_cd_survives_eviction_of_session(web_client, tmpdir):
+    tmpdir.mkdir("test_dir")
+    client, headers = await web_client(max_sessions=1)
+    other_headers = {'Authorization': str(UserService().add_session("test", "test"))}
+    await client.put("/cd?dir=test_dir", headers=headers)
+    await client.get("/ls", headers=other_headers)
+
+    responce = await client.get("/pwd", headers=headers)
+    assert json.loads(await responce.text())["working_directory"] == "test_dir"
+
+
+async def test_cd_outside_of_root(client_server_with_raw_file_service, tmpdir):
+    client, _, headers = client_server_with_raw_file_service
+    responce = await client.put("/cd?dir=..", headers=headers)
+    assert responce.status == 401
+    responce = await client.get("/pwd", headers=headers)
+    assert json.loads(await responce.text())["working_directory"] == "."
+
+
+async def test_signed_write_in_subdirectory(web_client, tmpdir):
+    tmpdir.mkdir("test_dir")
+    client, headers = await web_client(is_signed=True)
+    await client.put("/cd?dir=test_dir", headers=headers)
+    responce = await client.post('/write', data=b'data', headers=headers)
+    filename = json.loads(await responce.text())["created_file"]
+    assert (tmpdir / "test_dir" / filename).isfile()
+    assert (tmpdir / "test_dir" / f"{filename}.md5").isfile()
+    responce = await client.get(f'/read?filename={filename}', headers=headers)
+    assert await responce.read() == b'data'
+
+
+async def test_metrics(client_server_with_raw_file_service, tmpdir):
+    test_file = tmpdir / "test_file"
+    with test_file.open("w") as f:
+        f.write("data")
+    client, _, headers = client_server_with_raw_file_service
+    await client.get(f'/read?filename={str(test_file)}', headers=headers)
+    await client.get(f'/read?filename={str(test_file)}&format=json', headers=headers)
+    responce = await client.get("/metrics")
+    assert responce.status == 200
+    assert responce.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    data = await responce.text()
+    assert 'http_requests_total{route="/read",status="200"}' in data
+    assert 'http_request_duration_seconds_bucket{route="/read",status="200",le="+Inf"}' in data
+    assert 'http_response_bytes_total{route="/read"}' in data
+    assert 'file_service_duration_seconds_count{layer="raw",operation="get_etag"}' in data
+    assert 'user_service_duration_seconds_count{operation="check_authorization"}' in data
+    assert 'session_cache_hits_total' in data
+
+
+async def test_raw_ls_paginated(client_server_with_raw_file_service, tmpdir):
+    for name in ("a", "b", "c"):
+        (tmpdir / name).write("data")
+    client, _, headers = client_server_with_raw_file_service
+    responce = await client.get("/ls?limit=2", headers=headers)
+    assert responce.status == 200
+    assert responce.headers["Content-Type"] == "application/x-ndjson"
+    assert responce.headers["X-Next-Cursor"] == "b"
+    lines = (await responce.text()).splitlines()
+    assert [json.loads(line)["name"] for line in lines] == ["a", "b"]
+    responce = await client.get("/ls?limit=2&cursor=b", headers=headers)
+    assert "X-Next-Cursor" not in responce.headers
+    lines = (await responce.text()).splitlines()
+    assert [json.loads(line)["name"] for line in lines] == ["c"]
+
+
+async def test_raw_ls_invalid_limit(client_server_with_raw_file_service):
+    client, _, headers = client_server_with_raw_file_service
+    responce = await client.get("/ls?limit=0", headers=headers)
+    assert responce.status == 400
+
+
+async def test_signed_ls_hide_internal(web_client, tmpdir):
+    client, headers = await web_client(is_signed=True, sig_path=str(tmpdir / "sigs"))
+    responce = await client.post('/write', data=b'data', headers=headers)
+    filename = json.loads(await responce.text())["created_file"]
+    responce = await client.get("/ls?details=1", headers=headers)
+    names = {json.loads(line)["name"] for line in (await responce.text()).splitlines()}
+    assert names == {filename, "sigs"}
+    responce = await client.get("/ls?details=1&hide_internal=1", headers=headers)
+    entries = [json.loads(line) for line in (await responce.text()).splitlines()]
+    assert entries == [{"name": filename, "type": "file", "size": 4, "mtime": entries[0]["mtime"]}]
+
+
+async def test_signed_write_deduplicated(web_client, tmpdir):
+    client, headers = await web_client(is_signed=True, is_deduplicated=True,
+                                       sig_path=str(tmpdir / "sigs"), objects_path=str(tmpdir / "objects"))
+    filenames = []
+    for _ in range(2):
+        responce = await client.post('/write', data=b'data', headers=headers)
+        filenames.append(json.loads(await responce.text())["created_file"])
+    signatures = [path for path in (tmpdir / "sigs").visit() if path.isfile()]
+    assert len(signatures) == 1
+    for filename in filenames:
+        responce = await client.get(f'/read?filename={filename}', headers=headers)
+        assert await responce.read() == b'data'
+
+
+async def test_read_metadata_from_index(web_client, tmpdir):
+    (tmpdir / "test_file").write("data")
+    client, headers = await web_client(is_indexed=True, index_path=str(tmpdir / ".metadata.sqlite"))
+    responce = await client.get("/ls", headers=headers)
+    assert json.loads(await responce.text()) == ["test_file"]
+    responce = await client.get("/read_meta?filename=test_file", headers=headers)
+    assert json.loads(await responce.text())["file_size"] == 4
+    headers["If-None-Match"] = responce.headers["ETag"]
+    responce = await client.get("/read_meta?filename=test_file", headers=headers)
+    assert responce.status == 304
+
+
+async def test_signed_binary_write_and_range_read(web_client, tmpdir):
+    client, headers = await web_client(is_signed=True, sig_path=str(tmpdir / "sigs"), chunk_size=16)
+    content = bytes(range(256))
+    responce = await client.post('/write', data=content, headers=headers)
+    assert responce.status == 200
+    filename = json.loads(await responce.text())["created_file"]
+
+    responce = await client.get(f'/read?filename={filename}', headers=headers)
+    assert await responce.read() == content
+    responce = await client.get(f'/read?filename={filename}', headers={**headers, "Range": "bytes=10-40"})
+    assert responce.status == 206
+    assert await responce.read() == content[10:41]
+
+
+async def test_signed_read_broken_is_not_delivered(web_client, tmpdir):
+    import aiohttp
+    client, headers = await web_client(is_signed=True, sig_path=str(tmpdir / "sigs"), chunk_size=4)
+    responce = await client.post('/write', data=b"some content", headers=headers)
+    filename = json.loads(await responce.text())["created_file"]
+    with open(str(tmpdir / filename), "wb") as file:
+        file.write(b"some CONTENT")
+
+    responce = await client.get(f'/read?filename={filename}', headers=headers)
+    with pytest.raises(aiohttp.ClientPayloadError):
+        await responce.read()
+
+
+async def test_signed_range_read_mapped(web_client, tmpdir):
+    client, headers = await web_client(is_signed=True, sig_path=str(tmpdir / "sigs"), chunk_size=16, mmap_threshold=32)
+    content = bytes(range(256)) * 4
+    responce = await client.post('/write', data=content, headers=headers)
+    filename = json.loads(await responce.text())["created_file"]
+
+    responce = await client.get(f'/read?filename={filename}', headers=headers)
+    assert await responce.read() == content
+    responce = await client.get(f'/read?filename={filename}', headers={**headers, "Range": "bytes=100-"})
+    assert await responce.read() == content[100:]
+
+
+async def test_signed_read_cache_stats(web_client, tmpdir):
+    client, headers = await web_client(is_signed=True, sig_path=str(tmpdir / "sigs"))
+    responce = await client.post('/write', data=b"cached content", headers=headers)
+    filename = json.loads(await responce.text())["created_file"]
+    responce = await client.get("/stats", headers=headers)
+    before = json.loads(await responce.text())["read_cache"]
+
+    for _ in range(2):
+        responce = await client.get(f'/read?filename={filename}', headers=headers)
+        assert await responce.read() == b"cached content"
+
+    responce = await client.get("/stats", headers=headers)
+    after = json.loads(await responce.text())["read_cache"]
+    assert after["hits"] == before["hits"] + 1
+    assert after["misses"] == before["misses"] + 1
+
+
+async def test_background_sidecar_gc(web_client, tmpdir):
+    import asyncio
+    import os
+    # temporary files of the write itself are younger than min_age
+    client, headers = await web_client(is_signed=True, sig_path=str(tmpdir / "sigs"),
+                                       is_gc_enabled=True, gc_interval=0.01, gc_min_age=0.1)
+    responce = await client.post('/write', data=b"content", headers=headers)
+    filename = json.loads(await responce.text())["created_file"]
+    os.remove(str(tmpdir / filename))
+
+    for _ in range(300):
+        if not os.listdir(str(tmpdir / "sigs")):
+            break
+        await asyncio.sleep(0.01)
+    assert os.listdir(str(tmpdir / "sigs")) == []
+
+
+async def test_pack_backend_write_read(web_client, tmpdir):
+    from src.file_service import close_pack_stores
+    client, headers = await web_client(backend="pack", pack_path=str(tmpdir / "packs"))
+    try:
+        responce = await client.post('/write', data=b"packed", headers=headers)
+        filename = json.loads(await responce.text())["created_file"]
+
+        responce = await client.get(f'/read?filename={filename}', headers=headers)
+        assert await responce.read() == b"packed"
+        responce = await client.get('/ls?details=1', headers=headers)
+        assert json.loads(await responce.text()) == {"name": filename, "type": "file", "size": 6,
+                                                     "mtime": json.loads(await responce.text())["mtime"]}
+    finally:
+        await client.close()
+        close_pack_stores()
+
+
+@pytest.fixture()
+def compressed_config(mocker, tmpdir):
+    mocker.patch("src.config.Config.is_signed").return_value = True
+    mocker.patch("src.config.Config.sig_path").return_value = str(tmpdir / "sigs")
+    mocker.patch("src.config.Config.is_compressed").return_value = True
+    mocker.patch("src.config.Config.compression_codec").return_value = "zlib"
+    mocker.patch("src.config.Config.chunk_size").return_value = 64
+
+
+async def test_compressed_read_passes_deflate_through(web_client, tmpdir, compressed_config):
+    import os
+    import zlib
+    client, headers = await web_client(auto_decompress=False)
+    content = b"compressible content " * 100
+    responce = await client.post('/write', data=content, headers=headers)
+    filename = json.loads(await responce.text())["created_file"]
+
+    responce = await client.get(f'/read?filename={filename}', headers={**headers, "Accept-Encoding": "deflate"})
+    assert responce.headers["Content-Encoding"] == "deflate"
+    assert responce.headers["Vary"] == "Accept-Encoding"
+    assert responce.headers["ETag"].endswith('-deflate"')
+    assert zlib.decompress(await responce.read()) == content
+    assert os.path.getsize(str(tmpdir / filename)) < len(content)
+
+
+async def test_compressed_read_identity(web_client, compressed_config):
+    client, headers = await web_client(auto_decompress=False)
+    content = b"compressible content " * 100
+    responce = await client.post('/write', data=content, headers=headers)
+    filename = json.loads(await responce.text())["created_file"]
+
+    responce = await client.get(f'/read?filename={filename}', headers={**headers, "Accept-Encoding": "xz;q=0"})
+    assert "Content-Encoding" not in responce.headers
+    assert responce.headers["Content-Length"] == str(len(content))
+    assert await responce.read() == content
+
+    responce = await client.get(f'/read?filename={filename}', headers={**headers, "Range": "bytes=10-19"})
+    assert responce.status == 206
+    assert await responce.read() == content[10:20]
+    responce = await client.get(f'/read_meta?filename={filename}', headers=headers)
+    assert json.loads(await responce.text())["file_size"] == len(content)
+    responce = await client.get('/ls?details=1', headers=headers)
+    entries = [json.loads(line) for line in (await responce.text()).splitlines()]
+    assert [entry["size"] for entry in entries if entry["name"] == filename] == [len(content)]
+
+
+async def test_compressed_read_broken_is_not_delivered(web_client, tmpdir, compressed_config):
+    import aiohttp
+    from src.file_service.compressed_file_service import compress, get_codec
+    client, headers = await web_client(auto_decompress=False)
+    responce = await client.post('/write', data=b"compressible content " * 100, headers=headers)
+    filename = json.loads(await responce.text())["created_file"]
+    with open(str(tmpdir / filename), "wb") as file:
+        file.write(compress(get_codec("zlib").id, 6, b"COMPRESSIBLE CONTENT " * 100))
+
+    for accept_encoding in ("deflate", "identity"):
+        responce = await client.get(f'/read?filename={filename}',
+                                    headers={**headers, "Accept-Encoding": accept_encoding})
+        with pytest.raises(aiohttp.ClientPayloadError):
+            await responce.read()
+
+
+async def test_encrypted_read_file_range(web_client, tmpdir):
+    client, headers = await web_client(is_encrypted=True, key_path=str(tmpdir / "keys"),
+                                       encryption_type="aes", encryption_chunk_size=16)
+    content = bytes(range(200))
+    responce = await client.post('/write', data=content, headers=headers)
+    filename = json.loads(await responce.text())["created_file"]
+
+    responce = await client.get(f'/read?filename={filename}', headers={**headers, "Range": "bytes=40-99"})
+    assert responce.status == 206
+    assert responce.headers["Content-Range"] == "bytes 40-99/200"
+    assert await responce.read() == content[40:100]
+    responce = await client.get(f'/read?filename={filename}', headers=headers)
+    assert responce.headers["Content-Length"] == "200"
+    assert await responce.read() == content
+
+
+async def test_sessions_shared_by_workers(aiohttp_client, tmpdir, mocker):
+    mocker.patch.object(Config(), "config_data", {})
+    Singleton._instances.pop(SessionCache, None)
+    tmpdir.mkdir("test_dir")
+    first = await aiohttp_client(create_web_app(str(tmpdir), shared_sessions=True))
+    second = await aiohttp_client(create_web_app(str(tmpdir), shared_sessions=True))
+    headers = {'Authorization': str(UserService().add_session("test", "test"))}
+    try:
+        responce = await first.put("/cd?dir=test_dir", headers=headers)
+        assert responce.status == 200
+        responce = await second.post('/write', data=b'data', headers=headers)
+        filename = json.loads(await responce.text())["created_file"]
+        assert (tmpdir / "test_dir" / filename).isfile()
+
+        responce = await first.post('/logout', headers=headers)
+        assert responce.status == 200
+        responce = await second.get("/ls", headers=headers)
+        assert responce.status == 401
+    finally:
+        Singleton._instances.pop(SessionCache, None)
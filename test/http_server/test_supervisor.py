@@ -0,0 +1,97 @@
+import os
+import signal
+import time
+import pytest
+from src.config import Config
+from src.http_server import Supervisor, notify_ready
+
+
+def sleeping_worker(ready_fd):
+    notify_ready(ready_fd)
+    time.sleep(60)
+
+
+def failing_worker(ready_fd):
+    raise RuntimeError("broken worker")
+
+
+@pytest.fixture()
+def supervisor():
+    supervisor = Supervisor(2, sleeping_worker, ready_timeout=5, restart_delay=0)
+    yield supervisor
+    supervisor.stop()
+
+
+def wait_exit(supervisor, timeout=5):
+    deadline = time.monotonic() + timeout
+    exited = []
+    while not exited and time.monotonic() < deadline:
+        exited = supervisor.reap()
+        time.sleep(0.05)
+    return exited
+
+
+def test_start_workers(supervisor):
+    supervisor.start()
+    time.sleep(0.5)
+
+    assert supervisor.reap() == []
+    assert len(supervisor.pids) == 2
+
+
+def test_crashed_worker_restarted(supervisor):
+    supervisor.start()
+    crashed = next(iter(supervisor.pids))
+    os.kill(crashed, signal.SIGKILL)
+
+    assert wait_exit(supervisor) == [crashed]
+    assert len(supervisor.pids) == 2
+    assert crashed not in supervisor.pids
+
+
+def test_rolling_reload(supervisor):
+    supervisor.start()
+    old_pids = set(supervisor.pids)
+
+    supervisor.reload()
+
+    assert len(supervisor.pids) == 2
+    assert not old_pids & supervisor.pids
+
+
+def test_reload_aborted_when_worker_not_ready():
+    supervisor = Supervisor(1, sleeping_worker, ready_timeout=5, restart_delay=0)
+    supervisor.start()
+    old_pids = set(supervisor.pids)
+    supervisor.target = failing_worker
+    try:
+        supervisor.reload()
+
+        assert supervisor.pids == old_pids
+    finally:
+        supervisor.stop()
+
+
+def test_reload_reads_config(supervisor, mocker, tmpdir):
+    mocker.patch.object(Config(), "filename", None)
+    mocker.patch.object(Config(), "config_data", {})
+    config_file = tmpdir / "config.ini"
+    config_file.write("[Server]\nmax_sessions = 10\n")
+    Config().load(str(config_file))
+    config_file.write("[Server]\nmax_sessions = 20\n")
+
+    supervisor.reload()
+
+    assert Config().max_sessions() == 20
+
+
+def test_stop(supervisor):
+    supervisor.start()
+    pids = set(supervisor.pids)
+
+    supervisor.stop()
+
+    assert supervisor.pids == set()
+    for pid in pids:
+        with pytest.raises(ProcessLookupError):
+            os.kill(pid, 0)
@@ -0,0 +1,77 @@
+import pytest
+from src.metrics import Counter, Gauge, Histogram, Registry, instrument
+from src.utils import Singleton
+
+
+@pytest.fixture()
+def registry():
+    saved = Singleton._instances.pop(Registry, None)
+    yield Registry()
+    Singleton._instances.pop(Registry, None)
+    if saved:
+        Singleton._instances[Registry] = saved
+
+
+def test_counter_render(registry):
+    counter = Counter("requests_total", "Requests", ("route", "status"))
+    counter.labels("/ls", 200).inc()
+    counter.labels("/ls", 200).inc(2)
+
+    assert registry.render() == ('# HELP requests_total Requests\n'
+                                 '# TYPE requests_total counter\n'
+                                 'requests_total{route="/ls",status="200"} 3\n')
+
+
+def test_labels_child_is_cached(registry):
+    counter = Counter("requests_total", "Requests", ("route",))
+
+    assert counter.labels("/ls") is counter.labels("/ls")
+
+
+def test_label_values_escaped(registry):
+    counter = Counter("requests_total", "Requests", ("route",))
+    counter.labels('a"b\\c\n').inc()
+
+    assert 'requests_total{route="a\\"b\\\\c\\n"} 1' in registry.render()
+
+
+def test_gauge_inc_dec_and_function(registry):
+    gauge = Gauge("in_flight", "In flight", ("route",))
+    gauge.labels("/ls").inc()
+    gauge.labels("/ls").inc()
+    gauge.labels("/ls").dec()
+    gauge.labels("/read").set_function(lambda: 7)
+
+    rendered = registry.render()
+
+    assert 'in_flight{route="/ls"} 1' in rendered
+    assert 'in_flight{route="/read"} 7' in rendered
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = Histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    child = histogram.labels("/ls")
+    child.observe(0.05)
+    child.observe(0.1)
+    child.observe(0.5)
+    child.observe(5)
+
+    rendered = registry.render()
+
+    assert 'latency_seconds_bucket{route="/ls",le="0.1"} 2' in rendered
+    assert 'latency_seconds_bucket{route="/ls",le="1.0"} 3' in rendered
+    assert 'latency_seconds_bucket{route="/ls",le="+Inf"} 4' in rendered
+    assert 'latency_seconds_sum{route="/ls"} 5.65' in rendered
+    assert 'latency_seconds_count{route="/ls"} 4' in rendered
+
+
+def test_instrument_records_duration(registry):
+    histogram = Histogram("duration_seconds", "Duration", ("layer", "operation"))
+
+    @instrument(histogram, ("read",), "raw")
+    class Service:
+        def read(self, value):
+            return value
+
+    assert Service().read(1) == 1
+    assert 'duration_seconds_count{layer="raw",operation="read"} 1' in registry.render()
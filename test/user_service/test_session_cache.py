@@ -0,0 +1,69 @@
+import pytest
+from datetime import datetime, timedelta
+from src.user_service import SessionCache
+from src.utils import Singleton
+
+
+@pytest.fixture()
+def session_cache(mocker):
+    mocker.patch("src.config.Config.session_cache_size").return_value = 2
+    mocker.patch("src.config.Config.session_cache_ttl").return_value = 60
+    Singleton._instances.pop(SessionCache, None)
+    yield SessionCache()
+    Singleton._instances.pop(SessionCache, None)
+
+
+def expires_in(seconds):
+    return datetime.utcnow() + timedelta(seconds=seconds)
+
+
+def test_hit_after_put(session_cache):
+    session_cache.put("a", expires_in(3600))
+
+    assert session_cache.get("a") is True
+    assert session_cache.stats() == {"hits": 1, "misses": 0, "size": 1}
+
+
+def test_miss_unknown_session(session_cache):
+    assert session_cache.get("a") is False
+    assert session_cache.stats() == {"hits": 0, "misses": 1, "size": 0}
+
+
+def test_least_recently_used_evicted(session_cache):
+    session_cache.put("a", expires_in(3600))
+    session_cache.put("b", expires_in(3600))
+    session_cache.get("a")
+    session_cache.put("c", expires_in(3600))
+
+    assert session_cache.get("a") is True
+    assert session_cache.get("b") is False
+    assert session_cache.get("c") is True
+
+
+def test_ttl_expired(session_cache, mocker):
+    session_cache.put("a", expires_in(3600))
+    monotonic = mocker.patch("src.user_service.session_cache.time.monotonic")
+    monotonic.return_value = 10 ** 9
+
+    assert session_cache.get("a") is False
+    assert session_cache.stats()["size"] == 0
+
+
+def test_session_expiration_bounds_ttl(session_cache):
+    session_cache.put("a", expires_in(-1))
+
+    assert session_cache.get("a") is False
+
+
+def test_remove(session_cache):
+    session_cache.put("a", expires_in(3600))
+    session_cache.remove("a")
+
+    assert session_cache.get("a") is False
+
+
+def test_disabled_cache(session_cache):
+    session_cache.size = 0
+    session_cache.put("a", expires_in(3600))
+
+    assert session_cache.get("a") is False